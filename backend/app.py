@@ -7,11 +7,14 @@ import cv2
 import traceback
 from sqlalchemy import create_engine, text
 from PIL import Image
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 from flask_cors import CORS
 import tensorflow as tf
 from tensorflow.keras.models import load_model
 
+from render import heatmap_overlay
+from metrics import Gauge, Histogram, Registry, instrument_app, timed
+
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": [
     "http://localhost:3000", "http://127.0.0.1:3000",
@@ -30,6 +33,8 @@ SCALE_INPUT = True
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(HEATMAP_FOLDER, exist_ok=True)
 
+DEVICE = "gpu" if tf.config.list_logical_devices("GPU") else "cpu"
+
 # DB connection
 engine = create_engine("sqlite:///predictions.db", echo=False)
 
@@ -37,6 +42,15 @@ engine = create_engine("sqlite:///predictions.db", echo=False)
 model = None
 labs = None
 
+# Metrics: GET /metrics (Prometheus text format), Server-Timing header on every response
+metrics = Registry()
+PREDICT_STAGE_SECONDS = metrics.register(
+    Histogram("predict_stage_seconds", "Time spent in each /predict stage", ("stage",)))
+instrument_app(app, metrics, PREDICT_STAGE_SECONDS)
+metrics.register(Gauge("model_info", "Loaded model (value is always 1)", ("path", "framework", "device"),
+                       fn=lambda: {(MODEL_PATH, "tensorflow", DEVICE): 1} if model is not None else {}))
+# no queue-depth gauges: each request runs its model call on its own Flask thread, nothing is queued
+
 
 def load_model_and_labels():
     global model, labs
@@ -50,14 +64,16 @@ def load_model_and_labels():
             labs = json.load(f)
 
 
-def preprocess_image(file_storage):
+def decode_image(file_storage):
     image = Image.open(file_storage.stream).convert("RGB")
-    image = image.resize(IMG_SIZE)
+    return image.resize(IMG_SIZE)
+
+
+def image_to_array(image):
     arr = np.array(image).astype(np.float32)
     if SCALE_INPUT:
         arr = arr / 255.0
-    arr = np.expand_dims(arr, axis=0)
-    return arr, image
+    return np.expand_dims(arr, axis=0)
 
 
 def get_gradcam_heatmap(img_array, model, last_conv_layer_name=LAST_CONV_LAYER_NAME):
@@ -79,21 +95,17 @@ def get_gradcam_heatmap(img_array, model, last_conv_layer_name=LAST_CONV_LAYER_N
 
 
 def overlay_heatmap_on_image(heatmap_np, pil_image, alpha=0.4):
-    rgb = np.array(pil_image)
+    # uint8 LUT blend from render.py; the result is a per-thread buffer, encode it before the next call
+    rgb = np.asarray(pil_image)
     heatmap_resized = cv2.resize(heatmap_np, (rgb.shape[1], rgb.shape[0]))
-    heatmap_uint8 = np.uint8(255 * heatmap_resized)
-    heatmap_color_bgr = cv2.applyColorMap(heatmap_uint8, cv2.COLORMAP_JET)
-    heatmap_color_rgb = cv2.cvtColor(heatmap_color_bgr, cv2.COLOR_BGR2RGB)
-    overlay_rgb = cv2.addWeighted(rgb, 1.0 - alpha, heatmap_color_rgb, alpha, 0)
-    return overlay_rgb
+    return heatmap_overlay(rgb, heatmap_resized, alpha)
 
 
-def encode_rgb_png_base64(rgb_array):
+def encode_rgb_png(rgb_array):
     img_pil = Image.fromarray(rgb_array)
     buf = io.BytesIO()
     img_pil.save(buf, format="PNG")
-    buf.seek(0)
-    return base64.b64encode(buf.read()).decode("utf-8")
+    return buf.getvalue()
 
 
 @app.get("/health")
@@ -143,12 +155,17 @@ def predict():
             return jsonify({"error": "Empty filename"}), 400
 
         print("✅ File received:", file.filename)
+        timings = g.timings
 
         # Preprocess
-        img_array, pil_image = preprocess_image(file)
+        with timed(timings, "decode"):
+            pil_image = decode_image(file)
+        with timed(timings, "preprocess"):
+            img_array = image_to_array(pil_image)
 
         # Predict
-        preds = model.predict(img_array)
+        with timed(timings, "predict"):
+            preds = model.predict(img_array)
         probs = preds.flatten().astype(float)
         pred_idx = int(np.argmax(probs))
         disease = labs[pred_idx]
@@ -158,12 +175,17 @@ def predict():
         probabilities = {labs[i]: float(np.round(probs[i], 3)) for i in range(len(labs))}
 
         # Grad-CAM
-        heatmap_np = get_gradcam_heatmap(img_array, model, LAST_CONV_LAYER_NAME)
-        overlay_rgb = overlay_heatmap_on_image(heatmap_np, pil_image, alpha=0.4)
-        heatmap_png_base64 = encode_rgb_png_base64(overlay_rgb)
+        with timed(timings, "gradcam"):
+            heatmap_np = get_gradcam_heatmap(img_array, model, LAST_CONV_LAYER_NAME)
+        with timed(timings, "overlay"):
+            overlay_rgb = overlay_heatmap_on_image(heatmap_np, pil_image, alpha=0.4)
+        with timed(timings, "encode"):
+            heatmap_png = encode_rgb_png(overlay_rgb)
+        with timed(timings, "base64"):
+            heatmap_png_base64 = base64.b64encode(heatmap_png).decode("utf-8")
 
         # ✅ Ensure table exists
-        with engine.begin() as conn:
+        with timed(timings, "db"), engine.begin() as conn:
             conn.execute(text("""
                 CREATE TABLE IF NOT EXISTS predictions (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
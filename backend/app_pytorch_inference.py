@@ -2,25 +2,54 @@
 """
 Robust Flask inference server for multi-task EfficientNet-B3 model (classification + segmentation).
 - Robust checkpoint/state_dict loading
+- Optional memory-mapped weights (WEIGHTS_MMAP) so worker processes share one read-only copy
+- Zero-downtime hot reload (POST /admin/reload or MODEL_WATCH); each prediction row records its model version
+- Explicit startup: DB schema once, model load, warm-up batches, then GET /ready -> 200
+  (gunicorn.conf.py preloads the weights in the master so workers share them copy-on-write)
 - Tolerant Grad-CAM initialization across versions
-- Thread-safe Grad-CAM usage
+- Single-pass Grad-CAM sharing the classification forward (CAM_MODE=single_pass);
+  cam_classes=all adds a heatmap per disease class from the same forward + one batched backward
+- Thread-safe Grad-CAM usage (concurrent in single-pass mode, locked for pytorch-grad-cam);
+  CAM hooks are attached only while a CAM runs, so no_cam forwards stay hook-free
+- CPU thread counts from `python autotune.py` (per-machine config read at startup)
+- Pluggable inference engine: eager PyTorch, TorchScript or ONNX Runtime (INFERENCE_ENGINE)
+- Gated int8 / bf16 / channels_last precision modes for the eager engine (INFERENCE_PRECISION)
+- JPEG draft-mode decode + lookup-table normalization into preallocated buffers
+- Dynamic micro-batching of concurrent /predict forward passes (single-pass CAM requests included)
+- Segmentation decoder skipped for Normal predictions and no_mask requests
+- Compact mask output (mask_format=rle|polygon) thresholded on logits, no overlay/PNG
+- Selectable heatmap/mask encoding (PNG level, WebP, JPEG quality) and binary transports (multipart, MessagePack)
+- Async mode: /predict answers with the diagnosis + a job ID, CAM/mask follow via /jobs/<id> or SSE
+- /predict staged as decode -> model -> CAM -> render/encode -> log with bounded queues;
+  overlays rendered + encoded in a process pool through shared-memory slots
+- /predict/batch: many images (multipart or zip) streamed back as NDJSON
 - Optional skipping of CAM/mask via query params
-- SQLite logging of predictions
+- Content-addressed result cache with single-flight deduplication
+- SQLite logging of predictions (heatmap/mask images in a content-addressed artifact store)
+- Prediction rows written by a background writer in batched WAL transactions
+- Per-stage timers: Prometheus GET /metrics and a Server-Timing header on every response
+- Admin-gated /predict?profile=1 (torch.profiler + cProfile, Chrome trace + top-N tables) and
+  1-in-N sampled profiles in a size-capped directory (PROFILE_SAMPLE_EVERY)
 - CORS configured for dev origins
 """
 import io
 import os
 import json
 import base64
+import hashlib
+import hmac
+import zipfile
 import traceback
+import atexit
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from PIL import Image
 import numpy as np
-import cv2
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
 
 import torch
@@ -39,18 +68,145 @@ except Exception:
     show_cam_on_image = None
     preprocess_image = None
     ClassifierOutputTarget = None
+try:
+    from pytorch_grad_cam.activations_and_gradients import ActivationsAndGradients
+except Exception:
+    ActivationsAndGradients = None
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 import pandas as pd
 
+from batching import MicroBatcher
+from cam_engine import CamEngine
+from result_cache import ResultCache, make_key, file_sha256
+from artifact_store import ArtifactStore
+from prediction_log import PredictionLogWriter
+from engines import build_engine, segment_subset
+from precision import apply_precision, check_report
+from preprocess import Preprocessor
+from tuning import load_tuning, apply_torch_threads
+from weights import convert_checkpoint, load_mapped, mapped_path, memory_usage, normalize_state_dict
+from mask_codec import MASK_FORMATS, empty_mask, encode_polygons, encode_rle, mask_from_logits
+from jobs import JobStore, JobStoreFull
+from pipeline import Pipeline, Stage
+from metrics import Gauge, Histogram, Registry, instrument_app, timed
+from profiling import ProfiledTimings, RequestProfiler
+from render import heatmap_overlay, red_mask_overlay
+from render_pool import RenderPool, render_heatmap, render_mask
+from artifact_codec import (ArtifactEncoding, EXTENSIONS, MIMETYPES as ARTIFACT_MIMETYPES,
+                            negotiate_transport, pack_msgpack, pack_multipart, parse_encoding)
+
 # ---------------- CONFIG - edit these ----------------
 # FIX 1: Use a relative path. Assumes .pth is in the same folder as this script.
 # Fix: Use the script's own location to find the file reliably
 MODEL_PATH = Path(__file__).parent / "models" / "eye_model_lite.pth"
-LOG_DB_PATH = "sqlite:///predictions_flask.db"
+LOG_DB_PATH = os.environ.get("LOG_DB_PATH", "sqlite:///predictions_flask.db")
+# heatmap / mask PNGs live here (sharded by SHA-256); the predictions table only keeps refs
+ARTIFACT_DIR = Path(os.environ.get("ARTIFACT_DIR", str(Path(__file__).parent / "artifacts")))
+ARTIFACT_MAX_AGE = 365 * 24 * 3600
+# Prediction logging: "sync" (wait for group commit, returns prediction_id),
+# "async" (queue and return), "fire-and-forget" (drop rows when the queue is full)
+LOG_DURABILITY = os.environ.get("LOG_DURABILITY", "async")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "1000"))
+LOG_MAX_BATCH = int(os.environ.get("LOG_MAX_BATCH", "200"))
+LOG_LINGER_MS = float(os.environ.get("LOG_LINGER_MS", "20"))
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
 IMG_SIZE = 224
-MAX_UPLOAD_MB = 12 
+# Request body limits: MAX_UPLOAD_MB for /predict (also the largest image inside a batch zip),
+# MAX_BATCH_UPLOAD_MB for the whole multipart / zip body of /predict/batch
+MAX_UPLOAD_MB = 12
+MAX_BATCH_UPLOAD_MB = float(os.environ.get("MAX_BATCH_UPLOAD_MB", "128"))
+MAX_BATCH_IMAGES = int(os.environ.get("MAX_BATCH_IMAGES", "64"))
+# total decompressed size of the images of one /predict/batch request (zip members included)
+MAX_BATCH_UNZIPPED_MB = float(os.environ.get("MAX_BATCH_UNZIPPED_MB", "256"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Engine for the plain (non-CAM) forward: "eager", "torchscript" or "onnx".
+# Artifacts come from `python export_model.py export`; CAM always runs on the eager model.
+INFERENCE_ENGINE = os.environ.get("INFERENCE_ENGINE", "eager")
+TORCHSCRIPT_PATH = MODEL_PATH.with_suffix(".torchscript.pt")
+ONNX_PATH = MODEL_PATH.with_suffix(".onnx")
+ORT_INTRA_OP_THREADS = int(os.environ.get("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.environ.get("ORT_INTER_OP_THREADS", "0"))
+# Precision for the eager engine: fp32, dynamic_int8, static_int8, bf16, channels_last.
+# Non-fp32 modes need a passing report from `python quantize_model.py calibrate --images DIR`:
+# top-1 agreement, max softmax-probability difference and mean thresholded-mask IoU vs fp32.
+INFERENCE_PRECISION = os.environ.get("INFERENCE_PRECISION", "fp32")
+PRECISION_MIN_AGREEMENT = float(os.environ.get("PRECISION_MIN_AGREEMENT", "0.99"))
+PRECISION_MAX_PROB_DELTA = float(os.environ.get("PRECISION_MAX_PROB_DELTA", "0.02"))
+PRECISION_MIN_MASK_IOU = float(os.environ.get("PRECISION_MIN_MASK_IOU", "0.9"))
+PRECISION_REPORT_PATH = MODEL_PATH.with_suffix(".precision.json")
+STATIC_INT8_PATH = MODEL_PATH.with_suffix(".static_int8.pt")
+# Memory-mapped weights (CPU): "auto" maps <checkpoint>.mmap.pt when it matches the checkpoint,
+# "1" also (re)converts it at startup, "0" always loads a private copy.
+# WEIGHTS_FORMAT=safetensors uses <checkpoint>.safetensors instead (needs the safetensors package).
+WEIGHTS_MMAP = os.environ.get("WEIGHTS_MMAP", "auto").lower()
+WEIGHTS_FORMAT = os.environ.get("WEIGHTS_FORMAT", "torch")
+MAPPED_WEIGHTS_PATH = mapped_path(MODEL_PATH, WEIGHTS_FORMAT)
+# Hot reload: POST /admin/reload (X-Admin-Token header; disabled while ADMIN_TOKEN is unset) and/or
+# MODEL_WATCH=1, which polls MODEL_PATH every MODEL_WATCH_INTERVAL s and reloads when it changes.
+# Reloads are per process: under gunicorn use the file watch, or signal every worker.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+MODEL_WATCH = os.environ.get("MODEL_WATCH", "0").lower() in ("1", "true", "yes")
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", "10"))
+# Profiling: /predict?profile=1 (or "X-Profile: 1") with the admin token runs that request under
+# torch.profiler + cProfile and returns the top-N tables; PROFILE_SAMPLE_EVERY=N also profiles 1 in N
+# synchronous requests. Profiles go to PROFILE_DIR (oldest deleted above PROFILE_MAX_MB), served by
+# GET /admin/profiles. Profiled requests skip the result cache, pipeline threads and micro-batcher.
+PROFILE_DIR = os.environ.get("PROFILE_DIR", str(Path(__file__).parent / "profiles"))
+PROFILE_MAX_MB = float(os.environ.get("PROFILE_MAX_MB", "200"))
+PROFILE_SAMPLE_EVERY = int(os.environ.get("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "25"))
+# CPU threads: `python autotune.py` measures this machine and writes AUTOTUNE_CONFIG (ignored when
+# tuned on another CPU type); TORCH_THREADS / TORCH_INTEROP_THREADS override it (0 = torch default).
+AUTOTUNE_CONFIG = os.environ.get("AUTOTUNE_CONFIG", str(Path(__file__).parent / "autotune.json"))
+TUNED = load_tuning(AUTOTUNE_CONFIG)
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", str(TUNED.get("torch_threads", 0))))
+TORCH_INTEROP_THREADS = int(os.environ.get("TORCH_INTEROP_THREADS", str(TUNED.get("interop_threads", 0))))
+# Micro-batching: concurrent /predict calls are coalesced into one forward pass
+# (single-pass CAM requests into one forward + backward).
+# BATCH_MAX_SIZE <= 1 disables the batcher (every request runs its own forward).
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+# Only run the seg decoder for rows whose mask is used (mask requested and not Normal)
+CONDITIONAL_SEG = os.environ.get("CONDITIONAL_SEG", "1").lower() in ("1", "true", "yes")
+# Grad-CAM engine: "single_pass" reuses the classification forward (one forward + one backward),
+# "gradcam" uses pytorch-grad-cam (a second forward + backward per heatmap)
+CAM_MODE = os.environ.get("CAM_MODE", "single_pass")
+# Max concurrent single-pass CAMs (each holds an autograd graph); 0 = unbounded
+CAM_MAX_CONCURRENCY = int(os.environ.get("CAM_MAX_CONCURRENCY", str(os.cpu_count() or 4)))
+# Result cache: in-memory LRU byte budget (0 disables) + optional on-disk tier capped at RESULT_CACHE_DISK_MB.
+# Cache hits are still logged, so repeat uploads appear in /history.
+RESULT_CACHE_MB = float(os.environ.get("RESULT_CACHE_MB", "256"))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "")
+RESULT_CACHE_DISK_MB = float(os.environ.get("RESULT_CACHE_DISK_MB", "1024"))
+# Default heatmap / mask encoding (per request: ?artifact_format=&quality=&png_level=)
+# ARTIFACT_FORMAT: png | webp | jpeg; ARTIFACT_QUALITY applies to webp/jpeg, PNG_COMPRESS_LEVEL (0-9) to png
+ARTIFACT_FORMAT = os.environ.get("ARTIFACT_FORMAT", "png")
+ARTIFACT_QUALITY = int(os.environ.get("ARTIFACT_QUALITY", "85"))
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "6"))
+DEFAULT_ENCODING = parse_encoding({}, ArtifactEncoding(ARTIFACT_FORMAT, ARTIFACT_QUALITY, PNG_COMPRESS_LEVEL))
+# Async /predict (?async=1, or PREDICT_ASYNC=1 for every request): CAM / mask rendered by a worker pool.
+# Jobs live in the serving process, so /jobs/<id> must reach the same worker (one process or sticky routing).
+PREDICT_ASYNC = os.environ.get("PREDICT_ASYNC", "0").lower() in ("1", "true", "yes")
+ASYNC_WORKERS = int(os.environ.get("ASYNC_WORKERS", "2"))
+# Single-pass CAM: async requests keep the autograd graph of their classification forward for the
+# job's backward (one encoder pass). At most ASYNC_CAM_GRAPHS graphs wait for the job pool at once;
+# beyond that a request classifies with a plain forward and its job runs a second, full CAM pass.
+ASYNC_CAM_GRAPHS = int(os.environ.get("ASYNC_CAM_GRAPHS", str(max(1, ASYNC_WORKERS))))
+JOB_TTL_S = float(os.environ.get("JOB_TTL_S", "600"))
+JOB_MAX = int(os.environ.get("JOB_MAX", "1000"))
+# Staged /predict (PIPELINE=0 runs the same stages inline on the request thread)
+PIPELINE = os.environ.get("PIPELINE", "1").lower() in ("1", "true", "yes")
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "16"))
+DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", "2"))
+# Overlay render/encode worker processes (0 = render on the calling thread) and shared-memory slots
+RENDER_PROCESSES = int(os.environ.get("RENDER_PROCESSES", "2"))
+RENDER_SLOTS = int(os.environ.get("RENDER_SLOTS", "0"))
+# Warm-up at startup: WARMUP_ITERS forwards at each served batch size (empty = 1 and BATCH_MAX_SIZE)
+WARMUP_BATCH_SIZES = [int(b) for b in os.environ.get("WARMUP_BATCH_SIZES", "").split(",") if b.strip()]
+WARMUP_ITERS = int(os.environ.get("WARMUP_ITERS", "2"))
 
 # CORS origins
 CORS_ORIGINS = [
@@ -60,16 +216,29 @@ CORS_ORIGINS = [
 ]
 # ----------------------------------------------------
 
+# before any torch work: inter-op threads can only be set once per process
+apply_torch_threads(TORCH_THREADS, TORCH_INTEROP_THREADS)
+
 # Flask app
 app = Flask(__name__)
 
 # FIX 2: Correct syntax using the 'origins' key and the variable defined above
 CORS(app)
 
-app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024
+# global cap for Flask; each upload route checks its own limit (_body_too_large)
+app.config["MAX_CONTENT_LENGTH"] = int(max(MAX_UPLOAD_MB, MAX_BATCH_UPLOAD_MB) * 1024 * 1024)
 
 # DB engine
 engine = create_engine(LOG_DB_PATH, echo=False)
+artifact_store = ArtifactStore(ARTIFACT_DIR)
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets /history readers run while the log writer commits
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.close()
 
 # ... (The rest of your Model class, Load functions, and Routes go here) ...
 # ... (The rest of your Model class, Load functions, and Routes go here) ...
@@ -82,6 +251,7 @@ CLASS_MAP_INV = {
     3: "Glaucoma"
 }
 NUM_CLASSES = len(CLASS_MAP_INV)
+NORMAL_IDX = 0
 
 # ---------------- Model definition (must match training) ----------------
 class MultiTaskNet(nn.Module):
@@ -113,23 +283,50 @@ class MultiTaskNet(nn.Module):
         self.log_vars = nn.Parameter(torch.zeros(2))
         self.img_size = img_size
 
-    def forward(self, x):
-        feats = self.encoder.features(x)
+    # Stages are independently callable so the seg decoder only runs when its output is used
+    def encode(self, x):
+        return self.encoder.features(x)
+
+    def classify(self, feats):
         # Global Average Pooling
         pooled = F.adaptive_avg_pool2d(feats, 1).reshape(feats.shape[0], -1)
-        cls_out = self.classifier(pooled)
-        
+        return self.classifier(pooled)
+
+    def segment(self, feats):
         seg_out = self.seg_head(feats)
         # Guarantee output size is (img_size, img_size)
         if seg_out.shape[-2:] != (self.img_size, self.img_size):
             seg_out = F.interpolate(seg_out, size=(self.img_size, self.img_size), mode='bilinear', align_corners=False)
-        return cls_out, seg_out
+        return seg_out
+
+    def forward(self, x):
+        feats = self.encode(x)
+        return self.classify(feats), self.segment(feats)
 
 # ---------------- Globals ----------------
+# active ModelBundle; a request captures it once, so a reload never changes the model under it
+_bundle = None
+# mirrors of the active bundle (scripts, /health)
 _model = None
 _gradcam = None
 _classification_wrapper = None
 _gradcam_lock = threading.Lock()
+_batcher = None
+_engine = None
+_precision = "fp32"
+_cam_target = None
+_cam_engine = None
+_model_id = None
+_result_cache = (ResultCache(RESULT_CACHE_MB * 1024 * 1024, RESULT_CACHE_DIR or None, RESULT_CACHE_DISK_MB * 1024 * 1024)
+                 if RESULT_CACHE_MB > 0 else None)
+_jobs = JobStore(ttl_s=JOB_TTL_S, max_jobs=JOB_MAX)
+_profiler = RequestProfiler(PROFILE_DIR, int(PROFILE_MAX_MB * 1024 * 1024), PROFILE_SAMPLE_EVERY, PROFILE_TOP_N)
+_job_executor = None
+_job_executor_pid = None
+_job_executor_lock = threading.Lock()
+_render_pool = RenderPool(RENDER_PROCESSES, IMG_SIZE, RENDER_SLOTS or None) if RENDER_PROCESSES > 0 else None
+if _render_pool is not None:
+    atexit.register(_render_pool.close)
 
 # Preprocess transform
 MEAN = [0.485, 0.456, 0.406]
@@ -141,28 +338,62 @@ def build_preprocess():
         T.Normalize(mean=MEAN, std=STD)
     ])
 
-def pil_to_tensor_for_model(pil_img):
-    tf = build_preprocess()
-    return tf(pil_img).unsqueeze(0).to(DEVICE)
+def _split_outputs(out):
+    # Handle potential output formats -> (cls_logits, seg_logits or None)
+    if isinstance(out, (list, tuple)):
+        cls_logits = out[0]
+        seg_logits = out[1] if len(out) > 1 else None
+    else:
+        cls_logits = out
+        seg_logits = None
+    if not isinstance(cls_logits, torch.Tensor):
+        raise RuntimeError(f"Unexpected classification output type: {type(cls_logits)}")
+    return cls_logits, seg_logits
+
+def _seg_rows(cls_logits, want_seg=True):
+    """
+    Bool tensor of rows whose segmentation output will actually be rendered:
+    mask requested (want_seg: bool or per-row bools) and not predicted Normal.
+    """
+    need = cls_logits.argmax(dim=1) != NORMAL_IDX
+    if want_seg is not True:
+        need &= torch.as_tensor(want_seg, dtype=torch.bool, device=need.device).reshape(-1).expand_as(need)
+    return need
+
+def _run_staged(model, batch, want_seg=True):
+    # encoder + classifier for every row, seg decoder only on the rows that need it
+    feats = model.encode(batch)
+    cls_logits = model.classify(feats)
+    return cls_logits, segment_subset(model, feats, _seg_rows(cls_logits, want_seg))
+
+def _run_model(batch, want_seg=True, bundle=None):
+    # active inference engine (eager model unless INFERENCE_ENGINE selects another)
+    b = bundle or _bundle
+    if CONDITIONAL_SEG and b.engine is not None and getattr(b.engine, "staged", False):
+        return _run_staged(b.engine.model, batch, want_seg)
+    if b.engine is not None:
+        return _split_outputs(b.engine(batch))
+    return _split_outputs(b.model(batch))
+
+def _forward(inp_tensor, want_seg=True, bundle=None, direct=False):
+    # Route through the micro-batcher when enabled; each caller gets its own rows back
+    # (direct=True runs on the calling thread, e.g. for a profiled request)
+    b = bundle or _bundle
+    if b.batcher is not None and not direct:
+        return b.batcher(inp_tensor, want_seg=want_seg)
+    with torch.inference_mode():
+        return _run_model(inp_tensor, want_seg, b)
 
-def encode_base64_png_from_pil(pil_img):
-    buff = io.BytesIO()
-    pil_img.save(buff, format="PNG")
-    buff.seek(0)
-    return base64.b64encode(buff.read()).decode("utf-8")
+# decode + normalize engine used by every route (build_preprocess is the reference pipeline)
+_preprocessor = Preprocessor(IMG_SIZE, MEAN, STD)
+
+def pil_to_tensor_for_model(pil_img, reuse=False):
+    # reuse=True: tensor lives in this thread's buffer until its next call
+    return _preprocessor.to_tensor(pil_img, reuse=reuse).to(DEVICE)
 
 def overlay_heatmap_on_pil(pil_rgb, cam_mask, alpha=0.4):
-    # pil_rgb: PIL Image resized to IMG_SIZE
-    rgb = np.array(pil_rgb).astype(np.float32) / 255.0
-    # cam_mask assumed 2D, values in [0,1]
-    cam_uint8 = (np.clip(cam_mask, 0, 1) * 255).astype("uint8")
-    # apply OpenCV colormap
-    heatmap = cv2.applyColorMap(cam_uint8, cv2.COLORMAP_JET)
-    heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB).astype(np.float32)/255.0
-    overlay = (1-alpha)*rgb + alpha*heatmap
-    overlay = np.clip(overlay, 0, 1)
-    overlay_img = Image.fromarray((overlay*255).astype("uint8"))
-    return overlay_img
+    # pil_rgb: PIL Image resized to IMG_SIZE; cam_mask: 2D, values in [0,1]
+    return Image.fromarray(heatmap_overlay(np.array(pil_rgb), cam_mask, alpha))
 
 # --- NEW FUNCTION FOR RED MASK OVERLAY ---
 def overlay_red_mask_on_pil(pil_rgb, binary_mask_uint8, alpha=0.5):
@@ -170,20 +401,7 @@ def overlay_red_mask_on_pil(pil_rgb, binary_mask_uint8, alpha=0.5):
     Overlays a red color where the mask is 1 (255), transparent elsewhere.
     binary_mask_uint8: numpy array of shape (H, W), values 0 or 255
     """
-    rgb = np.array(pil_rgb)
-    
-    # Create a solid red image
-    red_layer = np.zeros_like(rgb)
-    red_layer[:, :, 0] = 255  # Red channel full
-    
-    # Create mask boolean
-    mask_bool = binary_mask_uint8 > 0
-    
-    # Blend only where mask is True
-    output = rgb.copy()
-    output[mask_bool] = (rgb[mask_bool] * (1 - alpha) + red_layer[mask_bool] * alpha).astype(np.uint8)
-    
-    return Image.fromarray(output)
+    return Image.fromarray(red_mask_overlay(np.array(pil_rgb), binary_mask_uint8, alpha))
 
 # ---------------- DB utilities ----------------
 def init_db():
@@ -197,9 +415,33 @@ def init_db():
                 probabilities TEXT,
                 heatmap_base64 TEXT,
                 mask_base64 TEXT,
+                heatmap_ref TEXT,
+                mask_ref TEXT,
+                model_version TEXT,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         """))
+        # older databases: add the artifact-store reference / model version columns
+        cols = {r[1] for r in conn.execute(text("PRAGMA table_info(predictions)")).fetchall()}
+        for col in ("heatmap_ref", "mask_ref", "model_version"):
+            if col not in cols:
+                conn.execute(text(f"ALTER TABLE predictions ADD COLUMN {col} TEXT"))
+        # /history: keyset pagination over (created_at, id), optionally per disease
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_predictions_created_id ON predictions (created_at DESC, id DESC)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_predictions_disease_created_id "
+            "ON predictions (predicted_disease, created_at DESC, id DESC)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_predictions_disease_confidence ON predictions (predicted_disease, confidence)"
+        ))
+        # confidence-only filters: a confidence range is searched here, then sorted; SQLite keeps
+        # walking idx_predictions_created_id for a one-sided bound or with a cursor (stops at LIMIT matches)
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_predictions_confidence ON predictions (confidence)"
+        ))
 
 # ---------------- Model loader (robust GradCAM init) ----------------
 def _find_target_conv(module: nn.Module):
@@ -222,42 +464,122 @@ def _find_target_conv(module: nn.Module):
             last = m
     return last
 
-def load_model():
-    global _model, _gradcam, _classification_wrapper
-    if _model is not None:
-        return
+# wrapper returns only logits for Grad-CAM
+class ClassificationOnlyWrapper(nn.Module):
+    def __init__(self, full_model):
+        super().__init__()
+        self.full = full_model
+    def forward(self, x):
+        cls, _ = self.full(x)
+        return cls
+
+def init_library_gradcam(model, target_layer):
+    """Build a pytorch-grad-cam GradCAM around model -> (wrapper, gradcam), gradcam None on failure."""
+    # Setup Grad-CAM tolerant to API differences
+    if GradCAM is None or show_cam_on_image is None or preprocess_image is None:
+        print("pytorch-grad-cam not available or incomplete; Grad-CAM disabled.")
+        return None, None
+
+    wrapper = ClassificationOnlyWrapper(model).to(DEVICE)
+
+    # Try multiple GradCAM init signatures
+    cam = None
+    try:
+        # preferred: use_cuda argument (older versions)
+        cam = GradCAM(model=wrapper, target_layers=[target_layer], use_cuda=(DEVICE=="cuda"))
+        print("GradCAM initialized with use_cuda.")
+    except TypeError:
+        try:
+            # alternate: device argument
+            cam = GradCAM(model=wrapper, target_layers=[target_layer], device=torch.device(DEVICE))
+            print("GradCAM initialized with device arg.")
+        except TypeError:
+            try:
+                # simplest init
+                cam = GradCAM(model=wrapper, target_layers=[target_layer])
+                print("GradCAM initialized without extra kwargs.")
+            except Exception as e:
+                print("GradCAM initialization failed; disabling CAM. Error:", e)
+                cam = None
+    except Exception as e:
+        print("Unexpected error initializing GradCAM; disabling CAM. Error:", e)
+        cam = None
+    if cam is not None and ActivationsAndGradients is not None:
+        # GradCAM hooks the target layer (shared with the inference model) at construction,
+        # copying activations on every plain forward; attach them per CAM call instead
+        _release_library_hooks(cam)
+    return wrapper, cam
 
-    if not MODEL_PATH.exists():
-        raise FileNotFoundError(f"Model checkpoint not found: {MODEL_PATH}")
+def _release_library_hooks(cam):
+    hooks = getattr(cam, "activations_and_grads", None)
+    if hooks is not None:
+        hooks.release()
+        # drop the tensors captured so far
+        hooks.activations, hooks.gradients = [], []
 
-    print("Loading model from:", MODEL_PATH)
+def _run_library_cam(cam, input_tensor, targets):
+    """pytorch-grad-cam call with its hooks attached for this call only (caller holds the gradcam lock)."""
+    if ActivationsAndGradients is None:
+        return cam(input_tensor, targets=targets)
+    cam.activations_and_grads = ActivationsAndGradients(cam.model, cam.target_layers, cam.reshape_transform)
+    try:
+        return cam(input_tensor, targets=targets)
+    finally:
+        _release_library_hooks(cam)
+
+class ModelBundle:
+    """
+    Everything a request needs from one checkpoint: model, inference engine, micro-batcher and
+    CAM setup. Requests capture the active bundle once; hot reload swaps in a new one and
+    retires the old one after the requests already holding it have finished with it.
+    """
+
+    def __init__(self, path, model_id):
+        self.path = Path(path)
+        self.model_id = model_id
+        # short version recorded on every prediction row: <checkpoint stem>@<sha256 prefix>
+        self.version = f"{self.path.stem}@{model_id[:12]}"
+        self.model = None
+        self.engine = None
+        self.precision = "fp32"
+        self.batcher = None
+        self.cam_target = None
+        self.cam_engine = None
+        self.gradcam = None
+        self.classification_wrapper = None
+        self.gradcam_lock = threading.Lock()
+        self.loaded_at = time.time()
+
+    def retire(self):
+        # queued micro-batches still run; later submits run inline on this bundle
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def info(self):
+        return {"version": self.version, "path": str(self.path), "sha256": self.model_id,
+                "engine": self.engine.name if self.engine is not None else None,
+                "precision": self.precision, "loaded_at": self.loaded_at}
+
+def _sidecar(checkpoint_path, default_path):
+    # engine / precision artifacts live next to their checkpoint: <stem>.torchscript.pt, <stem>.onnx, ...
+    checkpoint_path = Path(checkpoint_path)
+    if checkpoint_path == MODEL_PATH:
+        return default_path
+    return checkpoint_path.with_suffix("".join(Path(default_path).suffixes))
+
+def _load_checkpoint_model(path=MODEL_PATH):
+    """MultiTaskNet with a private copy of the checkpoint weights."""
+    print("Loading model from:", path)
     m = MultiTaskNet(num_classes=NUM_CLASSES).to(DEVICE)
     
     try:
-        ckpt = torch.load(MODEL_PATH, map_location=DEVICE)
+        ckpt = torch.load(path, map_location=DEVICE)
     except Exception as e:
         print(f"Failed to load checkpoint file: {e}")
         raise e
 
-    # robustly obtain state_dict
-    state = ckpt
-    if isinstance(ckpt, dict):
-        # Priority check for 'model' key which we know works
-        if 'model' in ckpt:
-            state = ckpt['model']
-        else:
-            for key in ("model_state", "model_state_dict", "state_dict"):
-                if key in ckpt:
-                    state = ckpt[key]
-                    break
-
-    # normalize keys (strip 'module.' if present) - Keeping this for robustness
-    if isinstance(state, dict):
-        new_state = {}
-        for k, v in state.items():
-            nk = k.replace("module.", "") if isinstance(k, str) and k.startswith("module.") else k
-            new_state[nk] = v
-        state = new_state
+    # robustly obtain state_dict ('model' / 'state_dict' probing, 'module.' stripping)
+    state = normalize_state_dict(ckpt)
 
     # attempt strict load, then fallback
     try:
@@ -271,64 +593,979 @@ def load_model():
         except Exception as e2:
             print("Final load attempt failed:", e2)
             raise e2
+    return m
+
+def _load_mapped_model(path, model_id):
+    """
+    MultiTaskNet whose parameters are the read-only mapped tensors of the checkpoint's mapped
+    weights file (no private copy), or None to fall back to _load_checkpoint_model.
+    """
+    mapped = MAPPED_WEIGHTS_PATH if Path(path) == MODEL_PATH else mapped_path(path, WEIGHTS_FORMAT)
+    try:
+        state, source = load_mapped(mapped) if mapped.exists() else (None, None)
+        if source != model_id:
+            if WEIGHTS_MMAP == "auto":
+                if mapped.exists():
+                    print(f"Mapped weights {mapped.name} are stale; run: python export_model.py mmap")
+                return None
+            print("Converting checkpoint to mapped weights:", mapped)
+            convert_checkpoint(path, mapped, model_id, WEIGHTS_FORMAT)
+            state, source = load_mapped(mapped)
+
+        # built on the meta device: no throwaway random init; assign=True adopts the mapped tensors
+        with torch.device("meta"):
+            m = MultiTaskNet(num_classes=NUM_CLASSES)
+        m.load_state_dict(state, strict=True, assign=True)
+        print("✅ Model weights memory-mapped from", mapped)
+        return m
+    except Exception as e:
+        print("Memory-mapped weights unavailable, loading a private copy:", e)
+        return None
+
+def _build_bundle(path=MODEL_PATH):
+    """Load checkpoint path into a new ModelBundle (not yet active)."""
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"Model checkpoint not found: {path}")
+
+    # checkpoint identity, part of every result-cache key
+    bundle = ModelBundle(path, file_sha256(path))
+    mem_before = memory_usage()
+
+    m = None
+    if DEVICE == "cpu" and WEIGHTS_MMAP not in ("0", "false", "no"):
+        m = _load_mapped_model(path, bundle.model_id)
+    if m is None:
+        m = _load_checkpoint_model(path)
 
     m.eval()
-    _model = m.to(DEVICE)
-    print("Model loaded to", DEVICE)
+    bundle.model = m.to(DEVICE)
+    print("Model loaded to", DEVICE, "version", bundle.version)
+    print("Memory before/after model load:", mem_before, "->", memory_usage())
 
-    # Setup Grad-CAM tolerant to API differences
-    if GradCAM is None or show_cam_on_image is None or preprocess_image is None:
-        print("pytorch-grad-cam not available or incomplete; Grad-CAM disabled.")
-        _gradcam = None
-        _classification_wrapper = None
-        return
+    # reduced-precision copy for the plain forward; CAM keeps the fp32 model
+    infer_model = bundle.model
+    if INFERENCE_PRECISION != "fp32":
+        ok, reason = check_report(_sidecar(path, PRECISION_REPORT_PATH), INFERENCE_PRECISION, bundle.model_id,
+                                  PRECISION_MIN_AGREEMENT, PRECISION_MAX_PROB_DELTA, PRECISION_MIN_MASK_IOU)
+        if ok and DEVICE != "cpu":
+            ok, reason = False, "precision modes target CPU nodes"
+        if ok:
+            try:
+                infer_model = apply_precision(INFERENCE_PRECISION, bundle.model,
+                                              static_int8_path=_sidecar(path, STATIC_INT8_PATH))
+                bundle.precision = INFERENCE_PRECISION
+            except Exception as e:
+                ok, reason = False, str(e)
+        if ok:
+            print("Inference precision:", bundle.precision)
+        else:
+            print(f"Refusing precision mode {INFERENCE_PRECISION!r} ({reason}); using fp32.")
+
+    try:
+        bundle.engine = build_engine(INFERENCE_ENGINE, infer_model, torchscript_path=_sidecar(path, TORCHSCRIPT_PATH),
+                                     onnx_path=_sidecar(path, ONNX_PATH), device=DEVICE,
+                                     intra_op_threads=ORT_INTRA_OP_THREADS, inter_op_threads=ORT_INTER_OP_THREADS)
+        print("Inference engine:", bundle.engine.name)
+    except Exception as e:
+        print(f"Inference engine {INFERENCE_ENGINE!r} unavailable ({e}); falling back to eager.")
+        bundle.engine = build_engine("eager", infer_model)
 
-    # find a sensible target layer
-    target_layer = _find_target_conv(_model)
-    if target_layer is None:
+    if BATCH_MAX_SIZE > 1:
+        bundle.batcher = MicroBatcher(lambda batch, want_seg: _run_model(batch, want_seg, bundle),
+                                      max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                                      run_cam_batch=lambda batch, want_seg: _forward_with_cam(
+                                          batch, want_seg, bundle, direct=True))
+        print(f"Micro-batching enabled (max_batch_size={BATCH_MAX_SIZE}, max_wait_ms={BATCH_MAX_WAIT_MS}).")
+
+    # find a sensible target layer (shared by the single-pass engine and pytorch-grad-cam)
+    bundle.cam_target = _find_target_conv(bundle.model)
+    if bundle.cam_target is None:
         print("Could not find a conv layer for Grad-CAM; disabling CAM.")
-        _gradcam = None
-        _classification_wrapper = None
+        return bundle
+
+    if CAM_MODE == "single_pass":
+        # one forward + one backward per CAM, per-thread capture -> no global lock
+        bundle.cam_engine = CamEngine(bundle.model, bundle.cam_target, max_concurrency=CAM_MAX_CONCURRENCY or None)
+        print(f"Single-pass Grad-CAM ready (max_concurrency={CAM_MAX_CONCURRENCY or 'unbounded'}).")
+        return bundle
+
+    bundle.classification_wrapper, bundle.gradcam = init_library_gradcam(bundle.model, bundle.cam_target)
+    if bundle.gradcam is not None:
+        print("GradCAM ready.")
+    else:
+        print("GradCAM not available; continuing without CAM.")
+    return bundle
+
+def _install_bundle(bundle):
+    """Make bundle the active one -> the previous bundle (or None)."""
+    global _bundle, _model, _gradcam, _classification_wrapper, _gradcam_lock, _batcher, _engine, _precision
+    global _cam_target, _cam_engine, _model_id
+    previous = _bundle
+    # single reference assignment: a request sees either the old bundle or the new one
+    _bundle = bundle
+    _model, _engine, _precision, _batcher = bundle.model, bundle.engine, bundle.precision, bundle.batcher
+    _cam_target, _cam_engine, _model_id = bundle.cam_target, bundle.cam_engine, bundle.model_id
+    _gradcam, _classification_wrapper, _gradcam_lock = bundle.gradcam, bundle.classification_wrapper, bundle.gradcam_lock
+    return previous
+
+def load_model():
+    if _bundle is not None:
         return
+    _install_bundle(_build_bundle(MODEL_PATH))
 
-    # wrapper returns only logits for Grad-CAM
-    class ClassificationOnlyWrapper(nn.Module):
-        def __init__(self, full_model):
-            super().__init__()
-            self.full = full_model
-        def forward(self, x):
-            cls, _ = self.full(x)
-            return cls
+# ---------------- Startup / readiness ----------------
+_startup_lock = threading.Lock()
+_db_initialized = False
+# pid of the process whose warm-up finished (readiness does not survive a fork)
+_ready_pid = None
+_startup_error = None
 
-    _classification_wrapper = ClassificationOnlyWrapper(_model).to(DEVICE)
+def init_resources():
+    """DB schema (once) + model load. Runs in the gunicorn master when preloading."""
+    global _db_initialized
+    if _db_initialized and _bundle is not None:
+        return
+    with _startup_lock:
+        if not _db_initialized:
+            init_db()
+            _db_initialized = True
+        load_model()
 
-    # Try multiple GradCAM init signatures
-    _gradcam = None
-    try:
-        # preferred: use_cuda argument (older versions)
-        _gradcam = GradCAM(model=_classification_wrapper, target_layers=[target_layer], use_cuda=(DEVICE=="cuda"))
-        print("GradCAM initialized with use_cuda.")
-    except TypeError:
-        try:
-            # alternate: device argument
-            _gradcam = GradCAM(model=_classification_wrapper, target_layers=[target_layer], device=torch.device(DEVICE))
-            print("GradCAM initialized with device arg.")
-        except TypeError:
+def _warmup_batch_sizes():
+    sizes = WARMUP_BATCH_SIZES or [1, max(1, BATCH_MAX_SIZE)]
+    return sorted(set(max(1, b) for b in sizes))
+
+def warmup(bundle=None):
+    """Run dummy batches through every path a request can take (allocator, oneDNN, CAM, render)."""
+    b = bundle or _bundle
+    sizes = _warmup_batch_sizes()
+    x = torch.zeros((max(sizes), 3, IMG_SIZE, IMG_SIZE), device=DEVICE)
+    for bs in sizes:
+        for _ in range(max(1, WARMUP_ITERS)):
+            with torch.inference_mode():
+                _run_model(x[:bs], want_seg=True, bundle=b)
+    if b.cam_engine is not None:
+        for bs in sizes:
             try:
-                # simplest init
-                _gradcam = GradCAM(model=_classification_wrapper, target_layers=[target_layer])
-                print("GradCAM initialized without extra kwargs.")
+                b.cam_engine(x[:bs].clone(), out_size=(IMG_SIZE, IMG_SIZE))
             except Exception as e:
-                print("GradCAM initialization failed; disabling CAM. Error:", e)
-                _gradcam = None
+                print("CAM warm-up failed:", e)
+    # spawns the render workers and runs each encoder once
+    pil = Image.fromarray(np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8))
+    try:
+        _render_heatmap(pil, np.zeros((IMG_SIZE, IMG_SIZE), dtype=np.float32))
+        _render_mask(pil, np.full((IMG_SIZE, IMG_SIZE), 255, dtype=np.uint8))
     except Exception as e:
-        print("Unexpected error initializing GradCAM; disabling CAM. Error:", e)
-        _gradcam = None
+        print("Render warm-up failed:", e)
+    print(f"Warm-up done (batch sizes {sizes}, {WARMUP_ITERS} iters).")
 
-    if _gradcam is not None:
-        print("GradCAM ready.")
+def startup(background=False):
+    """init_resources + warm-up, then /ready returns 200. background=True returns immediately."""
+    def _run():
+        global _ready_pid, _startup_error
+        try:
+            # forked gunicorn workers re-apply the intra-op setting in their own process
+            apply_torch_threads(TORCH_THREADS)
+            init_resources()
+            warmup()
+            _startup_error = None
+            _ready_pid = os.getpid()
+        except Exception as e:
+            traceback.print_exc()
+            _startup_error = str(e)
+        if MODEL_WATCH:
+            start_model_watch()
+
+    if background:
+        threading.Thread(target=_run, name="startup", daemon=True).start()
     else:
-        print("GradCAM not available; continuing without CAM.")
+        _run()
+
+def is_ready():
+    return _ready_pid == os.getpid()
+
+# ---------------- Hot reload ----------------
+_reload_lock = threading.Lock()
+_reload_status = {"state": "idle", "version": None, "error": None, "started_at": None, "finished_at": None}
+_watch_pid = None
+
+def reload_model(path=None):
+    """
+    Load path (default MODEL_PATH), warm it up and swap it in. Requests already running keep the
+    bundle they captured; the old bundle is retired once swapped out. Blocks; raises on failure
+    (the current model stays active). Only one reload runs at a time.
+    """
+    path = Path(path) if path else MODEL_PATH
+    with _reload_lock:
+        _reload_status.update(state="loading", error=None, started_at=time.time(), finished_at=None)
+        try:
+            bundle = _build_bundle(path)
+            # warm before the swap so the first requests on the new model are not slow
+            warmup(bundle)
+            previous = _install_bundle(bundle)
+            if previous is not None:
+                previous.retire()
+            _reload_status.update(state="idle", version=bundle.version, finished_at=time.time())
+            print(f"Model reloaded: {previous.version if previous else None} -> {bundle.version}")
+            return bundle
+        except Exception as e:
+            traceback.print_exc()
+            _reload_status.update(state="failed", error=str(e), finished_at=time.time())
+            raise
+
+def reload_model_async(path=None):
+    """Start reload_model in a background thread; False if a reload is already running."""
+    if _reload_lock.locked():
+        return False
+
+    def _run():
+        try:
+            reload_model(path)
+        except Exception:
+            pass
+
+    threading.Thread(target=_run, name="model-reload", daemon=True).start()
+    return True
+
+def _checkpoint_stamp(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+def _watch_loop():
+    last = _checkpoint_stamp(MODEL_PATH)
+    while True:
+        time.sleep(max(0.5, MODEL_WATCH_INTERVAL))
+        stamp = _checkpoint_stamp(MODEL_PATH)
+        if stamp is None or stamp == last:
+            continue
+        # wait for the writer to finish (size / mtime stable for one interval)
+        time.sleep(max(0.5, MODEL_WATCH_INTERVAL))
+        if _checkpoint_stamp(MODEL_PATH) != stamp:
+            continue
+        last = stamp
+        if _bundle is not None and file_sha256(MODEL_PATH) == _bundle.model_id:
+            continue
+        try:
+            reload_model(MODEL_PATH)
+        except Exception as e:
+            print("Model watch: reload failed, keeping the current model:", e)
+
+def start_model_watch():
+    """Poll MODEL_PATH and hot reload when it changes (one thread per process)."""
+    global _watch_pid
+    if _watch_pid == os.getpid():
+        return
+    _watch_pid = os.getpid()
+    threading.Thread(target=_watch_loop, name="model-watch", daemon=True).start()
+    print(f"Watching {MODEL_PATH} for changes (every {MODEL_WATCH_INTERVAL}s).")
+
+# ---------------- Prediction helpers ----------------
+def _parse_flags(args):
+    no_cam = args.get("no_cam", "0").lower() in ("1", "true", "yes")
+    no_mask = args.get("no_mask", "0").lower() in ("1", "true", "yes")
+    return no_cam, no_mask
+
+def _parse_async(args):
+    value = args.get("async")
+    if value is None:
+        return PREDICT_ASYNC
+    return value.lower() in ("1", "true", "yes")
+
+def _jobs_full_response():
+    resp = jsonify({"error": "too many async jobs in progress, retry shortly or use async=0"})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "5"
+    return resp
+
+def _parse_profile(req):
+    value = req.args.get("profile", req.headers.get("X-Profile", ""))
+    return value.lower() in ("1", "true", "yes")
+
+def _parse_mask_format(args):
+    mask_format = args.get("mask_format", "png").lower()
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f"mask_format must be one of {', '.join(MASK_FORMATS)}")
+    return mask_format
+
+def _parse_cam_classes(args):
+    """cam_classes=all or comma-separated class labels -> class indices, None when absent."""
+    raw = args.get("cam_classes", "").strip()
+    if not raw:
+        return None
+    if raw.lower() == "all":
+        return list(range(NUM_CLASSES))
+    by_label = {label.lower(): idx for idx, label in CLASS_MAP_INV.items()}
+    classes = []
+    for label in raw.split(","):
+        idx = by_label.get(label.strip().lower())
+        if idx is None:
+            raise ValueError(f"unknown class {label.strip()!r} in cam_classes; "
+                             f"expected 'all' or labels from: {', '.join(CLASS_MAP_INV.values())}")
+        if idx not in classes:
+            classes.append(idx)
+    return classes
+
+def _load_pil_resized(stream):
+    # JPEGs are DCT-downscaled while decoding, then resized once to IMG_SIZE
+    return _preprocessor.decode(stream)
+
+def _render_mask(pil_resized, mask_uint8, encoding=None):
+    # red overlay, or the clean image when mask_uint8 is None / empty (render pool when enabled)
+    rgb = np.asarray(pil_resized)
+    if _render_pool is not None:
+        return _render_pool.mask(rgb, mask_uint8, encoding or DEFAULT_ENCODING)
+    return render_mask(rgb, mask_uint8, encoding or DEFAULT_ENCODING)
+
+def _render_heatmap(pil_resized, grayscale_cam, encoding=None):
+    # normalize / resize the CAM, JET overlay, encode (render pool when enabled)
+    rgb = np.asarray(pil_resized)
+    if _render_pool is not None:
+        return _render_pool.heatmap(rgb, grayscale_cam, encoding or DEFAULT_ENCODING)
+    return render_heatmap(rgb, grayscale_cam, encoding or DEFAULT_ENCODING)
+
+def _build_mask_image(pil_resized, seg_logits, pred_label, encoding=None):
+    # seg_logits: (1, 1, H, W) slice for this image (None when the decoder was skipped for Normal)
+    try:
+        # 1. NORMAL SUPPRESSION (If Normal, mask is empty -> clean image)
+        if pred_label == "Normal":
+            return _render_mask(pil_resized, None, encoding)
+
+        # 2. LOW THRESHOLD (0.25 to catch partial confidence), compared on logits
+        mask_uint8 = mask_from_logits(seg_logits.detach()) * 255
+
+        # 3. RED OVERLAY (clean image if the mask is empty)
+        return _render_mask(pil_resized, mask_uint8, encoding)
+    except Exception as e:
+        print(f"Mask generation failed: {e}")
+        traceback.print_exc()
+        return None
+
+def _build_mask_compact(seg_logits, pred_label, mask_format):
+    """
+    RLE / polygon mask at the decoder's output resolution, for the client to draw on the
+    original image. Normal predictions (or a skipped decoder) give an empty mask.
+    """
+    try:
+        if pred_label == "Normal" or seg_logits is None:
+            size = tuple(seg_logits.shape[-2:]) if seg_logits is not None else (IMG_SIZE, IMG_SIZE)
+            mask = empty_mask(size)
+        else:
+            mask = mask_from_logits(seg_logits.detach())
+        return encode_rle(mask) if mask_format == "rle" else encode_polygons(mask)
+    except Exception as e:
+        print(f"Mask encoding failed: {e}")
+        traceback.print_exc()
+        return None
+
+def _compute_library_cam(pil_resized, pred_idx, bundle=None):
+    """Grayscale CAM from pytorch-grad-cam (its own forward/backward), or None if unavailable."""
+    b = bundle or _bundle
+    if (b.gradcam is None) or (preprocess_image is None):
+        return None
+    try:
+        rgb_for_cam = np.array(pil_resized).astype(np.float32) / 255.0
+        input_for_cam = preprocess_image(rgb_for_cam, mean=MEAN, std=STD).to(DEVICE)
+        # thread-safe call
+        with b.gradcam_lock:
+            return _run_library_cam(b.gradcam, input_for_cam, [ClassifierOutputTarget(pred_idx)])
+    except Exception as e:
+        print("Grad-CAM generation error:", e)
+        traceback.print_exc()
+        return None
+
+def _build_cam_image(pil_resized, pred_idx, cam=None, encoding=None, bundle=None):
+    """
+    cam: precomputed grayscale CAM from the single-pass engine; when None the
+    pytorch-grad-cam instance (if any) computes it with its own forward/backward.
+    """
+    if cam is None:
+        cam = _compute_library_cam(pil_resized, pred_idx, bundle)
+        if cam is None:
+            return None
+    try:
+        return _render_heatmap(pil_resized, cam, encoding)
+    except Exception as e:
+        print("Grad-CAM rendering error:", e)
+        traceback.print_exc()
+        return None
+
+def _use_single_pass_cam(no_cam, bundle=None):
+    return (not no_cam) and (bundle or _bundle).cam_engine is not None
+
+def _forward_with_cam(inp_tensor, want_seg=True, bundle=None, direct=False):
+    """
+    One forward + one backward producing (cls_logits, seg_logits, cams) for the argmax class
+    of every row. Returns cams=None (and plain forward outputs) if the CAM pass fails.
+    Concurrent callers are coalesced by the micro-batcher into one CAM pass when enabled
+    (direct=True runs on the calling thread, e.g. for a profiled request or a ready-made batch).
+    """
+    b = bundle or _bundle
+    if b.batcher is not None and not direct:
+        return b.batcher(inp_tensor, want_seg=want_seg, with_cam=True)
+    segment_rows = (lambda cls_logits: _seg_rows(cls_logits, want_seg)) if CONDITIONAL_SEG else None
+    try:
+        return b.cam_engine(inp_tensor, out_size=(IMG_SIZE, IMG_SIZE), segment_rows=segment_rows)
+    except Exception as e:
+        print("Single-pass Grad-CAM error:", e)
+        traceback.print_exc()
+    with torch.inference_mode():
+        cls_logits, seg_logits = _run_model(inp_tensor, want_seg, b)
+    return cls_logits, seg_logits, None
+
+def _has_cam_engine(bundle=None):
+    return (bundle or _bundle).cam_engine is not None
+
+def _forward_with_class_cams(inp_tensor, classes, want_seg=True, with_argmax=True, bundle=None):
+    """
+    One forward + one batched backward -> (cls_logits, seg_logits, cams) with cams of shape
+    (B, K, H, W): slot 0 the argmax class when with_argmax, then one slot per class of classes.
+    Returns cams=None (and plain forward outputs) if the CAM pass fails.
+    """
+    b = bundle or _bundle
+    segment_rows = (lambda cls_logits: _seg_rows(cls_logits, want_seg)) if CONDITIONAL_SEG else None
+    try:
+        return b.cam_engine.multi(inp_tensor, classes, out_size=(IMG_SIZE, IMG_SIZE), segment_rows=segment_rows,
+                                  with_argmax=with_argmax)
+    except Exception as e:
+        print("Batched Grad-CAM error:", e)
+        traceback.print_exc()
+    with torch.inference_mode():
+        cls_logits, seg_logits = _run_model(inp_tensor, want_seg, b)
+    return cls_logits, seg_logits, None
+
+def _split_class_cams(cams, row, no_cam):
+    # one row of _forward_with_class_cams output -> (argmax CAM or None, [CAM per requested class])
+    if cams is None:
+        return None, None
+    if no_cam:
+        return None, list(cams[row])
+    return cams[row, 0], list(cams[row, 1:])
+
+def _classification(cls_logits, model_version=None):
+    """(1, C) logits -> (pred_idx, response fields: predicted_disease / confidence / probabilities / model_version)."""
+    with torch.inference_mode():
+        probs = torch.softmax(cls_logits, dim=1).cpu().numpy()[0]
+    pred_idx = int(np.argmax(probs))
+    pred_label = CLASS_MAP_INV.get(pred_idx, str(pred_idx))
+    probabilities = {CLASS_MAP_INV[i]: float(round(float(probs[i]), 6)) for i in range(len(probs))}
+    return pred_idx, {
+        "predicted_disease": pred_label,
+        "confidence": float(probs[pred_idx]),
+        "probabilities": probabilities,
+        "model_version": model_version
+    }
+
+def _mask_fields(pil_resized, seg_logits, pred_label, no_mask, mask_format, encoding, timings=None):
+    """-> (response fields, overlay image bytes or None) for the mask."""
+    if no_mask:
+        return {}, None
+    with torch.inference_mode():
+        if mask_format != "png":
+            mask_compact = _build_mask_compact(seg_logits, pred_label, mask_format)
+            if mask_compact is None:
+                return {}, None
+            return {"mask_rle" if mask_format == "rle" else "mask_polygons": mask_compact}, None
+        if seg_logits is None and pred_label != "Normal":
+            return {}, None
+        mask_img = _build_mask_image(pil_resized, seg_logits, pred_label, encoding)
+    if mask_img is None:
+        return {}, None
+    with timed(timings, "base64"):
+        mask_b64 = base64.b64encode(mask_img).decode("utf-8")
+    return {"mask_png_base64": mask_b64, "artifact_format": encoding.format}, mask_img
+
+def _heatmap_fields(pil_resized, pred_idx, cam, no_cam, encoding, bundle=None, timings=None):
+    """-> (response fields, overlay image bytes or None) for the Grad-CAM heatmap."""
+    if no_cam:
+        return {}, None
+    overlay_img = _build_cam_image(pil_resized, pred_idx, cam, encoding, bundle)
+    if overlay_img is None:
+        return {}, None
+    with timed(timings, "base64"):
+        overlay_b64 = base64.b64encode(overlay_img).decode("utf-8")
+    return {"heatmap_png_base64": overlay_b64, "artifact_format": encoding.format}, overlay_img
+
+def _class_heatmap_fields(pil_resized, classes, class_cams, encoding, bundle=None):
+    """
+    -> {"class_heatmaps_base64": {label: image}} for the cam_classes of a request.
+    class_cams: CAMs aligned with classes, or None to compute them with pytorch-grad-cam.
+    """
+    if not classes:
+        return {}
+    if class_cams is None:
+        class_cams = [_compute_library_cam(pil_resized, idx, bundle) for idx in classes]
+    heatmaps = {}
+    for idx, cam in zip(classes, class_cams):
+        if cam is None:
+            continue
+        try:
+            img = _render_heatmap(pil_resized, cam, encoding)
+        except Exception as e:
+            print("Grad-CAM rendering error:", e)
+            traceback.print_exc()
+            continue
+        heatmaps[CLASS_MAP_INV[idx]] = base64.b64encode(img).decode("utf-8")
+    if not heatmaps:
+        return {}
+    return {"class_heatmaps_base64": heatmaps, "artifact_format": encoding.format}
+
+def _prediction_row(filename, classification, overlay_img, mask_img, encoding):
+    # images go to the artifact store; the DB row only references them
+    ext = EXTENSIONS[encoding.format]
+    return {
+        "fn": filename, "pd": classification["predicted_disease"], "c": classification["confidence"],
+        "p": json.dumps(classification["probabilities"]),
+        "h": artifact_store.put(overlay_img, ext) if overlay_img is not None else None,
+        "m": artifact_store.put(mask_img, ext) if mask_img is not None else None,
+        "mv": classification.get("model_version"),
+    }
+
+def _build_result(filename, pil_resized, cls_logits, seg_logits, no_cam, no_mask, cam=None, mask_format="png",
+                  encoding=None, bundle=None, cam_classes=None, class_cams=None):
+    """
+    Turn one image's model outputs into (response dict, DB row dict).
+    cls_logits: (1, C), seg_logits: (1, 1, H, W) or None, cam: (H, W) single-pass CAM or None
+    mask_format: "png" (red overlay image) or "rle" / "polygon" (compact mask, see mask_codec)
+    encoding: ArtifactEncoding for the heatmap / overlay images (DEFAULT_ENCODING when None);
+              they keep the *_png_base64 keys whatever the format, "artifact_format" says which
+    cam_classes / class_cams: extra per-class heatmaps (class_cams None -> pytorch-grad-cam)
+    """
+    encoding = encoding or DEFAULT_ENCODING
+    bundle = bundle or _bundle
+    pred_idx, response = _classification(cls_logits, bundle.version)
+    mask_fields, mask_img = _mask_fields(pil_resized, seg_logits, response["predicted_disease"], no_mask,
+                                         mask_format, encoding)
+    heatmap_fields, overlay_img = _heatmap_fields(pil_resized, pred_idx, cam, no_cam, encoding, bundle)
+
+    row = _prediction_row(filename, response, overlay_img, mask_img, encoding)
+    response.update(heatmap_fields)
+    response.update(mask_fields)
+    response.update(_class_heatmap_fields(pil_resized, cam_classes, class_cams, encoding, bundle))
+    return response, row
+
+INSERT_PREDICTION_SQL = (
+    "INSERT INTO predictions (filename, predicted_disease, confidence, probabilities, heatmap_ref, mask_ref, "
+    "model_version) VALUES (:fn,:pd,:c,:p,:h,:m,:mv)"
+)
+
+_log_writer = PredictionLogWriter(engine, INSERT_PREDICTION_SQL, mode=LOG_DURABILITY,
+                                  max_queue=LOG_QUEUE_SIZE, max_batch=LOG_MAX_BATCH, linger_ms=LOG_LINGER_MS)
+atexit.register(_log_writer.close)
+
+def _insert_prediction(row):
+    # returns the new prediction id in sync mode, None otherwise
+    return _log_writer.submit(row)
+
+def _log_cached_result(filename, response, encoding):
+    """
+    Log a response served from the result cache as a new prediction row, so repeat uploads still
+    show up in /history; the images dedupe in the content-addressed artifact store.
+    -> the response with this row's prediction_id.
+    """
+    classification = {k: response.get(k) for k in ("predicted_disease", "confidence", "probabilities",
+                                                    "model_version")}
+    overlay_img = base64.b64decode(response["heatmap_png_base64"]) if response.get("heatmap_png_base64") else None
+    mask_img = base64.b64decode(response["mask_png_base64"]) if response.get("mask_png_base64") else None
+    encoding = encoding._replace(format=response.get("artifact_format", encoding.format))
+    prediction_id = _insert_prediction(_prediction_row(filename, classification, overlay_img, mask_img, encoding))
+    response = {k: v for k, v in response.items() if k != "prediction_id"}
+    if prediction_id is not None:
+        response["prediction_id"] = prediction_id
+    return response
+
+def _insert_predictions(rows):
+    # rows are committed by the background writer in batched transactions
+    _log_writer.submit_many(rows)
+
+# ---------------- /predict stages ----------------
+# Each stage takes and returns the job dict; the last one returns the response.
+def _stage_decode(job):
+    with timed(job["timings"], "decode"):
+        job["pil"] = _load_pil_resized(io.BytesIO(job["data"]))
+    with timed(job["timings"], "preprocess"):
+        # the thread-local buffer is only safe when this thread also runs the forward
+        job["inp"] = pil_to_tensor_for_model(job["pil"], reuse=job["inline"])
+    return job
+
+def _stage_model(job):
+    bundle = job["bundle"]
+    job["cam"] = None
+    timings = job["timings"]
+    if job["cam_classes"] and _has_cam_engine(bundle):
+        # argmax + every requested class from one forward and one batched backward
+        with timed(timings, "forward_cam"):
+            cls_logits, job["seg"], cams = _forward_with_class_cams(
+                job["inp"], job["cam_classes"], want_seg=not job["no_mask"], with_argmax=not job["no_cam"],
+                bundle=bundle)
+        job["cam"], job["class_cams"] = _split_class_cams(cams, 0, job["no_cam"])
+    elif _use_single_pass_cam(job["no_cam"], bundle):
+        # the CAM forward doubles as the classification + segmentation forward
+        # (coalesced with concurrent CAM requests by the micro-batcher when enabled)
+        with timed(timings, "forward_cam"):
+            cls_logits, job["seg"], cams = _forward_with_cam(job["inp"], want_seg=not job["no_mask"], bundle=bundle,
+                                                             direct=job["direct"])
+        job["cam"] = cams[0] if cams is not None else None
+    else:
+        # run forward (classification + segmentation) using inference_mode (uses less RAM)
+        # (coalesced with concurrent requests by the micro-batcher when enabled)
+        job["cam_pending"] = not job["no_cam"]
+        with timed(timings, "forward"):
+            cls_logits, job["seg"] = _forward(job["inp"], want_seg=not job["no_mask"], bundle=bundle,
+                                              direct=job["direct"])
+    job["pred_idx"], job["classification"] = _classification(cls_logits, bundle.version)
+    return job
+
+def _stage_cam(job):
+    # pytorch-grad-cam (CAM_MODE=gradcam) runs its own forward/backward here
+    if job.pop("cam_pending", False):
+        with timed(job["timings"], "cam"):
+            job["cam"] = _compute_library_cam(job["pil"], job["pred_idx"], job["bundle"])
+    if job["cam_classes"] and job.get("class_cams") is None:
+        with timed(job["timings"], "cam"):
+            job["class_cams"] = [_compute_library_cam(job["pil"], idx, job["bundle"]) for idx in job["cam_classes"]]
+    return job
+
+def _stage_render(job):
+    encoding, timings = job["encoding"], job["timings"]
+    with timed(timings, "mask"):
+        job["mask_fields"], job["mask_img"] = _mask_fields(
+            job["pil"], job["seg"], job["classification"]["predicted_disease"], job["no_mask"], job["mask_format"],
+            encoding, timings)
+    # no CAM at this point means it was skipped or failed upstream
+    with timed(timings, "heatmap"):
+        job["heatmap_fields"], job["overlay_img"] = _heatmap_fields(
+            job["pil"], job["pred_idx"], job["cam"], job["no_cam"] or job["cam"] is None, encoding, timings=timings)
+    with timed(timings if job["cam_classes"] else None, "class_heatmaps"):
+        job["class_heatmap_fields"] = _class_heatmap_fields(job["pil"], job["cam_classes"],
+                                                            job.get("class_cams") or [], encoding)
+    return job
+
+def _stage_log(job):
+    response = dict(job["classification"])
+    row = _prediction_row(job["filename"], response, job["overlay_img"], job["mask_img"], job["encoding"])
+    response.update(job["heatmap_fields"])
+    response.update(job["mask_fields"])
+    response.update(job["class_heatmap_fields"])
+
+    # store in DB; the id addresses /predictions/<id>/heatmap and /mask (known in sync mode only)
+    with timed(job["timings"], "db"):
+        prediction_id = _insert_prediction(row)
+    if prediction_id is not None:
+        response["prediction_id"] = prediction_id
+    return response
+
+PREDICT_STAGES = (
+    ("decode", _stage_decode, DECODE_WORKERS),
+    # enough threads for the micro-batcher to coalesce a full batch
+    ("model", _stage_model, max(1, BATCH_MAX_SIZE)),
+    ("cam", _stage_cam, 1),
+    ("render", _stage_render, 2 * max(1, RENDER_PROCESSES)),
+    ("log", _stage_log, 2),
+)
+
+_pipeline = Pipeline([Stage(name, fn, workers, PIPELINE_QUEUE_SIZE) for name, fn, workers in PREDICT_STAGES],
+                     name="predict") if PIPELINE else None
+
+def _staged_seconds(timings):
+    # "base64" is timed inside "mask" / "heatmap"
+    return sum(secs for name, secs in timings.stages.items() if name != "base64")
+
+def _predict_bytes(filename, data, no_cam, no_mask, mask_format="png", encoding=None, bundle=None, cam_classes=None,
+                   timings=None, inline=False):
+    """
+    Full /predict pipeline for one uploaded file: decode, forward, CAM, render/encode, DB insert.
+    timings: StageTimings filled per stage ("queue" = time spent waiting between pipeline stages)
+    inline: every stage on this thread, past the stage pipeline and the micro-batcher
+    """
+    job = {"filename": filename, "data": data, "no_cam": no_cam, "no_mask": no_mask,
+           "mask_format": mask_format, "encoding": encoding or DEFAULT_ENCODING, "inline": inline or _pipeline is None,
+           "bundle": bundle or _bundle, "cam_classes": cam_classes, "timings": timings, "direct": inline}
+    if _pipeline is not None and not inline:
+        # stages have their own threads: this request's render overlaps the next one's forward
+        if timings is None:
+            return _pipeline(job)
+        staged_before = _staged_seconds(timings)
+        start = time.perf_counter()
+        response = _pipeline(job)
+        staged = _staged_seconds(timings) - staged_before
+        timings.add("queue", max(0.0, time.perf_counter() - start - staged))
+        return response
+    for _, fn, _ in PREDICT_STAGES:
+        job = fn(job)
+    return job
+
+def _job_pool():
+    # created lazily (and again after a fork) so gunicorn workers get their own threads
+    global _job_executor, _job_executor_pid
+    with _job_executor_lock:
+        if _job_executor is None or _job_executor_pid != os.getpid():
+            _job_executor = ThreadPoolExecutor(max_workers=max(1, ASYNC_WORKERS), thread_name_prefix="artifact-job")
+            _job_executor_pid = os.getpid()
+        return _job_executor
+
+_async_cam_graphs = threading.BoundedSemaphore(max(1, ASYNC_CAM_GRAPHS))
+
+def _start_async_cam(inp_tensor, bundle):
+    """
+    Forward half of a single-pass CAM for an async request -> PendingCam, or None when
+    ASYNC_CAM_GRAPHS graphs are already waiting (or the forward fails).
+    """
+    if not _async_cam_graphs.acquire(blocking=False):
+        return None
+    try:
+        pending = bundle.cam_engine.start(inp_tensor)
+    except Exception as e:
+        _async_cam_graphs.release()
+        print("Single-pass Grad-CAM error:", e)
+        traceback.print_exc()
+        return None
+    pending.on_release = _async_cam_graphs.release
+    return pending
+
+def _finish_async_cam(pending, inp_tensor, want_seg, bundle):
+    """Backward half of _start_async_cam -> (seg_logits, cam or None); plain forward if the CAM fails."""
+    segment_rows = (lambda cls_logits: _seg_rows(cls_logits, want_seg)) if CONDITIONAL_SEG else None
+    try:
+        _, seg_logits, cams = pending.finish(out_size=(IMG_SIZE, IMG_SIZE), segment_rows=segment_rows)
+        return seg_logits, cams[0]
+    except Exception as e:
+        print("Single-pass Grad-CAM error:", e)
+        traceback.print_exc()
+    finally:
+        pending.cancel()
+    with torch.inference_mode():
+        _, seg_logits = _run_model(inp_tensor, want_seg, bundle)
+    return seg_logits, None
+
+def _predict_async(filename, data, no_cam, no_mask, mask_format="png", encoding=None, cache_key=None, bundle=None,
+                   timings=None):
+    """
+    Async /predict: classify now, return the diagnosis + job_id, and render CAM / mask in the
+    job pool. With single-pass CAM the classification forward keeps its autograd graph and the
+    job only runs the backward (and the decoder) on it; when ASYNC_CAM_GRAPHS graphs are already
+    waiting, the request classifies through the micro-batcher and its job runs a full CAM pass.
+    """
+    encoding = encoding or DEFAULT_ENCODING
+    bundle = bundle or _bundle
+    with timed(timings, "decode"):
+        pil_resized = _load_pil_resized(io.BytesIO(data))
+    with timed(timings, "preprocess"):
+        # not reuse=True: the job keeps the tensor after this thread moves on
+        inp_tensor = pil_to_tensor_for_model(pil_resized)
+    deferred_cam = _use_single_pass_cam(no_cam, bundle)
+    pending_cam = None
+    with timed(timings, "forward"):
+        if deferred_cam:
+            pending_cam = _start_async_cam(inp_tensor, bundle)
+        if pending_cam is not None:
+            cls_logits, seg_logits = pending_cam.cls_logits, None
+        else:
+            cls_logits, seg_logits = _forward(inp_tensor, want_seg=(not no_mask) and not deferred_cam,
+                                              bundle=bundle)
+    try:
+        pred_idx, classification = _classification(cls_logits, bundle.version)
+        job_id = _jobs.create(classification)
+        _job_pool().submit(_run_artifact_job, job_id, filename, pil_resized, inp_tensor, seg_logits, pred_idx,
+                           classification, no_cam, no_mask, mask_format, encoding, cache_key, bundle, timings,
+                           pending_cam)
+    except BaseException:
+        if pending_cam is not None:
+            pending_cam.cancel()
+        raise
+    response = {"job_id": job_id, "status": "running"}
+    response.update(classification)
+    return response
+
+def _run_artifact_job(job_id, filename, pil_resized, inp_tensor, seg_logits, pred_idx, classification,
+                      no_cam, no_mask, mask_format, encoding, cache_key, bundle, timings=None, pending_cam=None):
+    """
+    Job pool body: mask, then heatmap (each published as soon as it is encoded), then the DB row.
+    Stage timings still reach the histograms, after the response (and its Server-Timing) has gone.
+    pending_cam: the request's CAM forward (backward still to run), or None.
+    """
+    try:
+        cam = None
+        if pending_cam is not None:
+            with timed(timings, "cam"):
+                seg_logits, cam = _finish_async_cam(pending_cam, inp_tensor, not no_mask, bundle)
+        elif _use_single_pass_cam(no_cam, bundle):
+            with timed(timings, "forward_cam"):
+                _, seg_logits, cams = _forward_with_cam(inp_tensor, want_seg=not no_mask, bundle=bundle)
+            cam = cams[0] if cams is not None else None
+
+        with timed(timings, "mask"):
+            mask_fields, mask_img = _mask_fields(pil_resized, seg_logits, classification["predicted_disease"],
+                                                 no_mask, mask_format, encoding, timings)
+        if mask_fields:
+            _jobs.publish(job_id, "mask", mask_fields)
+        with timed(timings, "heatmap"):
+            heatmap_fields, overlay_img = _heatmap_fields(pil_resized, pred_idx, cam, no_cam, encoding, bundle, timings)
+        if heatmap_fields:
+            _jobs.publish(job_id, "heatmap", heatmap_fields)
+
+        done = {}
+        with timed(timings, "db"):
+            prediction_id = _insert_prediction(_prediction_row(filename, classification, overlay_img, mask_img,
+                                                               encoding))
+        if prediction_id is not None:
+            done["prediction_id"] = prediction_id
+        if cache_key is not None and _result_cache is not None:
+            # same shape as a synchronous /predict response, so later requests can hit it
+            full = dict(classification)
+            full.update(heatmap_fields)
+            full.update(mask_fields)
+            full.update(done)
+            _result_cache.put(cache_key, full)
+        _jobs.finish(job_id, done)
+    except Exception as e:
+        traceback.print_exc()
+        _jobs.fail(job_id, e)
+    finally:
+        if pending_cam is not None:
+            pending_cam.cancel()
+
+def _is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+def _collect_batch_uploads():
+    """
+    Read every uploaded image of a /predict/batch request into memory as (filename, bytes).
+    Accepts repeated "images" / "image" file fields and .zip archives of images.
+    Image count and total size are checked before anything is decompressed (zip bombs).
+    """
+    uploads = []
+    total_bytes = 0
+    max_total = int(MAX_BATCH_UNZIPPED_MB * 1024 * 1024)
+
+    def admit(name, size):
+        nonlocal total_bytes
+        if len(uploads) >= MAX_BATCH_IMAGES:
+            raise ValueError(f"too many images in batch (max {MAX_BATCH_IMAGES})")
+        total_bytes += size
+        if total_bytes > max_total:
+            raise ValueError(f"batch too large: over {MAX_BATCH_UNZIPPED_MB:g} MB of images (at {name})")
+
+    files = request.files.getlist("images") + request.files.getlist("image")
+    for f in files:
+        if f.filename == "":
+            continue
+        is_zip = f.filename.lower().endswith(".zip") or f.mimetype in ("application/zip", "application/x-zip-compressed")
+        if not is_zip:
+            data = f.read()
+            admit(f.filename, len(data))
+            uploads.append((f.filename, data))
+            continue
+        with zipfile.ZipFile(io.BytesIO(f.read())) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not _is_image_name(info.filename):
+                    continue
+                # declared sizes are checked before zf.read; no single member larger than the upload limit
+                if info.file_size > MAX_UPLOAD_MB * 1024 * 1024:
+                    raise ValueError(f"zip member too large: {info.filename}")
+                admit(info.filename, info.file_size)
+                uploads.append((info.filename, zf.read(info)))
+    return uploads
+
+def _iter_batch_results(uploads, no_cam, no_mask, mask_format="png", encoding=None, bundle=None, cam_classes=None):
+    """
+    Yield one NDJSON line per image as soon as it is finished. Images are decoded and run
+    through the model in real tensor batches of BATCH_MAX_SIZE; all successful rows are
+    bulk-inserted in a single transaction when the stream ends. With cam_classes, the CAMs of
+    every image x class of a chunk come from one forward and one batched backward.
+    """
+    # one model for the whole stream, even if a reload lands halfway through
+    bundle = bundle or _bundle
+    rows = []
+    chunk_size = max(1, BATCH_MAX_SIZE)
+    try:
+        for start in range(0, len(uploads), chunk_size):
+            chunk = []
+            for index in range(start, min(start + chunk_size, len(uploads))):
+                filename, data = uploads[index]
+                try:
+                    chunk.append((index, filename, _load_pil_resized(io.BytesIO(data))))
+                except Exception as e:
+                    yield json.dumps({"index": index, "filename": filename, "error": f"could not decode image: {e}"}) + "\n"
+            if not chunk:
+                continue
+
+            # normalize straight into one preallocated batch array
+            batch_np = _preprocessor.new_batch(len(chunk))
+            for row_idx, (_, _, pil_resized) in enumerate(chunk):
+                _preprocessor.to_array(pil_resized, out=batch_np[row_idx])
+            batch = torch.from_numpy(batch_np).to(DEVICE)
+            cams = class_cams = None
+            if cam_classes and _has_cam_engine(bundle):
+                cls_logits, seg_logits, class_cams = _forward_with_class_cams(
+                    batch, cam_classes, want_seg=not no_mask, with_argmax=not no_cam, bundle=bundle)
+            elif _use_single_pass_cam(no_cam, bundle):
+                cls_logits, seg_logits, cams = _forward_with_cam(batch, want_seg=not no_mask, bundle=bundle,
+                                                                 direct=True)
+            else:
+                with torch.inference_mode():
+                    cls_logits, seg_logits = _run_model(batch, want_seg=not no_mask, bundle=bundle)
+
+            for row_idx, (index, filename, pil_resized) in enumerate(chunk):
+                try:
+                    seg_row = seg_logits[row_idx:row_idx + 1] if seg_logits is not None else None
+                    cam = cams[row_idx] if cams is not None else None
+                    row_class_cams = None
+                    if class_cams is not None:
+                        cam, row_class_cams = _split_class_cams(class_cams, row_idx, no_cam)
+                    response, row = _build_result(filename, pil_resized, cls_logits[row_idx:row_idx + 1], seg_row,
+                                                  no_cam, no_mask, cam, mask_format, encoding, bundle,
+                                                  cam_classes, row_class_cams)
+                    rows.append(row)
+                    out = {"index": index, "filename": filename}
+                    out.update(response)
+                except Exception as e:
+                    traceback.print_exc()
+                    out = {"index": index, "filename": filename, "error": str(e)}
+                yield json.dumps(out) + "\n"
+    finally:
+        # runs even if the client disconnects mid-stream
+        try:
+            _insert_predictions(rows)
+        except Exception as e:
+            print("Bulk insert of batch predictions failed:", e)
+            traceback.print_exc()
+
+# ---------------- Metrics ----------------
+# GET /metrics (Prometheus text format); every response carries a Server-Timing header
+metrics = Registry()
+PREDICT_STAGE_SECONDS = Histogram("predict_stage_seconds", "Time spent in each /predict stage", ("stage",))
+
+def _model_info():
+    b = _bundle
+    if b is None:
+        return {}
+    return {(b.version, DEVICE, b.engine.name if b.engine is not None else "none", b.precision, CAM_MODE): 1}
+
+def _pipeline_gauge(field):
+    return lambda: {(name, ): st[field] for name, st in _pipeline.stats().items()} if _pipeline is not None else {}
+
+instrument_app(app, metrics, PREDICT_STAGE_SECONDS)
+metrics.register(PREDICT_STAGE_SECONDS)
+metrics.register(Gauge("model_info", "Active model (value is always 1)",
+                       ("version", "device", "engine", "precision", "cam_mode"), fn=_model_info))
+metrics.register(Gauge("model_ready", "1 once this process has loaded the model and warmed up",
+                       fn=lambda: int(is_ready())))
+metrics.register(Gauge("predict_pipeline_queue_depth", "Jobs queued per /predict pipeline stage", ("stage",),
+                       fn=_pipeline_gauge("queued")))
+metrics.register(Gauge("predict_pipeline_busy", "Jobs being processed per /predict pipeline stage", ("stage",),
+                       fn=_pipeline_gauge("busy")))
+metrics.register(Gauge("batcher_queue_depth", "Forward requests waiting for the micro-batcher",
+                       fn=lambda: _batcher.qsize() if _batcher is not None else 0))
+metrics.register(Gauge("prediction_log_queue_depth", "Prediction rows waiting for the DB writer",
+                       fn=lambda: _log_writer.stats()["queue_depth"]))
+metrics.register(Gauge("async_jobs_running", "Async /predict artifact jobs still rendering",
+                       fn=lambda: _jobs.stats()["running"]))
+metrics.register(Gauge("result_cache_bytes", "Result cache memory tier size",
+                       fn=lambda: _result_cache.stats()["bytes"] if _result_cache is not None else 0))
 
 # ---------------- Routes ----------------
 @app.route("/", methods=["GET", "HEAD"])
@@ -337,41 +1574,195 @@ def index():
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok", "device": DEVICE})
+    # liveness only; load balancers should gate traffic on /ready
+    return jsonify({"status": "ok", "device": DEVICE, "engine": _engine.name if _engine is not None else None,
+                    "precision": _precision, "model_loaded": _model is not None, "ready": is_ready(),
+                    "model_version": _bundle.version if _bundle is not None else None, "memory": memory_usage(),
+                    "torch_threads": torch.get_num_threads(), "interop_threads": torch.get_num_interop_threads()})
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """200 once this process has loaded the model and finished warm-up, 503 before (or on failure)."""
+    if is_ready():
+        return jsonify({"status": "ready"})
+    if _startup_error is not None:
+        return jsonify({"status": "error", "error": _startup_error}), 503
+    return jsonify({"status": "starting", "model_loaded": _model is not None}), 503
+
+def _encode_cursor(created_at, pid):
+    raw = json.dumps([created_at, pid]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def _decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created_at, pid = json.loads(raw)
+        return str(created_at), int(pid)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+def _history_query(args):
+    """Build (sql, params, limit) for /history from query args; raises ValueError on bad input."""
+    limit = int(args.get("limit", HISTORY_DEFAULT_LIMIT))
+    if not 1 <= limit <= HISTORY_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {HISTORY_MAX_LIMIT}")
+
+    where = []
+    params = {"limit": limit + 1}
+    if args.get("disease"):
+        where.append("predicted_disease = :disease")
+        params["disease"] = args["disease"]
+    if args.get("min_confidence") is not None:
+        where.append("confidence >= :cmin")
+        params["cmin"] = float(args["min_confidence"])
+    if args.get("max_confidence") is not None:
+        where.append("confidence <= :cmax")
+        params["cmax"] = float(args["max_confidence"])
+    # dates compare as text against CURRENT_TIMESTAMP ("YYYY-MM-DD HH:MM:SS")
+    if args.get("from"):
+        where.append("created_at >= :dfrom")
+        params["dfrom"] = args["from"].replace("T", " ")
+    if args.get("to"):
+        where.append("created_at < :dto")
+        params["dto"] = args["to"].replace("T", " ")
+    if args.get("cursor"):
+        # keyset: strictly after the last row of the previous page in (created_at, id) DESC order
+        params["cur_ts"], params["cur_id"] = _decode_cursor(args["cursor"])
+        where.append("(created_at, id) < (:cur_ts, :cur_id)")
+
+    sql = ("SELECT id, filename, predicted_disease, confidence, probabilities, created_at, model_version "
+           "FROM predictions")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT :limit"
+    return sql, params, limit
 
 @app.route("/history", methods=["GET"])
 def history():
+    """
+    Keyset-paginated prediction history, newest first.
+    Query params (all optional):
+      - limit=N                 -> page size (default 50, max 200)
+      - cursor=<token>          -> next_cursor from the previous page
+      - disease=<label>         -> exact predicted_disease
+      - min_confidence / max_confidence (a range without disease uses the confidence index and
+                                         sorts the matches; a single bound walks the newest-first index)
+      - from / to               -> created_at range, ISO date or datetime (to is exclusive)
+    Returns {"items": [...], "next_cursor": <token or null>}
+    """
     try:
+        try:
+            sql, params, limit = _history_query(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         with engine.connect() as conn:
-            rows = conn.execute(text(
-                "SELECT id, filename, predicted_disease, confidence, probabilities, created_at FROM predictions ORDER BY created_at DESC LIMIT 200"
-            )).fetchall()
+            rows = conn.execute(text(sql), params).fetchall()
         out = []
-        for r in rows:
+        for r in rows[:limit]:
             out.append({
                 "id": r[0],
                 "filename": r[1],
                 "predicted_disease": r[2],
                 "confidence": float(r[3]) if r[3] is not None else None,
                 "probabilities": json.loads(r[4]) if r[4] else None,
-                "created_at": str(r[5])
+                "created_at": str(r[5]),
+                "model_version": r[6]
             })
-        return jsonify(out)
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = _encode_cursor(str(last[5]), last[0])
+        return jsonify({"items": out, "next_cursor": next_cursor})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _serve_artifact(pid, kind):
+    """Serve a prediction's heatmap or mask with a content ETag and long-lived Cache-Control."""
+    with engine.connect() as conn:
+        r = conn.execute(text(
+            f"SELECT {kind}_ref, {kind}_base64 FROM predictions WHERE id = :id"
+        ), {"id": pid}).fetchone()
+    if r is None:
+        return jsonify({"error": "prediction not found"}), 404
+    ref, legacy_b64 = r[0], r[1]
+
+    if ref:
+        try:
+            resp = send_file(artifact_store.path(ref), mimetype=artifact_store.mimetype(ref),
+                             etag=artifact_store.etag(ref), conditional=True, max_age=ARTIFACT_MAX_AGE)
+        except (ValueError, FileNotFoundError):
+            return jsonify({"error": f"{kind} artifact missing"}), 404
+    elif legacy_b64:
+        # row not migrated yet (see migrate_artifacts.py)
+        data = base64.b64decode(legacy_b64)
+        resp = Response(data, mimetype="image/png")
+        resp.set_etag(hashlib.sha256(data).hexdigest())
+        resp = resp.make_conditional(request)
+    else:
+        return jsonify({"error": f"no {kind} for this prediction"}), 404
+
+    # artifacts are content-addressed, so a given id/kind never changes
+    resp.headers["Cache-Control"] = f"public, max-age={ARTIFACT_MAX_AGE}, immutable"
+    return resp
+
+@app.route("/predictions/<int:pid>/heatmap", methods=["GET"])
+def prediction_heatmap(pid):
+    return _serve_artifact(pid, "heatmap")
+
+@app.route("/predictions/<int:pid>/mask", methods=["GET"])
+def prediction_mask(pid):
+    return _serve_artifact(pid, "mask")
+
+def _pack_response(response, transport, encoding):
+    # the cached result is always the JSON form; binary transports unpack the base64 images
+    if transport == "msgpack":
+        return Response(pack_msgpack(response), mimetype="application/msgpack")
+    if transport == "multipart":
+        body, content_type = pack_multipart(response, ARTIFACT_MIMETYPES[encoding.format])
+        return Response(body, content_type=content_type)
+    return jsonify(response)
+
+def _body_too_large(limit_mb):
+    """413 response when the declared request body exceeds limit_mb, else None."""
+    if request.content_length is not None and request.content_length > limit_mb * 1024 * 1024:
+        return jsonify({"error": f"request body too large (max {limit_mb:g} MB)"}), 413
+    return None
+
 @app.route("/predict", methods=["POST"])
 def predict():
     """
-    POST multipart/form-data with key "image" -> file
+    POST multipart/form-data with key "image" -> file (body up to MAX_UPLOAD_MB, else 413)
     Optional query params:
       - no_cam=1   -> skip Grad-CAM generation
       - no_mask=1  -> skip mask generation (return no mask)
+      - mask_format=png|rle|polygon -> red overlay PNG (default) or a compact mask
+        ("mask_rle" / "mask_polygons" with "size": [h, w]) to draw on the original image
+      - artifact_format=png|webp|jpeg, quality=1-100, png_level=0-9 -> heatmap / mask image encoding
+      - transport=json|multipart|msgpack -> base64 JSON (default), multipart/mixed with a JSON part
+        plus binary "heatmap" / "mask" parts, or MessagePack with raw bytes under "heatmap" / "mask"
+        (also negotiated from the Accept header)
+      - async=1    -> return the diagnosis with "job_id" right away (HTTP 202); heatmap / mask come
+        from GET /jobs/<job_id> or the SSE stream /jobs/<job_id>/events (a cache hit returns the full result;
+        503 while JOB_MAX jobs are still running). With single-pass CAM the diagnosis comes from the
+        CAM forward (fp32 eager, autograd on) and the job only adds the backward: one encoder pass per
+        request, unless ASYNC_CAM_GRAPHS forwards are already waiting for a job (then two)
+    Identical uploads may be answered from the result cache (X-Cache: HIT / DISK / WAIT); they are
+    still logged as their own prediction row with a new prediction_id.
+      - cam_classes=all|<label>,<label> -> also "class_heatmaps_base64": {label: image} with one
+        heatmap per listed class, all from the same forward pass (not with async=1)
+      - profile=1 (or header "X-Profile: 1"; X-Admin-Token required) -> run this request under
+        torch.profiler + cProfile, bypassing the cache; adds "profile" with the top operators /
+        Python functions and the URLs of the stored Chrome trace and tables (not with async=1)
     """
     try:
-        # ensure model + DB ready
-        load_model()
-        init_db()
+        too_large = _body_too_large(MAX_UPLOAD_MB)
+        if too_large is not None:
+            return too_large
+        # no-op after startup; loads lazily if the server was started without it
+        init_resources()
+        # this request runs start to finish on the model that is active now
+        bundle = _bundle
 
         if "image" not in request.files:
             return jsonify({"error": "no image file uploaded under key 'image'"}), 400
@@ -379,125 +1770,237 @@ def predict():
         if f.filename == "":
             return jsonify({"error": "empty filename"}), 400
 
-        no_cam = request.args.get("no_cam", "0").lower() in ("1", "true", "yes")
-        no_mask = request.args.get("no_mask", "0").lower() in ("1", "true", "yes")
+        no_cam, no_mask = _parse_flags(request.args)
+        try:
+            mask_format = _parse_mask_format(request.args)
+            encoding = parse_encoding(request.args, DEFAULT_ENCODING)
+            transport = negotiate_transport(request.args, request.headers.get("Accept"))
+            cam_classes = _parse_cam_classes(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        is_async = _parse_async(request.args)
+        if is_async and cam_classes:
+            return jsonify({"error": "cam_classes is not supported with async=1"}), 400
+        profile_requested = _parse_profile(request)
+        if profile_requested:
+            denied = _admin_denied()
+            if denied is not None:
+                return denied
+            if is_async:
+                return jsonify({"error": "profile is not supported with async=1"}), 400
+        # sampling skips async requests and never waits for a profile already running
+        sampled = (not profile_requested and not is_async and _profiler.should_sample()
+                   and not _profiler.busy())
+        if profile_requested or sampled:
+            # stage ranges in the trace; profiler overhead is kept out of the stage histograms
+            g.timings = ProfiledTimings()
+        timings = g.timings
+        with timed(timings, "read"):
+            data = f.read()
 
-        pil = Image.open(f.stream).convert("RGB")
-        pil_resized = pil.resize((IMG_SIZE, IMG_SIZE))
-        inp_tensor = pil_to_tensor_for_model(pil_resized)
+        key = None
+        if _result_cache is not None:
+            key = make_key(data, bundle.model_id, no_cam=no_cam, no_mask=no_mask, mask_format=mask_format,
+                           artifact_format=encoding.format, quality=encoding.quality, png_level=encoding.png_level,
+                           cam_classes=cam_classes)
+
+        if is_async:
+            response = _result_cache.get(key) if key is not None else None
+            if response is None:
+                if not _jobs.has_room():
+                    return _jobs_full_response()
+                try:
+                    response = _predict_async(f.filename, data, no_cam, no_mask, mask_format, encoding, key, bundle,
+                                              timings)
+                except JobStoreFull:
+                    return _jobs_full_response()
+                with timed(timings, "serialize"):
+                    resp = _pack_response(response, transport, encoding)
+                resp.status_code = 202
+                resp.headers["X-Cache"] = "MISS" if key is not None else "OFF"
+                return resp
+            cache_status = "hit"
+        elif profile_requested or sampled:
+            # cProfile only sees this thread: no cache, pipeline threads or micro-batcher
+            with _profiler.profile(f.filename, sampled, timings) as run:
+                response = _predict_bytes(f.filename, data, no_cam, no_mask, mask_format, encoding, bundle,
+                                          cam_classes, timings, inline=True)
+            cache_status = "bypass"
+            if profile_requested:
+                files = {name: f"/admin/profiles/{run.id}/{name}" for name in ("trace.json", "ops.txt", "python.txt")}
+                response = dict(response, profile=dict(run.summary(), files=files))
+        elif _result_cache is None:
+            response, cache_status = _predict_bytes(f.filename, data, no_cam, no_mask, mask_format, encoding,
+                                                    bundle, cam_classes, timings), "off"
+        else:
+            # identical uploads (same bytes, model and flags) are served from cache, and
+            # concurrent duplicates wait on the one in-flight computation
+            response, cache_status = _result_cache.get_or_compute(
+                key, lambda: _predict_bytes(f.filename, data, no_cam, no_mask, mask_format, encoding, bundle,
+                                            cam_classes, timings))
+
+        if cache_status in ("hit", "disk", "wait"):
+            # computed (and logged) for an earlier upload: this one gets its own history row
+            with timed(timings, "db"):
+                response = _log_cached_result(f.filename, response, encoding)
+
+        with timed(timings, "serialize"):
+            resp = _pack_response(response, transport, encoding)
+        resp.headers["X-Cache"] = cache_status.upper()
+        timings.note("cache", cache_status.upper())
+        if profile_requested or sampled:
+            resp.headers["X-Profile-Id"] = run.id
+        return resp
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Async /predict job: "status" (running | done | error) plus every field produced so far."""
+    snapshot = _jobs.snapshot(job_id)
+    if snapshot is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(snapshot)
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Server-sent events for an async /predict job, replayed from the start:
+    "classification", then "mask" / "heatmap" as each is encoded, then "done" or "error".
+    """
+    if _jobs.snapshot(job_id) is None:
+        return jsonify({"error": "job not found"}), 404
 
-        # run forward (classification + segmentation) under no_grad
-        # with torch.no_grad():
-         # run forward (classification + segmentation) using inference_mode (uses less RAM)
-        with torch.inference_mode():
-            out = _model(inp_tensor)
-            # Handle potential output formats
-            if isinstance(out, (list, tuple)):
-                cls_logits = out[0]
-                seg_logits = out[1] if len(out) > 1 else None
+    def _stream():
+        for name, data in _jobs.events(job_id):
+            if name is None:
+                yield ": keepalive\n\n"
             else:
-                cls_logits = out
-                seg_logits = None
+                yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
 
-            if not isinstance(cls_logits, torch.Tensor):
-                raise RuntimeError(f"Unexpected classification output type: {type(cls_logits)}")
+    resp = Response(_stream(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
-            # --- CLASSIFICATION LOGIC ---
-            probs = torch.softmax(cls_logits, dim=1).cpu().numpy()[0]
-            pred_idx = int(np.argmax(probs))
-            pred_label = CLASS_MAP_INV.get(pred_idx, str(pred_idx))
-            confidence = float(probs[pred_idx])
+@app.route("/log/stats", methods=["GET"])
+def log_stats():
+    return jsonify(_log_writer.stats())
 
-            # --- SEGMENTATION MASK LOGIC (UPDATED) ---
-            mask_b64 = None
-            if (not no_mask) and (seg_logits is not None):
-                try:
-                    seg_prob = torch.sigmoid(seg_logits).detach().cpu().numpy()[0, 0]
-                    
-                    # 1. NORMAL SUPPRESSION (If Normal, mask is empty)
-                    if pred_label == "Normal":
-                        mask_uint8 = np.zeros_like(seg_prob, dtype="uint8")
-                    else:
-                        # 2. LOW THRESHOLD (0.25 to catch partial confidence)
-                        mask_uint8 = (seg_prob > 0.25).astype("uint8") * 255
-                    
-                    # 3. GENERATE RED OVERLAY
-                    if mask_uint8.max() > 0:
-                        # Use the new Red Overlay function
-                        mask_pil_overlay = overlay_red_mask_on_pil(pil_resized, mask_uint8)
-                        mask_b64 = encode_base64_png_from_pil(mask_pil_overlay)
-                    else:
-                        # Return clean image if empty
-                        mask_b64 = encode_base64_png_from_pil(pil_resized)
-                        
-                except Exception as e:
-                    print(f"Mask generation failed: {e}")
-                    traceback.print_exc()
-                    mask_b64 = None
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    if _result_cache is None:
+        return jsonify({"enabled": False})
+    out = _result_cache.stats()
+    out["enabled"] = True
+    return jsonify(out)
 
-        # Grad-CAM (thread-safe)
-        overlay_b64 = None
-        if (not no_cam) and (_gradcam is not None) and (preprocess_image is not None):
-            try:
-                rgb_for_cam = np.array(pil_resized).astype(np.float32) / 255.0
-                input_for_cam = preprocess_image(rgb_for_cam, mean=MEAN, std=STD).to(DEVICE)
-                # thread-safe call
-                with _gradcam_lock:
-                    grayscale_cam = _gradcam(input_for_cam, targets=[ClassifierOutputTarget(pred_idx)])
-                
-                cam_np = np.array(grayscale_cam)
-                cam_np = np.squeeze(cam_np)
-                if cam_np.ndim == 3:
-                    cam_np = cam_np[0]
-                
-                cam_np = cam_np.astype(np.float32)
-                if cam_np.max() > 0:
-                    cam_np = (cam_np - cam_np.min()) / (cam_np.max() - cam_np.min() + 1e-8)
-                else:
-                    cam_np = np.zeros((IMG_SIZE, IMG_SIZE), dtype=np.float32)
-                
-                if cam_np.shape != (IMG_SIZE, IMG_SIZE):
-                    cam_np = cv2.resize(cam_np, (IMG_SIZE, IMG_SIZE))
-                
-                overlay_pil = overlay_heatmap_on_pil(pil_resized, cam_np)
-                overlay_b64 = encode_base64_png_from_pil(overlay_pil)
-            except Exception as e:
-                print("Grad-CAM generation error:", e)
-                traceback.print_exc()
-                overlay_b64 = None
-
-        probabilities_json = json.dumps({CLASS_MAP_INV[i]: float(round(float(probs[i]), 6)) for i in range(len(probs))})
-
-        # store in DB
-        with engine.begin() as conn:
-            conn.execute(text(
-                "INSERT INTO predictions (filename, predicted_disease, confidence, probabilities, heatmap_base64, mask_base64) VALUES (:fn,:pd,:c,:p,:h,:m)"
-            ), {"fn": f.filename, "pd": pred_label, "c": confidence, "p": probabilities_json, "h": overlay_b64, "m": mask_b64})
-
-        response = {
-            "predicted_disease": pred_label,
-            "confidence": confidence,
-            "probabilities": json.loads(probabilities_json)
-        }
-        if overlay_b64 is not None:
-            response["heatmap_png_base64"] = overlay_b64
-        if mask_b64 is not None:
-            response["mask_png_base64"] = mask_b64
-
-        return jsonify(response)
+@app.route("/pipeline/stats", methods=["GET"])
+def pipeline_stats():
+    if _pipeline is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, "stages": _pipeline.stats(),
+                    "render_processes": RENDER_PROCESSES if _render_pool is not None else 0})
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """
+    POST multipart/form-data with any number of files under key "images" (or "image"),
+    and/or .zip archives of images. Same query params as /predict, except transport (always NDJSON).
+    Streams application/x-ndjson: one JSON object per image, in upload order,
+    with "index", "filename" and the same fields /predict returns (or "error").
+    Limits: request body MAX_BATCH_UPLOAD_MB (413), at most MAX_BATCH_IMAGES images and
+    MAX_BATCH_UNZIPPED_MB of decompressed images, no single image over MAX_UPLOAD_MB (400).
+    """
+    try:
+        too_large = _body_too_large(MAX_BATCH_UPLOAD_MB)
+        if too_large is not None:
+            return too_large
+        init_resources()
+
+        no_cam, no_mask = _parse_flags(request.args)
+        try:
+            mask_format = _parse_mask_format(request.args)
+            encoding = parse_encoding(request.args, DEFAULT_ENCODING)
+            cam_classes = _parse_cam_classes(request.args)
+            uploads = _collect_batch_uploads()
+        except (ValueError, zipfile.BadZipFile) as e:
+            return jsonify({"error": str(e)}), 400
+        if not uploads:
+            return jsonify({"error": "no image files uploaded under key 'images'"}), 400
+
+        return Response(_iter_batch_results(uploads, no_cam, no_mask, mask_format, encoding, _bundle, cam_classes),
+                        mimetype="application/x-ndjson")
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+def _admin_denied():
+    # -> error response, or None when the request carries the admin token
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "admin endpoints are disabled (set ADMIN_TOKEN)"}), 404
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        return jsonify({"error": "invalid admin token"}), 403
+    return None
+
+@app.route("/admin/model", methods=["GET"])
+def admin_model():
+    denied = _admin_denied()
+    if denied is not None:
+        return denied
+    return jsonify({"active": _bundle.info() if _bundle is not None else None, "reload": dict(_reload_status),
+                    "watch": MODEL_WATCH})
+
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    """
+    Hot reload the model in this process (X-Admin-Token header required).
+    Optional JSON body {"path": "<checkpoint file name or path>"} inside the models directory
+    (default MODEL_PATH). Returns 202 at once; GET /admin/model shows progress and the active version.
+    """
+    denied = _admin_denied()
+    if denied is not None:
+        return denied
+    body = request.get_json(silent=True) or {}
+    path = MODEL_PATH
+    if body.get("path"):
+        path = (MODEL_PATH.parent / str(body["path"])).resolve()
+        if path.parent != MODEL_PATH.parent.resolve():
+            return jsonify({"error": "checkpoint must be in the models directory"}), 400
+        if not path.is_file():
+            return jsonify({"error": f"checkpoint not found: {path.name}"}), 400
+    if not reload_model_async(path):
+        return jsonify({"error": "a reload is already running", "reload": dict(_reload_status)}), 409
+    return jsonify({"status": "reloading", "path": str(path),
+                    "current": _bundle.version if _bundle is not None else None}), 202
+
+@app.route("/admin/profiles", methods=["GET"])
+def admin_profiles():
+    """Stored request profiles, newest first (X-Admin-Token header required)."""
+    denied = _admin_denied()
+    if denied is not None:
+        return denied
+    return jsonify({"profiles": _profiler.list(), **_profiler.stats()})
+
+@app.route("/admin/profiles/<profile_id>/<name>", methods=["GET"])
+def admin_profile_file(profile_id, name):
+    """trace.json (load in chrome://tracing or ui.perfetto.dev), ops.txt, python.txt or meta.json."""
+    denied = _admin_denied()
+    if denied is not None:
+        return denied
+    path = _profiler.path(profile_id, name)
+    if path is None:
+        return jsonify({"error": "profile not found"}), 404
+    mimetype = "application/json" if name.endswith(".json") else "text/plain"
+    return send_file(path, mimetype=mimetype)
+
 # ---------------- Main ----------------
 if __name__ == "__main__":
     print("Starting Flask server on 0.0.0.0:8000")
-    init_db()
-    # lazy model load on first request, or load now:
-    try:
-        load_model()
-    except Exception as e:
-        print("Model failed to load on startup:", e)
-    # For production use a WSGI server (gunicorn, waitress, etc.)
+    # DB schema, model load and warm-up before accepting traffic (errors show up on /ready)
+    startup()
+    # For production use gunicorn: gunicorn -c gunicorn.conf.py
     app.run(host="0.0.0.0", port=8000, debug=False)
\ No newline at end of file
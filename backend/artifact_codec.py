@@ -0,0 +1,123 @@
+# artifact_codec.py
+"""
+Heatmap / mask image encoding and /predict response transports.
+- Formats: PNG (compress_level 0-9), WebP (quality 1-100, 100 = lossless), JPEG (quality 1-95)
+- Transports: base64-in-JSON (default), multipart/mixed with binary image parts, MessagePack
+  (per-class heatmaps: "class_heatmap:<label>" parts / a "class_heatmaps" {label: bytes} map)
+"""
+import io
+import json
+import base64
+import uuid
+from collections import namedtuple
+
+# tolerant import of msgpack (optional dependency)
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+
+FORMATS = ("png", "webp", "jpeg")
+TRANSPORTS = ("json", "multipart", "msgpack")
+EXTENSIONS = {"png": "png", "webp": "webp", "jpeg": "jpg"}
+MIMETYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+# response keys holding base64 images in the JSON transport -> part / field names
+IMAGE_FIELDS = {"heatmap_png_base64": "heatmap", "mask_png_base64": "mask"}
+# {label: base64 image} of cam_classes requests
+CLASS_IMAGES_FIELD = "class_heatmaps_base64"
+
+ArtifactEncoding = namedtuple("ArtifactEncoding", ["format", "quality", "png_level"])
+
+
+def parse_encoding(args, default):
+    """ArtifactEncoding from ?artifact_format=&quality=&png_level=, falling back to default."""
+    fmt = args.get("artifact_format", default.format).lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in FORMATS:
+        raise ValueError(f"artifact_format must be one of {', '.join(FORMATS)}")
+    quality = int(args.get("quality", default.quality))
+    png_level = int(args.get("png_level", default.png_level))
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    if not 0 <= png_level <= 9:
+        raise ValueError("png_level must be between 0 and 9")
+    return ArtifactEncoding(fmt, quality, png_level)
+
+
+def encode_image(pil_img, encoding):
+    buff = io.BytesIO()
+    if encoding.format == "png":
+        pil_img.save(buff, format="PNG", compress_level=encoding.png_level)
+    elif encoding.format == "webp":
+        pil_img.save(buff, format="WEBP", quality=encoding.quality, lossless=encoding.quality >= 100, method=4)
+    else:
+        pil_img.save(buff, format="JPEG", quality=min(encoding.quality, 95))
+    return buff.getvalue()
+
+
+def negotiate_transport(args, accept_header):
+    transport = args.get("transport")
+    if transport is None:
+        accept = (accept_header or "").lower()
+        if "application/msgpack" in accept or "application/x-msgpack" in accept:
+            transport = "msgpack"
+        elif "multipart/mixed" in accept:
+            transport = "multipart"
+        else:
+            transport = "json"
+    transport = transport.lower()
+    if transport not in TRANSPORTS:
+        raise ValueError(f"transport must be one of {', '.join(TRANSPORTS)}")
+    if transport == "msgpack" and msgpack is None:
+        raise ValueError("msgpack transport requested but msgpack is not installed")
+    return transport
+
+
+def _split_images(result):
+    # -> (JSON fields, {"heatmap" / "mask": bytes}, {class label: bytes})
+    meta = {k: v for k, v in result.items() if k not in IMAGE_FIELDS and k != CLASS_IMAGES_FIELD}
+    images = {IMAGE_FIELDS[k]: base64.b64decode(v) for k, v in result.items() if k in IMAGE_FIELDS and v}
+    class_images = {label: base64.b64decode(v) for label, v in (result.get(CLASS_IMAGES_FIELD) or {}).items() if v}
+    return meta, images, class_images
+
+
+def pack_msgpack(result):
+    """
+    Same fields as the JSON response, with "heatmap" / "mask" as raw bytes instead of base64
+    and "class_heatmaps" {label: bytes} instead of "class_heatmaps_base64".
+    """
+    meta, images, class_images = _split_images(result)
+    meta.update(images)
+    if class_images:
+        meta["class_heatmaps"] = class_images
+    return msgpack.packb(meta, use_bin_type=True)
+
+
+def pack_multipart(result, image_mimetype):
+    """
+    multipart/mixed body: one application/json part, then one binary part per image
+    ("heatmap", "mask", "class_heatmap:<label>").
+    """
+    meta, images, class_images = _split_images(result)
+    for label, data in class_images.items():
+        images[f"class_heatmap:{label}"] = data
+    boundary = uuid.uuid4().hex
+    out = io.BytesIO()
+
+    def _part(headers, body):
+        out.write(f"--{boundary}\r\n".encode("ascii"))
+        for k, v in headers:
+            out.write(f"{k}: {v}\r\n".encode("ascii"))
+        out.write(b"\r\n")
+        out.write(body)
+        out.write(b"\r\n")
+
+    _part([("Content-Type", "application/json"), ("Content-Disposition", 'inline; name="result"')],
+          json.dumps(meta).encode("utf-8"))
+    for name, data in images.items():
+        _part([("Content-Type", image_mimetype), ("Content-Disposition", f'inline; name="{name}"'),
+               ("Content-Length", str(len(data)))], data)
+    out.write(f"--{boundary}--\r\n".encode("ascii"))
+    return out.getvalue(), f"multipart/mixed; boundary={boundary}"
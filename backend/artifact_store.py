@@ -0,0 +1,63 @@
+# artifact_store.py
+"""
+Content-addressed on-disk store for heatmap / mask images.
+- put(bytes, ext) writes <root>/<h[0:2]>/<h[2:4]>/<sha256>.<ext> once and returns the ref "<sha256>.<ext>"
+- Identical artifacts are stored once; files are immutable after write
+- Refs are validated before touching the filesystem
+"""
+import os
+import re
+import hashlib
+import tempfile
+from pathlib import Path
+
+MIMETYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+}
+
+_REF_RE = re.compile(r"^([0-9a-f]{64})\.(png|webp|jpg|jpeg)$")
+
+
+def parse_ref(ref):
+    """Return (sha256, ext) for a valid ref, else raise ValueError."""
+    m = _REF_RE.match(ref or "")
+    if not m:
+        raise ValueError(f"invalid artifact ref: {ref!r}")
+    return m.group(1), m.group(2)
+
+
+class ArtifactStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, ref):
+        digest, _ = parse_ref(ref)
+        return self.root / digest[:2] / digest[2:4] / ref
+
+    def put(self, data, ext="png"):
+        ext = ext.lower()
+        if ext not in MIMETYPES:
+            raise ValueError(f"unsupported artifact type: {ext}")
+        ref = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+        path = self.path(ref)
+        if path.exists():
+            return ref
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write-then-rename so concurrent readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        return ref
+
+    @staticmethod
+    def etag(ref):
+        return parse_ref(ref)[0]
+
+    @staticmethod
+    def mimetype(ref):
+        return MIMETYPES[parse_ref(ref)[1]]
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+CPU thread / worker autotuning for MultiTaskNet on this machine.
+
+Sweeps torch intra-op threads, inter-op threads and the number of worker processes (each
+process = one gunicorn worker started the way the server does, micro-batcher, stage pipeline
+and render pool included). For every setting it drives the full /predict path (_predict_bytes:
+decode, forward, Grad-CAM, mask / heatmap rendering and encoding, DB logging) with a real image
+at several concurrency levels (total in-flight requests, split evenly over the workers =
+gunicorn threads busy per worker) and records throughput and p50 / p99 latency. The result
+cache is off and rows go to a throwaway database, so the served data is not touched.
+
+The recommended setting is the highest-throughput one whose p99 stays within --p99-budget-ms;
+it is written with every measurement to --out (default: AUTOTUNE_CONFIG or backend/autotune.json).
+The server applies torch_threads / interop_threads at startup and gunicorn.conf.py uses workers /
+threads; TORCH_THREADS, TORCH_INTEROP_THREADS, WEB_CONCURRENCY and GUNICORN_THREADS still override.
+
+A worker that fails to start (or a setting that stops reporting for --timeout seconds) is
+reported and skipped instead of hanging the sweep.
+
+Usage:
+    python autotune.py [--workers 1 2 4] [--torch-threads 1 2 4 8] [--interop-threads 1 2]
+                       [--concurrency 1 4 16] [--duration 10] [--p99-budget-ms 500]
+                       [--image ../demo.jpg] [--no-cam] [--timeout 300]
+"""
+import os
+import sys
+import json
+import math
+import time
+import queue
+import argparse
+import tempfile
+import threading
+import multiprocessing as mp
+from datetime import datetime, timezone
+from pathlib import Path
+
+from tuning import machine_fingerprint
+
+DEFAULT_OUT = os.environ.get("AUTOTUNE_CONFIG", str(Path(__file__).parent / "autotune.json"))
+DEFAULT_IMAGE = str(Path(__file__).resolve().parent.parent / "demo.jpg")
+
+
+def _worker(torch_threads, interop_threads, levels, duration, image_path, no_cam, scratch, start, out, timeout):
+    # env must be set before the server module reads its config; the existing config is not applied
+    os.environ["AUTOTUNE_CONFIG"] = ""
+    os.environ["TORCH_THREADS"] = str(torch_threads)
+    os.environ["TORCH_INTEROP_THREADS"] = str(interop_threads)
+    # every request computes (no cache hits on the repeated image); rows / images go to scratch
+    os.environ["RESULT_CACHE_MB"] = "0"
+    os.environ["LOG_DB_PATH"] = "sqlite:///" + os.path.join(scratch, f"autotune-{os.getpid()}.db")
+    os.environ["ARTIFACT_DIR"] = os.path.join(scratch, "artifacts")
+    import app_pytorch_inference as srv
+
+    with open(image_path, "rb") as fh:
+        data = fh.read()
+    srv.startup()
+    if not srv.is_ready():
+        raise RuntimeError("server startup failed (see the traceback above)")
+    name = os.path.basename(image_path)
+    for level, clients in enumerate(levels):
+        latencies = []
+        lock = threading.Lock()
+        start.wait(timeout)
+        stop_at = time.perf_counter() + duration
+
+        def client():
+            mine = []
+            while time.perf_counter() < stop_at:
+                t0 = time.perf_counter()
+                srv._predict_bytes(name, data, no_cam, False)
+                mine.append(time.perf_counter() - t0)
+            with lock:
+                latencies.extend(mine)
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        out.put((level, latencies))
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q / 100.0 * len(values))) - 1)]
+
+
+def _collect(procs, out, expected, timeout):
+    """-> expected (level, latencies) messages; raises if a worker dies or nothing arrives for timeout s."""
+    messages = []
+    last = time.monotonic()
+    while len(messages) < expected:
+        try:
+            messages.append(out.get(timeout=1.0))
+            last = time.monotonic()
+            continue
+        except queue.Empty:
+            pass
+        dead = [p.exitcode for p in procs if p.exitcode not in (None, 0)]
+        if dead:
+            raise RuntimeError(f"worker exited with code {dead[0]}")
+        if time.monotonic() - last > timeout:
+            raise RuntimeError(f"no result from the workers for {timeout:g}s")
+    return messages
+
+
+def _measure(workers, torch_threads, interop_threads, concurrency, duration, image, no_cam, timeout):
+    """-> one result dict per concurrency level for this setting."""
+    levels = [max(1, int(math.ceil(c / workers))) for c in concurrency]
+    ctx = mp.get_context("spawn")
+    # every worker starts each level together, after all of them have loaded and warmed up
+    start = ctx.Barrier(workers)
+    out = ctx.Queue()
+    per_level = [[] for _ in levels]
+    with tempfile.TemporaryDirectory(prefix="autotune-") as scratch:
+        procs = [ctx.Process(target=_worker, args=(torch_threads, interop_threads, levels, duration, image, no_cam,
+                                                   scratch, start, out, timeout))
+                 for _ in range(workers)]
+        for p in procs:
+            p.start()
+        try:
+            # a level takes duration s once every worker is up; startup gets the full timeout
+            for level, latencies in _collect(procs, out, len(levels) * workers, timeout + duration):
+                per_level[level].extend(latencies)
+        finally:
+            for p in procs:
+                p.join(timeout=5)
+                if p.is_alive():
+                    p.terminate()
+                    p.join()
+    results = []
+    for clients, latencies in zip(levels, per_level):
+        results.append({
+            "workers": workers, "torch_threads": torch_threads, "interop_threads": interop_threads,
+            "concurrency": clients * workers, "clients_per_worker": clients,
+            "throughput_rps": round(len(latencies) / duration, 2),
+            "p50_ms": round(1000 * _percentile(latencies, 50), 2) if latencies else None,
+            "p99_ms": round(1000 * _percentile(latencies, 99), 2) if latencies else None,
+        })
+    return results
+
+
+def _recommend(results, p99_budget_ms):
+    """Highest throughput within the p99 budget (lowest p99 overall if nothing meets it)."""
+    within = [r for r in results if r["p99_ms"] is not None and r["p99_ms"] <= p99_budget_ms]
+    if within:
+        best = max(within, key=lambda r: r["throughput_rps"])
+    else:
+        best = min((r for r in results if r["p99_ms"] is not None), key=lambda r: r["p99_ms"])
+    return {"torch_threads": best["torch_threads"], "interop_threads": best["interop_threads"],
+            "workers": best["workers"], "threads": best["clients_per_worker"]}, best
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--torch-threads", type=int, nargs="+",
+                        default=sorted({t for t in (1, 2, 4, 8, 16, cpus) if t <= cpus}))
+    parser.add_argument("--interop-threads", type=int, nargs="+", default=[1])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                        help="total in-flight requests across all workers")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per measurement")
+    parser.add_argument("--p99-budget-ms", type=float, default=500.0)
+    parser.add_argument("--image", default=DEFAULT_IMAGE, help="fundus image sent on every request")
+    parser.add_argument("--no-cam", action="store_true", help="time no_cam=1 requests (CAM is on by default)")
+    parser.add_argument("--timeout", type=float, default=300.0,
+                        help="seconds to wait for worker startup / results before giving up on a setting")
+    parser.add_argument("--oversubscribe", action="store_true",
+                        help="also try settings with workers x torch threads > CPU count")
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    args = parser.parse_args()
+
+    settings = [(w, t, i) for w in args.workers for t in args.torch_threads for i in args.interop_threads
+                if args.oversubscribe or w * t <= cpus]
+    if not settings:
+        print(f"No setting fits {cpus} CPUs; pass --oversubscribe or smaller --workers / --torch-threads")
+        return 1
+
+    if not os.path.isfile(args.image):
+        print(f"Image not found: {args.image} (pass --image)")
+        return 1
+
+    print(f"{cpus} CPUs, {len(settings)} settings x {len(args.concurrency)} concurrency levels, {args.duration}s each, "
+          f"/predict with {os.path.basename(args.image)}{' (no_cam)' if args.no_cam else ''}")
+    print(f"{'workers':>8}{'threads':>8}{'interop':>8}{'conc':>6}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    results = []
+    for workers, torch_threads, interop_threads in settings:
+        try:
+            measured = _measure(workers, torch_threads, interop_threads, args.concurrency, args.duration,
+                                args.image, args.no_cam, args.timeout)
+        except RuntimeError as e:
+            print(f"{workers:>8}{torch_threads:>8}{interop_threads:>8}  skipped: {e}")
+            continue
+        for r in measured:
+            results.append(r)
+            print(f"{r['workers']:>8}{r['torch_threads']:>8}{r['interop_threads']:>8}{r['concurrency']:>6}"
+                  f"{r['throughput_rps']:>10.1f}{r['p50_ms'] or 0:>10.1f}{r['p99_ms'] or 0:>10.1f}")
+
+    if not results:
+        print("Every setting failed; nothing written")
+        return 1
+    recommended, best = _recommend(results, args.p99_budget_ms)
+    config = {
+        "machine": machine_fingerprint(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "p99_budget_ms": args.p99_budget_ms,
+        "duration_s": args.duration,
+        "workload": {"image": os.path.basename(args.image), "no_cam": args.no_cam},
+        "recommended": recommended,
+        "results": results,
+    }
+    with open(args.out, "w") as fh:
+        json.dump(config, fh, indent=2)
+    print(f"Recommended: {recommended} ({best['throughput_rps']} req/s, p99 {best['p99_ms']} ms "
+          f"at concurrency {best['concurrency']})")
+    print("Written to", args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+# batching.py
+"""
+Dynamic micro-batching for the MultiTaskNet forward pass.
+- Callers submit a (N, 3, H, W) tensor and block on a Future
+- A single worker thread coalesces queued inputs into one batch,
+  bounded by max_batch_size rows and max_wait_ms after the first arrival
+- Each caller gets back its own (cls_logits, seg_logits) slice
+- Per-caller want_seg flags are forwarded per row, so the seg decoder can skip rows
+- with_cam=True items (single-pass Grad-CAM) are coalesced into their own batch and run
+  through run_cam_batch: one forward + one backward for all of them, cams split per row
+- close() drains what is queued and stops the worker (used when a model is hot-swapped)
+"""
+import os
+import time
+import queue
+import threading
+import traceback
+from concurrent.futures import Future
+
+import torch
+
+
+class _Item:
+    __slots__ = ("tensor", "want_seg", "with_cam", "future")
+
+    def __init__(self, tensor, want_seg=True, with_cam=False):
+        self.tensor = tensor
+        self.want_seg = bool(want_seg)
+        self.with_cam = bool(with_cam)
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    run_batch: callable(batch_tensor, want_seg) -> (cls_logits, seg_logits or None)
+               want_seg is True when every row wants a mask, else a list of per-row bools
+    run_cam_batch: optional callable(batch_tensor, want_seg) -> (cls_logits, seg_logits or None,
+               cams or None) for with_cam items; it runs with autograd available (not under
+               inference_mode), cams is a (B, H, W) array or None if the CAM pass failed
+    The worker thread is started lazily (and restarted after a fork), so the
+    batcher can be created before gunicorn forks its workers.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0, name="micro-batcher", run_cam_batch=None):
+        self.run_batch = run_batch
+        self.run_cam_batch = run_cam_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._closed or (self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()):
+                return
+            if self._pid != os.getpid():
+                # queue state inherited from the parent process is meaningless here
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, inp_tensor, want_seg=True, with_cam=False):
+        """-> Future of (cls_logits, seg_logits), or (cls_logits, seg_logits, cams) when with_cam."""
+        if with_cam and self.run_cam_batch is None:
+            raise ValueError("with_cam needs a run_cam_batch callable")
+        item = _Item(inp_tensor, want_seg, with_cam)
+        if not self._closed:
+            self._ensure_worker()
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._queue.put(item)
+        if closed:
+            # stragglers after close() run unbatched on the caller's thread
+            self._run([item])
+        return item.future
+
+    def close(self):
+        """Stop the worker once everything queued so far has run."""
+        with self._lock:
+            self._closed = True
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                self._queue.put(None)
+
+    def __call__(self, inp_tensor, want_seg=True, with_cam=False):
+        return self.submit(inp_tensor, want_seg, with_cam).result()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            items = [first]
+            rows = first.tensor.shape[0]
+            deadline = time.perf_counter() + self.max_wait
+            while rows < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # close(): finish this batch, then stop
+                    self._queue.put(None)
+                    break
+                items.append(item)
+                rows += item.tensor.shape[0]
+            self._run(items)
+
+    def _run(self, items):
+        # CAM and plain items share the wait window but need different passes
+        plain = [it for it in items if not it.with_cam]
+        cam = [it for it in items if it.with_cam]
+        if plain:
+            self._run_group(plain, self.run_batch, inference=True)
+        if cam:
+            self._run_group(cam, self.run_cam_batch, inference=False)
+
+    def _run_group(self, items, run_batch, inference):
+        try:
+            if len(items) == 1:
+                batch = items[0].tensor
+            else:
+                batch = torch.cat([it.tensor for it in items], dim=0)
+            if all(it.want_seg for it in items):
+                want_seg = True
+            else:
+                want_seg = [it.want_seg for it in items for _ in range(it.tensor.shape[0])]
+            if inference:
+                with torch.inference_mode():
+                    outputs = run_batch(batch, want_seg)
+            else:
+                outputs = run_batch(batch, want_seg)
+        except Exception as e:
+            traceback.print_exc()
+            for it in items:
+                it.future.set_exception(e)
+            return
+
+        offset = 0
+        for it in items:
+            n = it.tensor.shape[0]
+            it.future.set_result(tuple(out[offset:offset + n] if out is not None else None for out in outputs))
+            offset += n
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Grad-CAM throughput benchmark: CAM requests/sec at 1, 2, 4 and 8 client threads.
+
+Compares the concurrent single-pass CamEngine, the same engine behind the /predict
+micro-batcher (concurrent CAMs coalesced into one forward + backward) and pytorch-grad-cam
+behind the old global lock (when pytorch-grad-cam is installed), then times CAMs for B images x every
+class: one CamEngine.multi call vs one forward/backward per image and class.
+
+Usage:
+    python bench_cam.py [--requests 64] [--threads 1 2 4 8] [--torch-threads N] [--batch-size 8]
+"""
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+import app_pytorch_inference as srv
+from batching import MicroBatcher
+from cam_engine import CamEngine
+
+
+def _run(fn, n_requests, n_threads, x):
+    # warm-up outside the timed region
+    fn(x)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        list(pool.map(lambda _: fn(x), range(n_requests)))
+    elapsed = time.perf_counter() - start
+    return n_requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--torch-threads", type=int, default=None, help="torch.set_num_threads per process")
+    parser.add_argument("--batch-size", type=int, default=8, help="images for the B x K comparison")
+    args = parser.parse_args()
+
+    if args.torch_threads:
+        torch.set_num_threads(args.torch_threads)
+
+    srv.load_model()
+    target = srv._find_target_conv(srv._model)
+    x = torch.randn(1, 3, srv.IMG_SIZE, srv.IMG_SIZE).to(srv.DEVICE)
+    size = (srv.IMG_SIZE, srv.IMG_SIZE)
+
+    engine = CamEngine(srv._model, target)
+    candidates = [("single-pass CamEngine", lambda t: engine(t, out_size=size))]
+
+    batcher = MicroBatcher(lambda t, want_seg: srv._split_outputs(srv._model(t)),
+                           max_batch_size=srv.BATCH_MAX_SIZE, max_wait_ms=srv.BATCH_MAX_WAIT_MS,
+                           run_cam_batch=lambda t, want_seg: engine(t, out_size=size))
+    candidates.append(("single-pass + micro-batcher", lambda t: batcher(t, with_cam=True)))
+
+    _, library_cam = srv.init_library_gradcam(srv._model, target)
+    if library_cam is not None:
+        lock = threading.Lock()
+
+        def locked_library(t):
+            with lock:
+                return srv._run_library_cam(library_cam, t, [srv.ClassifierOutputTarget(0)])
+        candidates.append(("pytorch-grad-cam + global lock", locked_library))
+
+    print(f"device={srv.DEVICE} torch_threads={torch.get_num_threads()} requests={args.requests}")
+    print(f"{'engine':<34}" + "".join(f"{f'{n} thr':>10}" for n in args.threads))
+    for name, fn in candidates:
+        rates = [_run(fn, args.requests, n, x) for n in args.threads]
+        print(f"{name:<34}" + "".join(f"{r:>10.2f}" for r in rates) + "   req/s")
+    batcher.close()
+
+    batch = torch.randn(args.batch_size, 3, srv.IMG_SIZE, srv.IMG_SIZE).to(srv.DEVICE)
+    n_cams = args.batch_size * srv.NUM_CLASSES
+
+    def looped(t):
+        for row in t.split(1):
+            for k in range(srv.NUM_CLASSES):
+                engine(row, target_idx=k, out_size=size)
+
+    print(f"{args.batch_size} images x {srv.NUM_CLASSES} classes ({n_cams} CAMs)")
+    for name, fn in (("per image + class", looped), ("CamEngine.multi", lambda t: engine.multi(t, out_size=size))):
+        fn(batch)
+        start = time.perf_counter()
+        fn(batch)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<34}{elapsed * 1000:>10.1f} ms   {n_cams / elapsed:>8.1f} CAM/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
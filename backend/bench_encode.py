@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Heatmap / mask artifact encoding benchmark: encode ms and bytes per format, and response size
+per transport (base64 JSON vs multipart/mixed vs MessagePack).
+
+Usage:
+    python bench_encode.py [--images path/to/fundus] [--iters 20]
+Without --images, a synthetic fundus-like image is used. The heatmap is drawn from a smooth
+synthetic CAM and the mask overlay from a thresholded blob, both at IMG_SIZE like /predict.
+"""
+import io
+import sys
+import json
+import time
+import base64
+import argparse
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import app_pytorch_inference as srv
+from artifact_codec import ArtifactEncoding, MIMETYPES, encode_image, msgpack, pack_msgpack, pack_multipart
+
+ENCODINGS = [
+    ArtifactEncoding("png", 85, 1),
+    ArtifactEncoding("png", 85, 6),
+    ArtifactEncoding("png", 85, 9),
+    ArtifactEncoding("webp", 75, 6),
+    ArtifactEncoding("webp", 90, 6),
+    ArtifactEncoding("webp", 100, 6),
+    ArtifactEncoding("jpeg", 75, 6),
+    ArtifactEncoding("jpeg", 90, 6),
+]
+
+
+def _base_images(images_dir):
+    if images_dir:
+        for p in sorted(Path(images_dir).iterdir()):
+            if p.suffix.lower() in srv.IMAGE_EXTENSIONS:
+                yield p.name, srv._load_pil_resized(io.BytesIO(p.read_bytes()))
+        return
+    n = srv.IMG_SIZE
+    yy, xx = np.mgrid[0:n, 0:n].astype(np.float32) / n
+    disc = np.clip(1.0 - ((xx - 0.5) ** 2 + (yy - 0.5) ** 2) * 4.0, 0.0, 1.0)
+    rng = np.random.default_rng(0)
+    rgb = np.stack([disc * 200, disc * 90, disc * 40], axis=-1) + rng.normal(0, 6, (n, n, 3))
+    yield "synthetic-fundus", Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8))
+
+
+def _artifacts(pil_resized):
+    n = srv.IMG_SIZE
+    yy, xx = np.mgrid[0:n, 0:n].astype(np.float32) / n
+    cam = np.exp(-(((xx - 0.6) ** 2) + ((yy - 0.4) ** 2)) / 0.02)
+    mask = ((((xx - 0.35) ** 2) + ((yy - 0.6) ** 2)) < 0.01).astype(np.uint8) * 255
+    return {
+        "heatmap": srv.overlay_heatmap_on_pil(pil_resized, cam),
+        "mask": srv.overlay_red_mask_on_pil(pil_resized, mask),
+    }
+
+
+def _time(fn, iters):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    return (time.perf_counter() - t0) * 1000.0 / iters
+
+
+def _label(enc):
+    if enc.format == "png":
+        return f"png level={enc.png_level}"
+    return f"{enc.format} q={enc.quality}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=None)
+    parser.add_argument("--iters", type=int, default=20)
+    args = parser.parse_args()
+
+    for name, pil_resized in _base_images(args.images):
+        images = _artifacts(pil_resized)
+        print(f"== {name}")
+        print(f"{'encoding':<18}{'artifact':<10}{'ms':>8}{'bytes':>9}{'base64':>9}")
+        for enc in ENCODINGS:
+            for kind, pil in images.items():
+                ms = _time(lambda: encode_image(pil, enc), args.iters)
+                size = len(encode_image(pil, enc))
+                print(f"{_label(enc):<18}{kind:<10}{ms:>8.2f}{size:>9}{4 * ((size + 2) // 3):>9}")
+
+        print(f"{'encoding':<18}{'json':>9}{'multipart':>11}{'msgpack':>9}")
+        for enc in ENCODINGS:
+            response = {"predicted_disease": "Glaucoma", "confidence": 0.9,
+                        "probabilities": {v: 0.25 for v in srv.CLASS_MAP_INV.values()},
+                        "artifact_format": enc.format}
+            response["heatmap_png_base64"] = base64.b64encode(encode_image(images["heatmap"], enc)).decode("utf-8")
+            response["mask_png_base64"] = base64.b64encode(encode_image(images["mask"], enc)).decode("utf-8")
+            json_size = len(json.dumps(response))
+            multipart_size = len(pack_multipart(response, MIMETYPES[enc.format])[0])
+            msgpack_size = f"{len(pack_msgpack(response))}" if msgpack is not None else "n/a"
+            print(f"{_label(enc):<18}{json_size:>9}{multipart_size:>11}{msgpack_size:>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
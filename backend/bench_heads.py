@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Conditional head execution benchmark: full MultiTaskNet forward vs encoder + classifier
+with the seg decoder run only on abnormal rows, at several Normal/abnormal ratios.
+
+Usage:
+    python bench_heads.py [--batch-size 8] [--normal-ratios 0 0.25 0.5 0.75 1] [--iters 20]
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+import app_pytorch_inference as srv
+from engines import segment_subset
+
+
+def _time(fn, iters):
+    with torch.inference_mode():
+        fn()
+        times = []
+        for _ in range(iters):
+            t0 = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - t0) * 1000.0)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--normal-ratios", type=float, nargs="+", default=[0.0, 0.25, 0.5, 0.75, 1.0])
+    parser.add_argument("--iters", type=int, default=20)
+    args = parser.parse_args()
+
+    srv.load_model()
+    model = srv._model
+    bs = args.batch_size
+    x = torch.randn(bs, 3, srv.IMG_SIZE, srv.IMG_SIZE).to(srv.DEVICE)
+
+    full_ms = _time(lambda: model(x), args.iters)
+    enc_ms = _time(lambda: model.classify(model.encode(x)), args.iters)
+    print(f"device={srv.DEVICE} batch={bs} full forward={full_ms:.2f} ms, encoder+classifier={enc_ms:.2f} ms")
+    print(f"{'normal %':>9}{'seg rows':>10}{'staged ms':>11}{'full ms':>9}{'saved':>8}")
+    for ratio in args.normal_ratios:
+        n_abnormal = bs - int(round(ratio * bs))
+        need = torch.zeros(bs, dtype=torch.bool, device=x.device)
+        need[:n_abnormal] = True
+
+        def staged():
+            feats = model.encode(x)
+            model.classify(feats)
+            segment_subset(model, feats, need)
+
+        staged_ms = _time(staged, args.iters)
+        print(f"{ratio * 100:>8.0f}%{n_abnormal:>10}{staged_ms:>11.2f}{full_ms:>9.2f}{(1 - staged_ms / full_ms) * 100:>7.1f}%")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
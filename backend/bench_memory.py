@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Per-worker memory with private vs memory-mapped weights.
+
+Starts N worker processes per mode, each loading the model and running one forward pass the
+way a gunicorn worker would, and reports RSS / PSS per worker once all of them are loaded.
+PSS splits shared pages between the processes mapping them, so its sum is the real footprint.
+
+Usage:
+    python bench_memory.py [--workers 4] [--format torch|safetensors]
+The mapped weights file is created first if missing (python export_model.py mmap).
+"""
+import os
+import sys
+import argparse
+import multiprocessing as mp
+
+MODES = {"private": "0", "mmap": "1"}
+
+
+def _worker(mode, fmt, loaded, measured, out):
+    # env must be set before the server module reads its config
+    os.environ["WEIGHTS_MMAP"] = MODES[mode]
+    os.environ["WEIGHTS_FORMAT"] = fmt
+    os.environ["RENDER_PROCESSES"] = "0"
+    import torch
+    import app_pytorch_inference as srv
+    from weights import memory_usage
+
+    srv.load_model()
+    with torch.inference_mode():
+        srv._run_model(torch.zeros(1, 3, srv.IMG_SIZE, srv.IMG_SIZE), want_seg=True)
+    loaded.wait()
+    out.put(memory_usage())
+    measured.wait()
+
+
+def _run(mode, fmt, workers):
+    ctx = mp.get_context("spawn")
+    loaded = ctx.Barrier(workers)
+    measured = ctx.Barrier(workers)
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(mode, fmt, loaded, measured, out)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    stats = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--format", choices=["torch", "safetensors"], default="torch")
+    args = parser.parse_args()
+
+    print(f"{'mode':<9}{'worker':>7}{'RSS MB':>10}{'PSS MB':>10}{'shared MB':>11}{'private MB':>12}")
+    for mode in MODES:
+        stats = _run(mode, args.format, args.workers)
+        for i, m in enumerate(stats):
+            private = m.get("private_clean_mb", 0.0) + m.get("private_dirty_mb", 0.0)
+            print(f"{mode:<9}{i:>7}{m.get('rss_mb', 0.0):>10.1f}{m.get('pss_mb', 0.0):>10.1f}"
+                  f"{m.get('shared_clean_mb', 0.0):>11.1f}{private:>12.1f}")
+        total_pss = sum(m.get("pss_mb", 0.0) for m in stats)
+        print(f"{mode:<9}{'total':>7}{sum(m.get('rss_mb', 0.0) for m in stats):>10.1f}{total_pss:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+no_cam=1 traffic with the Grad-CAM hooks attached persistently (the old behaviour) vs scoped
+to CAM calls only.
+
+For the single-pass CamEngine and, when installed, pytorch-grad-cam, runs --requests plain
+inference forwards (what a no_cam request does) and reports latency plus the memory they
+leave behind: RSS growth and the activations pytorch-grad-cam's hooks keep alive between CAMs.
+
+Usage:
+    python bench_nocam.py [--requests 200] [--batch-size 1] [--torch-threads N]
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+import app_pytorch_inference as srv
+from cam_engine import CamEngine
+from weights import memory_usage
+
+
+def _library_activation_mb(cam):
+    hooks = getattr(cam, "activations_and_grads", None) if cam is not None else None
+    if hooks is None:
+        return 0.0
+    return sum(a.element_size() * a.nelement() for a in hooks.activations) / (1024 * 1024)
+
+
+def _run(n_requests, x):
+    # one warm-up forward outside the timed region
+    with torch.inference_mode():
+        srv._run_model(x, want_seg=True)
+    rss_before = memory_usage().get("rss_mb", 0.0)
+    times = []
+    for _ in range(n_requests):
+        t0 = time.perf_counter()
+        with torch.inference_mode():
+            srv._run_model(x, want_seg=True)
+        times.append(time.perf_counter() - t0)
+    rss_after = memory_usage().get("rss_mb", 0.0)
+    times = np.array(times) * 1000
+    return float(np.percentile(times, 50)), float(np.percentile(times, 99)), rss_after - rss_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--torch-threads", type=int, default=None, help="torch.set_num_threads per process")
+    args = parser.parse_args()
+
+    if args.torch_threads:
+        torch.set_num_threads(args.torch_threads)
+
+    srv.load_model()
+    target = srv._find_target_conv(srv._model)
+    x = torch.randn(args.batch_size, 3, srv.IMG_SIZE, srv.IMG_SIZE).to(srv.DEVICE)
+    print(f"device={srv.DEVICE} torch_threads={torch.get_num_threads()} requests={args.requests} "
+          f"batch_size={args.batch_size}")
+    print(f"{'CAM':<18}{'hooks':<12}{'p50 ms':>9}{'p99 ms':>9}{'RSS +MB':>9}{'held MB':>9}")
+
+    def report(name, hooks, stats, held):
+        p50, p99, rss_delta = stats
+        print(f"{name:<18}{hooks:<12}{p50:>9.2f}{p99:>9.2f}{rss_delta:>9.1f}{held:>9.1f}")
+
+    engine = CamEngine(srv._model, target)
+    # persistent: what the engine used to do (hook registered in the constructor, never removed)
+    engine._attach()
+    report("single-pass", "persistent", _run(args.requests, x), 0.0)
+    engine.close()
+    report("single-pass", "scoped", _run(args.requests, x), 0.0)
+
+    _, library_cam = srv.init_library_gradcam(srv._model, target)
+    if library_cam is None or srv.ActivationsAndGradients is None:
+        print("pytorch-grad-cam not installed; library rows skipped")
+        return 0
+    # persistent: GradCAM as constructed, hooks left on the shared target layer
+    library_cam.activations_and_grads = srv.ActivationsAndGradients(
+        library_cam.model, library_cam.target_layers, library_cam.reshape_transform)
+    stats = _run(args.requests, x)
+    report("pytorch-grad-cam", "persistent", stats, _library_activation_mb(library_cam))
+    srv._release_library_hooks(library_cam)
+    report("pytorch-grad-cam", "scoped", _run(args.requests, x), _library_activation_mb(library_cam))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Decode + preprocess benchmark: ms per image and per megapixel, original pipeline vs Preprocessor.
+
+Usage:
+    python bench_preprocess.py [--images path/to/fundus] [--iters 10]
+Without --images, synthetic fundus-sized JPEGs (1000-4000 px wide) are generated in memory.
+"""
+import io
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import app_pytorch_inference as srv
+
+
+def _samples(images_dir):
+    if images_dir:
+        for p in sorted(Path(images_dir).iterdir()):
+            if p.suffix.lower() in srv.IMAGE_EXTENSIONS:
+                yield p.name, p.read_bytes()
+        return
+    rng = np.random.default_rng(0)
+    for width in (1000, 2000, 3000, 4000):
+        height = width * 3 // 4
+        # smooth noise compresses like a photo rather than like white noise
+        small = rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+        img = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=92)
+        yield f"synthetic-{width}x{height}.jpg", buf.getvalue()
+
+
+def _original(data):
+    pil = Image.open(io.BytesIO(data)).convert("RGB").resize((srv.IMG_SIZE, srv.IMG_SIZE))
+    return srv.build_preprocess()(pil).unsqueeze(0)
+
+
+def _fast(data):
+    return srv._preprocessor.to_tensor(srv._preprocessor.decode(io.BytesIO(data)), reuse=True)
+
+
+def _time(fn, data, iters):
+    fn(data)
+    t0 = time.perf_counter()
+    for _ in range(iters):
+        fn(data)
+    return (time.perf_counter() - t0) * 1000.0 / iters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=None)
+    parser.add_argument("--iters", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'image':<32}{'MP':>6}{'orig ms':>10}{'fast ms':>10}{'orig ms/MP':>12}{'fast ms/MP':>12}{'speedup':>9}")
+    for name, data in _samples(args.images):
+        with Image.open(io.BytesIO(data)) as im:
+            mp = im.size[0] * im.size[1] / 1e6
+        t_orig = _time(_original, data, args.iters)
+        t_fast = _time(_fast, data, args.iters)
+        print(f"{name[:31]:<32}{mp:>6.1f}{t_orig:>10.2f}{t_fast:>10.2f}{t_orig / mp:>12.2f}{t_fast / mp:>12.2f}"
+              f"{t_orig / t_fast:>9.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Overlay rendering benchmark: the previous float32 applyColorMap / cvtColor / blend path vs the
+uint8 fixed-point LUT kernels of render.py, per frame and over a batch of frames.
+
+Reports time per frame, the memory each frame allocates (tracemalloc peak above the baseline,
+as a count of full RGB frames) and the largest pixel difference from the float path.
+
+Usage:
+    python bench_render.py [--size 224] [--frames 200] [--batch-size 16]
+"""
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import cv2
+
+from render import heatmap_overlay, red_mask_overlay
+
+
+def _float_heatmap(rgb, cam, alpha=0.4):
+    # the overlay as rendered before render.py
+    rgb = rgb.astype(np.float32) / 255.0
+    cam_uint8 = (np.clip(cam, 0, 1) * 255).astype("uint8")
+    heatmap = cv2.applyColorMap(cam_uint8, cv2.COLORMAP_JET)
+    heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
+    overlay = np.clip((1 - alpha) * rgb + alpha * heatmap, 0, 1)
+    return (overlay * 255).astype("uint8")
+
+
+def _float_mask(rgb, mask, alpha=0.5):
+    mask_bool = mask > 0
+    output = rgb.copy()
+    output[mask_bool] = (rgb[mask_bool] * (1 - alpha) + np.array([255, 0, 0]) * alpha).astype(np.uint8)
+    return output
+
+
+def _measure(fn, frames, per_call):
+    """-> (ms per frame, peak bytes allocated per call) for fn() rendering per_call frames."""
+    fn()  # warm: per-thread buffers, LUTs
+    start = time.perf_counter()
+    for _ in range(frames // per_call):
+        fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return 1000 * elapsed / max(1, frames // per_call * per_call), (peak - base) / per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    n, s = args.batch_size, args.size
+    rgbs = rng.integers(0, 256, (n, s, s, 3), dtype=np.uint8)
+    cams = rng.random((n, s, s), dtype=np.float32)
+    masks = np.where(rng.random((n, s, s)) > 0.7, 255, 0).astype(np.uint8)
+    frame_bytes = s * s * 3
+
+    heat_diff = max(int(np.abs(heatmap_overlay(rgbs[i], cams[i]).astype(int) - _float_heatmap(rgbs[i], cams[i])).max())
+                    for i in range(n))
+    mask_diff = max(int(np.abs(red_mask_overlay(rgbs[i], masks[i]).astype(int) - _float_mask(rgbs[i], masks[i])).max())
+                    for i in range(n))
+
+    cases = [
+        ("heatmap float32 (before)", lambda: _float_heatmap(rgbs[0], cams[0]), 1, "-"),
+        ("heatmap uint8 LUT", lambda: heatmap_overlay(rgbs[0], cams[0]), 1, heat_diff),
+        (f"heatmap uint8 LUT x{n} batch", lambda: heatmap_overlay(rgbs, cams), n, heat_diff),
+        ("mask float (before)", lambda: _float_mask(rgbs[0], masks[0]), 1, "-"),
+        ("mask uint8", lambda: red_mask_overlay(rgbs[0], masks[0]), 1, mask_diff),
+        (f"mask uint8 x{n} batch", lambda: red_mask_overlay(rgbs, masks), n, mask_diff),
+    ]
+    print(f"{s}x{s} frames, {args.frames} per case")
+    print(f"{'kernel':<30}{'ms/frame':>10}{'alloc KB':>10}{'frames':>8}{'max diff':>10}")
+    for name, fn, per_call, diff in cases:
+        ms, alloc = _measure(fn, args.frames, per_call)
+        print(f"{name:<30}{ms:>10.3f}{alloc / 1024:>10.1f}{alloc / frame_bytes:>8.1f}{diff:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
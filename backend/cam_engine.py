@@ -0,0 +1,315 @@
+# cam_engine.py
+"""
+Single-pass Grad-CAM for MultiTaskNet.
+- One forward (with autograd enabled) produces cls_out, seg_out and the target-layer activations
+- One backward (torch.autograd.grad w.r.t. the activations only) produces the CAM gradients
+- Post-processing reproduces pytorch-grad-cam's GradCAM numerics (mean-pooled gradient weights,
+  ReLU, per-image min/max scaling, cv2 resize, multi-layer aggregation), vectorized over the batch
+- multi(): CAMs for B images x K target classes from one forward and one batched backward
+- Per-thread activation capture, so many CAMs can run concurrently on one shared model
+- start() / PendingCam.finish() split a CAM into its forward and its backward, so the logits
+  can be used (e.g. answered) before the backward runs, possibly on another thread
+- The capture hook is attached only while at least one CAM is running (refcounted), so plain
+  inference forwards on the same model run hook-free
+- With a staged model (encode/classify/segment) the seg decoder runs outside autograd, only
+  on the rows that need it
+"""
+import threading
+
+import numpy as np
+import cv2
+import torch
+
+from engines import segment_subset
+
+
+def _scale_cam_image(cam, target_size=None):
+    # same as pytorch_grad_cam.utils.image.scale_cam_image
+    result = []
+    for img in cam:
+        img = img - np.min(img)
+        img = img / (1e-7 + np.max(img))
+        if target_size is not None:
+            img = cv2.resize(img, target_size)
+        result.append(img)
+    return np.float32(result)
+
+
+def _split_outputs(out):
+    if isinstance(out, (list, tuple)):
+        return out[0], (out[1] if len(out) > 1 else None)
+    return out, None
+
+
+def _postprocess(activations, grads, out_size):
+    # per-image reference path (pytorch-grad-cam's loop); cam_parity.py checks _postprocess_batched against it
+    weights = np.mean(grads, axis=(2, 3))
+    cam = (weights[:, :, None, None] * activations).sum(axis=1)
+    cam = np.maximum(cam, 0)
+    cam = _scale_cam_image(cam, out_size)
+
+    # single target layer: aggregate_multi_layers reduces to ReLU + rescale
+    cam = np.maximum(cam[:, None, :], 0).mean(axis=1)
+    return _scale_cam_image(cam)
+
+
+def _minmax(cams):
+    # _scale_cam_image's per-image scaling over the last two axes, for any leading shape
+    cams = cams - cams.min(axis=(-2, -1), keepdims=True)
+    return cams / (1e-7 + cams.max(axis=(-2, -1), keepdims=True))
+
+
+# cv2 resizes up to CV_CN_MAX channels per call, each channel exactly like a single-channel image
+_RESIZE_CHANNELS = 512
+
+
+def _resize_stack(cams, out_size):
+    """(N, h, w) -> (N, height, width) with one cv2.resize per 512 maps (channels-last)."""
+    out = np.empty((cams.shape[0], out_size[1], out_size[0]), dtype=np.float32)
+    for start in range(0, cams.shape[0], _RESIZE_CHANNELS):
+        chunk = np.ascontiguousarray(cams[start:start + _RESIZE_CHANNELS].transpose(1, 2, 0))
+        resized = cv2.resize(chunk, out_size)
+        if resized.ndim == 2:
+            resized = resized[:, :, None]
+        out[start:start + _RESIZE_CHANNELS] = resized.transpose(2, 0, 1)
+    return out
+
+
+def _postprocess_batched(activations, grads, out_size):
+    """
+    activations: (B, C, h, w); grads: (K, B, C, h, w), one gradient per target slot
+    -> (B, K, height, width) float32, equal to _postprocess applied per image and target
+    """
+    weights = np.mean(grads, axis=(3, 4))
+    cam = (weights[:, :, :, None, None] * activations[None]).sum(axis=2)
+    cam = np.float32(_minmax(np.maximum(cam, 0)))
+    k, b, h, w = cam.shape
+    cam = _resize_stack(cam.reshape(k * b, h, w), out_size).reshape(k, b, out_size[1], out_size[0])
+    # aggregate_multi_layers (single layer): ReLU is a no-op after scaling, then rescale
+    return np.float32(_minmax(cam)).transpose(1, 0, 2, 3)
+
+
+class CamEngine:
+    """
+    Concurrency-safe single-pass Grad-CAM around a shared model.
+
+    A forward hook on the target layer writes into a thread-local capture slot, so each
+    request only ever sees the activations of its own forward; gradients come from
+    torch.autograd.grad (nothing is accumulated into .grad). The hook is registered when
+    the first concurrent CAM starts and removed when the last one finishes; forwards of
+    other threads in between only pay a thread-local lookup. Concurrent CAMs are bounded
+    by max_concurrency (None = unbounded) to cap autograd-graph memory.
+    """
+
+    def __init__(self, model, target_layer, max_concurrency=None):
+        self.model = model
+        self.target_layer = target_layer
+        self._local = threading.local()
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._hook_lock = threading.Lock()
+        self._hook_users = 0
+        self._handle = None
+        self.staged = all(hasattr(model, a) for a in ("encode", "classify", "segment"))
+
+    def _capture(self, module, inputs, output):
+        slot = getattr(self._local, "slot", None)
+        if slot is not None:
+            slot["act"] = output
+
+    def _attach(self):
+        with self._hook_lock:
+            if self._hook_users == 0:
+                self._handle = self.target_layer.register_forward_hook(self._capture)
+            self._hook_users += 1
+
+    def _detach(self):
+        with self._hook_lock:
+            self._hook_users -= 1
+            if self._hook_users == 0 and self._handle is not None:
+                self._handle.remove()
+                self._handle = None
+
+    @property
+    def hooked(self):
+        return self._handle is not None
+
+    def close(self):
+        with self._hook_lock:
+            if self._handle is not None:
+                self._handle.remove()
+                self._handle = None
+            self._hook_users = 0
+
+    def __call__(self, input_tensor, target_idx=None, out_size=(224, 224), segment_rows=None):
+        """
+        input_tensor: (B, 3, H, W) normalized batch
+        target_idx:   None (argmax of each row), an int, or a sequence of B ints
+        out_size:     (width, height) of the returned CAMs
+        segment_rows: optional callable(cls_logits) -> bool tensor of rows that need the seg
+                      decoder; with a staged model the decoder then runs outside autograd on
+                      just those rows (skipped rows get -inf logits, None if no row needs it)
+
+        Returns (cls_logits, seg_logits, cams) where the logits are detached tensors and
+        cams is a float32 numpy array of shape (B, height, width) in [0, 1].
+        """
+        return self.start(input_tensor).finish(target_idx, out_size, segment_rows)
+
+    def multi(self, input_tensor, target_classes=None, out_size=(224, 224), segment_rows=None, with_argmax=False):
+        """
+        CAMs for every image of input_tensor and every class of target_classes (None = all
+        classes) from one forward pass and one batched backward.
+        with_argmax=True prepends each row's argmax class as target slot 0.
+
+        Returns (cls_logits, seg_logits, cams) with cams of shape (B, K, height, width), K the
+        number of target slots, ordered like target_classes.
+        """
+        pending = self.start(input_tensor)
+        return self._finish(pending, _class_targets(target_classes, with_argmax), out_size, segment_rows)
+
+    def start(self, input_tensor):
+        """
+        Forward half of a CAM: -> PendingCam whose cls_logits are available right away; its
+        finish() runs the backward (possibly on another thread) against the same forward.
+        The pending CAM holds a concurrency slot and the autograd graph until finish() or
+        cancel(); the capture hook is already detached when start() returns.
+        """
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            self._attach()
+            self._local.slot = {}
+            try:
+                with torch.enable_grad():
+                    if self.staged:
+                        feats = self.model.encode(input_tensor)
+                        cls_out, seg_out = self.model.classify(feats), None
+                    else:
+                        feats = None
+                        cls_out, seg_out = _split_outputs(self.model(input_tensor))
+                act = self._local.slot.get("act")
+            finally:
+                self._local.slot = None
+                self._detach()
+            if act is None or not act.requires_grad:
+                raise RuntimeError("Grad-CAM target layer produced no differentiable activation")
+        except BaseException:
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        return PendingCam(self, cls_out, seg_out, feats, act)
+
+    def _grads(self, cls_out, act, idx):
+        """idx: (K, B) target class per slot and row -> (K, B, C, h, w) gradients w.r.t. act."""
+        if idx.shape[0] == 1:
+            # rows are independent in eval mode, so one backward of the summed scores
+            # yields every image's own gradient
+            score = cls_out.gather(1, idx[0].view(-1, 1)).sum()
+            return torch.autograd.grad(score, act)[0].unsqueeze(0)
+        onehot = torch.zeros((idx.shape[0],) + tuple(cls_out.shape), dtype=cls_out.dtype, device=cls_out.device)
+        onehot.scatter_(2, idx.unsqueeze(-1), 1.0)
+        try:
+            # all K backward passes vectorized in one call
+            return torch.autograd.grad(cls_out, act, grad_outputs=onehot, is_grads_batched=True, retain_graph=True)[0]
+        except RuntimeError:
+            # an op without a batching rule: one backward per target slot over the same graph
+            return torch.stack([torch.autograd.grad(cls_out, act, grad_outputs=g, retain_graph=True)[0]
+                                for g in onehot])
+
+    def _finish(self, pending, targets, out_size, segment_rows):
+        cls_out, seg_out, feats, act = pending._take()
+        try:
+            with torch.enable_grad():
+                grads = self._grads(cls_out, act, targets(cls_out.detach()))
+        finally:
+            pending.cancel()
+
+        if self.staged:
+            # the decoder never needs gradients, so it runs after the backward
+            with torch.no_grad():
+                cls_detached = cls_out.detach()
+                if segment_rows is None:
+                    need = torch.ones(cls_detached.shape[0], dtype=torch.bool, device=cls_detached.device)
+                else:
+                    need = segment_rows(cls_detached)
+                seg_out = segment_subset(self.model, feats.detach(), need)
+
+        cams = _postprocess_batched(act.detach().cpu().numpy(), grads.detach().cpu().numpy(), out_size)
+        seg_logits = seg_out.detach() if seg_out is not None else None
+        return cls_out.detach(), seg_logits, cams
+
+
+def _argmax_targets(target_idx):
+    # target_idx: None (argmax of each row), an int, or a sequence of B ints -> (1, B) targets
+    def targets(cls_out):
+        if target_idx is None:
+            idx = cls_out.argmax(dim=1)
+        elif isinstance(target_idx, (int, np.integer)):
+            idx = torch.full((cls_out.shape[0],), int(target_idx), dtype=torch.long, device=cls_out.device)
+        else:
+            idx = torch.as_tensor(list(target_idx), dtype=torch.long, device=cls_out.device)
+        return idx.view(1, -1)
+    return targets
+
+
+def _class_targets(target_classes, with_argmax):
+    # every class of target_classes (None = all) for every row -> (K, B) targets
+    def targets(cls_out):
+        b, num_classes = cls_out.shape
+        classes = range(num_classes) if target_classes is None else target_classes
+        idx = torch.as_tensor(list(classes), dtype=torch.long, device=cls_out.device).view(-1, 1).expand(-1, b)
+        if with_argmax:
+            idx = torch.cat([cls_out.argmax(dim=1).view(1, -1), idx], dim=0)
+        return idx
+    return targets
+
+
+class PendingCam:
+    """
+    A CamEngine forward waiting for its backward (see CamEngine.start). cls_logits can be read
+    at once; finish() / multi() complete the CAM exactly once, cancel() drops it. Both release
+    the engine's concurrency slot, and on_release (if set) is called once at that point.
+    """
+
+    def __init__(self, engine, cls_out, seg_out, feats, act):
+        self._engine = engine
+        self._state = (cls_out, seg_out, feats, act)
+        self._lock = threading.Lock()
+        self._released = False
+        self.on_release = None
+        self.cls_logits = cls_out.detach()
+
+    def _take(self):
+        with self._lock:
+            state, self._state = self._state, None
+        if state is None:
+            raise RuntimeError("pending CAM already finished or cancelled")
+        return state
+
+    def finish(self, target_idx=None, out_size=(224, 224), segment_rows=None):
+        """Same arguments and result as CamEngine.__call__, for the forward done in start()."""
+        cls_logits, seg_logits, cams = self._engine._finish(self, _argmax_targets(target_idx), out_size, segment_rows)
+        return cls_logits, seg_logits, cams[:, 0]
+
+    def multi(self, target_classes=None, out_size=(224, 224), segment_rows=None, with_argmax=False):
+        """Same arguments and result as CamEngine.multi, for the forward done in start()."""
+        return self._engine._finish(self, _class_targets(target_classes, with_argmax), out_size, segment_rows)
+
+    def cancel(self):
+        """Drop the autograd graph and release the slot (idempotent)."""
+        with self._lock:
+            self._state = None
+            if self._released:
+                return
+            self._released = True
+        if self._engine._slots is not None:
+            self._engine._slots.release()
+        if self.on_release is not None:
+            self.on_release()
+
+def gradcam_single_pass(model, target_layer, input_tensor, target_idx=None, out_size=(224, 224)):
+    """One-off CamEngine call (hook attached only for the duration of this call)."""
+    engine = CamEngine(model, target_layer)
+    try:
+        return engine(input_tensor, target_idx=target_idx, out_size=out_size)
+    finally:
+        engine.close()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Numerical parity checks for single-pass Grad-CAM (cam_engine):
+- vs pytorch-grad-cam for the predicted class (when pytorch-grad-cam is installed)
+- batched CamEngine.multi (all images x all classes in one forward) vs one call per image and class
+- vectorized post-processing (_postprocess_batched) vs the per-image reference (_postprocess)
+  on random activations and gradients
+
+Usage:
+    python cam_parity.py                      # random inputs
+    python cam_parity.py --images path/to/dir # real fundus images
+Exits with status 1 if any CAM differs by more than --atol.
+tests/test_cam_engine.py runs the same comparisons on a randomly initialized MultiTaskNet.
+"""
+import sys
+import argparse
+from pathlib import Path
+
+import numpy as np
+import torch
+
+import app_pytorch_inference as srv
+from cam_engine import CamEngine, gradcam_single_pass, _postprocess, _postprocess_batched
+
+
+def _inputs(images_dir, count):
+    if images_dir is None:
+        gen = torch.Generator().manual_seed(0)
+        for i in range(count):
+            yield f"random-{i}", torch.randn(1, 3, srv.IMG_SIZE, srv.IMG_SIZE, generator=gen).to(srv.DEVICE)
+        return
+    paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in srv.IMAGE_EXTENSIONS)
+    for p in paths[:count]:
+        with open(p, "rb") as fh:
+            pil_resized = srv._load_pil_resized(fh)
+        yield p.name, srv.pil_to_tensor_for_model(pil_resized)
+
+
+def _check_postprocess(count, atol, seed=0):
+    """_postprocess_batched vs _postprocess per target slot on random activations/grads -> failures."""
+    rng = np.random.default_rng(seed)
+    size = (srv.IMG_SIZE, srv.IMG_SIZE)
+    failed = 0
+    for i in range(count):
+        b, k, c, h, w = (int(v) for v in rng.integers([1, 1, 4, 4, 4], [5, 5, 64, 12, 12]))
+        activations = rng.standard_normal((b, c, h, w)).astype(np.float32)
+        grads = rng.standard_normal((k, b, c, h, w)).astype(np.float32)
+        batched = _postprocess_batched(activations, grads, size)
+        ref = np.stack([_postprocess(activations, grads[slot], size) for slot in range(k)], axis=1)
+        diff = float(np.abs(batched - ref).max())
+        ok = batched.shape == ref.shape and diff <= atol
+        failed += 0 if ok else 1
+        print(f"{'ok  ' if ok else 'FAIL'} random-{i}: postprocess B={b} K={k} C={c} {h}x{w} cam_max_abs={diff:.2e}")
+    return failed
+
+
+def _check_batched(target, inputs, atol):
+    """B x K CAMs from one CamEngine.multi call vs B * K single-image, single-class calls -> failures."""
+    engine = CamEngine(srv._model, target)
+    size = (srv.IMG_SIZE, srv.IMG_SIZE)
+    batch = torch.cat([x for _, x in inputs])
+    cls_logits, _, cams = engine.multi(batch, out_size=size)
+    worst = 0.0
+    failed = 0
+    for b, (name, x) in enumerate(inputs):
+        diffs = []
+        for k in range(cls_logits.shape[1]):
+            _, _, ref = engine(x, target_idx=k, out_size=size)
+            diffs.append(float(np.abs(cams[b, k] - ref[0]).max()))
+        diff = max(diffs)
+        worst = max(worst, diff)
+        ok = diff <= atol
+        failed += 0 if ok else 1
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: batched x {len(diffs)} classes cam_max_abs={diff:.2e}")
+    print(f"worst batched CAM difference: {worst:.2e} (atol={atol:g}), failures: {failed}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=None, help="folder of images (default: random tensors)")
+    parser.add_argument("--count", type=int, default=8)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    failed = _check_postprocess(args.count, args.atol)
+    srv.load_model()
+    target = srv._find_target_conv(srv._model)
+    inputs = list(_inputs(args.images, args.count))
+    failed += _check_batched(target, inputs, args.atol)
+
+    _, library_cam = srv.init_library_gradcam(srv._model, target)
+    if library_cam is None:
+        print("pytorch-grad-cam is not available; library comparison skipped.")
+        return 1 if failed else 0
+
+    worst = 0.0
+    for name, x in inputs:
+        # full-head forward: _run_model may skip the decoder (ref_seg=None) for Normal predictions
+        with torch.inference_mode():
+            ref_cls, ref_seg = srv._split_outputs(srv._model(x))
+        pred_idx = int(ref_cls.argmax(dim=1)[0])
+
+        ref_cam = np.asarray(srv._run_library_cam(library_cam, x.clone(), [srv.ClassifierOutputTarget(pred_idx)]))[0]
+        cls_logits, seg_logits, cams = gradcam_single_pass(srv._model, target, x, out_size=(srv.IMG_SIZE, srv.IMG_SIZE))
+
+        cam_diff = float(np.abs(cams[0] - ref_cam).max())
+        cls_diff = float((cls_logits - ref_cls).abs().max())
+        seg_diff = (float((seg_logits - ref_seg).abs().max())
+                    if seg_logits is not None and ref_seg is not None else 0.0)
+        worst = max(worst, cam_diff)
+        ok = cam_diff <= args.atol and cls_diff <= args.atol and seg_diff <= args.atol
+        failed += 0 if ok else 1
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: class={pred_idx} cam_max_abs={cam_diff:.2e} "
+              f"cls_max_abs={cls_diff:.2e} seg_max_abs={seg_diff:.2e}")
+
+    print(f"worst CAM difference vs pytorch-grad-cam: {worst:.2e} (atol={args.atol:g}), failures: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+# engines.py
+"""
+Pluggable inference engines for MultiTaskNet.
+All engines take a normalized (B, 3, H, W) float tensor and return (cls_logits, seg_logits)
+as torch tensors on the input's device, so /predict does not care which one is active.
+- eager:        the loaded nn.Module
+- torchscript:  traced + frozen TorchScript artifact (export_torchscript)
+- onnx:         ONNX Runtime session over an exported ONNX artifact (export_onnx)
+"""
+import torch
+
+# tolerant import of onnxruntime (optional dependency)
+try:
+    import onnxruntime as ort
+except Exception:
+    ort = None
+
+ENGINES = ("eager", "torchscript", "onnx")
+
+
+class _HeadsOnly(torch.nn.Module):
+    # export wrapper: always a (cls_logits, seg_logits) tuple
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        cls_out, seg_out = self.model(x)
+        return cls_out, seg_out
+
+
+# ---------------- Exporters ----------------
+def export_torchscript(model, path, img_size, device="cpu"):
+    model.eval()
+    example = torch.randn(1, 3, img_size, img_size, device=device)
+    with torch.inference_mode():
+        traced = torch.jit.trace(_HeadsOnly(model), example, check_trace=False)
+    traced = torch.jit.freeze(traced.eval())
+    traced.save(str(path))
+    return path
+
+
+def export_onnx(model, path, img_size, opset=17, device="cpu"):
+    model.eval()
+    example = torch.randn(1, 3, img_size, img_size, device=device)
+    with torch.inference_mode():
+        torch.onnx.export(
+            _HeadsOnly(model), example, str(path),
+            input_names=["input"], output_names=["cls_logits", "seg_logits"],
+            dynamic_axes={"input": {0: "batch"}, "cls_logits": {0: "batch"}, "seg_logits": {0: "batch"}},
+            opset_version=opset, do_constant_folding=True,
+        )
+    return path
+
+
+# ---------------- Conditional heads ----------------
+def segment_subset(model, feats, need):
+    """
+    Run model.segment only on rows where need (bool tensor) is True.
+    Rows that skipped the decoder get -inf logits (an empty mask); None if no row needs it.
+    """
+    if not bool(need.any()):
+        return None
+    if bool(need.all()):
+        return model.segment(feats)
+    seg_sub = model.segment(feats[need])
+    seg_logits = seg_sub.new_full((feats.shape[0],) + tuple(seg_sub.shape[1:]), float("-inf"))
+    seg_logits[need] = seg_sub
+    return seg_logits
+
+
+# ---------------- Engines ----------------
+class EagerEngine:
+    name = "eager"
+
+    def __init__(self, model):
+        self.model = model
+        # encode/classify/segment available -> heads can run conditionally
+        self.staged = all(hasattr(model, a) for a in ("encode", "classify", "segment"))
+
+    def __call__(self, batch):
+        out = self.model(batch)
+        if isinstance(out, (list, tuple)):
+            return out[0], (out[1] if len(out) > 1 else None)
+        return out, None
+
+
+class TorchScriptEngine:
+    name = "torchscript"
+    staged = False
+
+    def __init__(self, path, device="cpu"):
+        self.module = torch.jit.load(str(path), map_location=device).eval()
+        try:
+            self.module = torch.jit.optimize_for_inference(self.module)
+        except Exception as e:
+            print("TorchScript optimize_for_inference skipped:", e)
+
+    def __call__(self, batch):
+        cls_out, seg_out = self.module(batch)
+        return cls_out, seg_out
+
+
+class OnnxEngine:
+    name = "onnx"
+    staged = False
+
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=0, device="cpu"):
+        if ort is None:
+            raise RuntimeError("onnxruntime is not installed")
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 0 lets onnxruntime pick (one thread per physical core)
+        opts.intra_op_num_threads = int(intra_op_threads)
+        opts.inter_op_num_threads = int(inter_op_threads)
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        providers = ["CPUExecutionProvider"]
+        if device == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(str(path), sess_options=opts, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        device = batch.device
+        cls_out, seg_out = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})
+        return torch.from_numpy(cls_out).to(device), torch.from_numpy(seg_out).to(device)
+
+
+def build_engine(name, model, torchscript_path=None, onnx_path=None, device="cpu",
+                 intra_op_threads=0, inter_op_threads=0):
+    if name == "eager":
+        return EagerEngine(model)
+    if name == "torchscript":
+        return TorchScriptEngine(torchscript_path, device=device)
+    if name == "onnx":
+        return OnnxEngine(onnx_path, intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads, device=device)
+    raise ValueError(f"unknown inference engine {name!r}; expected one of {ENGINES}")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Export MultiTaskNet to TorchScript / ONNX, check parity against eager, and benchmark engines.
+
+Usage:
+    python export_model.py export                 # writes <checkpoint>.torchscript.pt and <checkpoint>.onnx
+    python export_model.py check [--atol 1e-3]    # logits + seg mask parity vs eager (exit 1 on mismatch)
+    python export_model.py bench [--batch-sizes 1 4 8] [--iters 20]
+    python export_model.py mmap [--format torch|safetensors]   # memory-mappable weights for WEIGHTS_MMAP
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+import app_pytorch_inference as srv
+from engines import ENGINES, build_engine, export_onnx, export_torchscript
+from mask_codec import LOGIT_THRESHOLD
+from weights import FORMATS as WEIGHTS_FORMATS, convert_checkpoint, mapped_path
+
+
+def _engines(args, names=ENGINES):
+    out = []
+    for name in names:
+        try:
+            out.append(build_engine(name, srv._model, torchscript_path=srv.TORCHSCRIPT_PATH, onnx_path=srv.ONNX_PATH,
+                                    device=srv.DEVICE, intra_op_threads=args.ort_intra, inter_op_threads=args.ort_inter))
+        except Exception as e:
+            print(f"skipping {name}: {e}")
+    return out
+
+
+def cmd_export(args):
+    print("TorchScript ->", export_torchscript(srv._model, srv.TORCHSCRIPT_PATH, srv.IMG_SIZE, device=srv.DEVICE))
+    print("ONNX        ->", export_onnx(srv._model, srv.ONNX_PATH, srv.IMG_SIZE, opset=args.opset, device=srv.DEVICE))
+    return 0
+
+
+def cmd_mmap(args):
+    dst = mapped_path(srv.MODEL_PATH, args.format)
+    convert_checkpoint(srv.MODEL_PATH, dst, srv.file_sha256(srv.MODEL_PATH), args.format)
+    print("Mapped weights ->", dst)
+    return 0
+
+
+def cmd_check(args):
+    gen = torch.Generator().manual_seed(0)
+    x = torch.randn(args.batch, 3, srv.IMG_SIZE, srv.IMG_SIZE, generator=gen).to(srv.DEVICE)
+    with torch.inference_mode():
+        ref_cls, ref_seg = build_engine("eager", srv._model)(x)
+        ref_mask = ref_seg > LOGIT_THRESHOLD
+        failed = 0
+        for engine in _engines(args, [n for n in ENGINES if n != "eager"]):
+            cls_out, seg_out = engine(x)
+            cls_diff = float((cls_out - ref_cls).abs().max())
+            seg_diff = float((seg_out - ref_seg).abs().max())
+            argmax_ok = bool((cls_out.argmax(1) == ref_cls.argmax(1)).all())
+            mask = seg_out > LOGIT_THRESHOLD
+            mask_mismatch = float((mask != ref_mask).float().mean())
+            ok = cls_diff <= args.atol and argmax_ok and mask_mismatch <= args.mask_tol
+            failed += 0 if ok else 1
+            print(f"{'ok  ' if ok else 'FAIL'} {engine.name:<12} logits_max_abs={cls_diff:.2e} seg_max_abs={seg_diff:.2e} "
+                  f"argmax_equal={argmax_ok} mask_pixel_mismatch={mask_mismatch:.4%}")
+    return 1 if failed else 0
+
+
+def cmd_bench(args):
+    engines = _engines(args)
+    print(f"device={srv.DEVICE} torch_threads={torch.get_num_threads()} iters={args.iters}")
+    print(f"{'engine':<12}{'batch':>6}{'p50 ms':>10}{'p90 ms':>10}{'ms/img':>10}")
+    for bs in args.batch_sizes:
+        x = torch.randn(bs, 3, srv.IMG_SIZE, srv.IMG_SIZE).to(srv.DEVICE)
+        for engine in engines:
+            with torch.inference_mode():
+                for _ in range(args.warmup):
+                    engine(x)
+                times = []
+                for _ in range(args.iters):
+                    t0 = time.perf_counter()
+                    engine(x)
+                    times.append((time.perf_counter() - t0) * 1000.0)
+            p50, p90 = np.percentile(times, [50, 90])
+            print(f"{engine.name:<12}{bs:>6}{p50:>10.2f}{p90:>10.2f}{p50 / bs:>10.2f}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "check", "bench", "mmap"])
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--batch", type=int, default=4, help="batch size for check")
+    parser.add_argument("--atol", type=float, default=1e-3, help="max abs logit difference for check")
+    parser.add_argument("--mask-tol", type=float, default=1e-3, help="max fraction of differing mask pixels")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--ort-intra", type=int, default=srv.ORT_INTRA_OP_THREADS)
+    parser.add_argument("--ort-inter", type=int, default=srv.ORT_INTER_OP_THREADS)
+    parser.add_argument("--format", choices=WEIGHTS_FORMATS, default=srv.WEIGHTS_FORMAT, help="weights format for mmap")
+    args = parser.parse_args()
+
+    if args.command == "mmap":
+        # converts straight from the checkpoint file, no model needed
+        return cmd_mmap(args)
+    srv.load_model()
+    return {"export": cmd_export, "check": cmd_check, "bench": cmd_bench}[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+# gunicorn.conf.py
+"""
+Production entry point:  gunicorn -c gunicorn.conf.py
+- preload_app: the master imports the app, creates the DB schema and loads the checkpoint once;
+  forked workers share the weights copy-on-write instead of each loading its own copy
+- Every worker warms up in a background thread after the fork (allocator, oneDNN, CAM and
+  render pools are per process) and answers GET /ready with 200 once that is done
+- Background threads (micro-batcher, log writer, pipeline, render pool) start lazily per worker
+- SQLite connections are never shared across the fork: the master closes its pool after
+  creating the schema and each worker drops whatever pooled connection it inherited
+- workers / threads default to the `python autotune.py` recommendation for this machine
+"""
+import os
+
+from tuning import load_tuning
+
+_tuned = load_tuning(os.environ.get("AUTOTUNE_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                    "autotune.json")))
+
+wsgi_app = "app_pytorch_inference:app"
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", str(_tuned.get("workers", 2))))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", str(_tuned.get("threads", 8))))
+preload_app = True
+# CPU inference with CAM can be slow under load (warm-up itself runs off the worker's main thread)
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+
+def when_ready(server):
+    # master, after the preloaded import and before any worker is forked
+    import app_pytorch_inference as srv
+    try:
+        srv.init_resources()
+    except Exception as e:
+        # workers retry in their own startup and report the error on /ready
+        server.log.error("Preload of model / DB failed: %s", e)
+    finally:
+        # init_db() checked a connection out of the pool; workers must open their own
+        srv.engine.dispose()
+
+
+def post_fork(server, worker):
+    import app_pytorch_inference as srv
+    # forget (without closing) any SQLite connection inherited from the master
+    srv.engine.dispose(close=False)
+    srv.startup(background=True)
@@ -0,0 +1,137 @@
+# jobs.py
+"""
+In-process job registry for asynchronous /predict artifact generation.
+- create() registers a job holding the immediate classification result
+- Worker threads publish each artifact (heatmap, mask) as it is ready, then finish or fail the job
+- snapshot() returns the merged result so far; events() yields (event, data) pairs for SSE,
+  replaying what already happened and then blocking for new updates
+- Finished jobs are evicted after ttl_s, and the oldest finished jobs beyond max_jobs; running
+  jobs are never dropped: create() raises JobStoreFull when every slot holds one
+"""
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+
+class JobStoreFull(Exception):
+    """Every job slot is taken by a running job."""
+
+
+class _Job:
+    __slots__ = ("job_id", "status", "result", "error", "events", "finished_at")
+
+    def __init__(self, job_id, result):
+        self.job_id = job_id
+        self.status = "running"
+        self.result = dict(result)
+        self.error = None
+        # (event name, payload) in publish order, replayed to late SSE subscribers
+        self.events = [("classification", dict(result))]
+        self.finished_at = None
+
+
+class JobStore:
+    def __init__(self, ttl_s=600.0, max_jobs=1000):
+        self.ttl_s = float(ttl_s)
+        self.max_jobs = max(1, int(max_jobs))
+        self._jobs = OrderedDict()
+        self._cond = threading.Condition()
+
+    def create(self, result):
+        job_id = uuid.uuid4().hex
+        with self._cond:
+            self._evict_locked()
+            if len(self._jobs) >= self.max_jobs:
+                raise JobStoreFull(f"{len(self._jobs)} async jobs still running")
+            self._jobs[job_id] = _Job(job_id, result)
+        return job_id
+
+    def has_room(self):
+        """False when every slot holds a running job (cheap check before starting work)."""
+        with self._cond:
+            self._evict_locked()
+            return len(self._jobs) < self.max_jobs
+
+    def publish(self, job_id, event, fields):
+        """Merge fields into the job's result and notify subscribers with event."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.result.update(fields)
+            job.events.append((event, dict(fields)))
+            self._cond.notify_all()
+
+    def finish(self, job_id, fields=None):
+        self._close(job_id, "done", fields or {}, None)
+
+    def fail(self, job_id, error):
+        self._close(job_id, "error", {}, str(error))
+
+    def _close(self, job_id, status, fields, error):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.result.update(fields)
+            job.status = status
+            job.error = error
+            job.finished_at = time.monotonic()
+            payload = dict(fields)
+            if error is not None:
+                payload["error"] = error
+            job.events.append((status, payload))
+            self._cond.notify_all()
+
+    def snapshot(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            out = {"job_id": job_id, "status": job.status}
+            out.update(job.result)
+            if job.error is not None:
+                out["error"] = job.error
+            return out
+
+    def events(self, job_id, keepalive_s=15.0):
+        """
+        Yield (event, data) for job_id from the start, ending after "done" / "error".
+        Yields (None, None) every keepalive_s without news; returns immediately for unknown jobs.
+        """
+        sent = 0
+        while True:
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return
+                if sent >= len(job.events) and job.status == "running":
+                    self._cond.wait(timeout=keepalive_s)
+                pending = job.events[sent:]
+                sent += len(pending)
+                status = job.status
+            if not pending:
+                yield None, None
+            for event, data in pending:
+                yield event, data
+            if status != "running" and sent >= len(job.events):
+                return
+
+    def stats(self):
+        with self._cond:
+            running = sum(1 for j in self._jobs.values() if j.status == "running")
+            return {"jobs": len(self._jobs), "running": running, "ttl_s": self.ttl_s, "max_jobs": self.max_jobs}
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        expired = [jid for jid, j in self._jobs.items()
+                   if j.finished_at is not None and now - j.finished_at > self.ttl_s]
+        for jid in expired:
+            del self._jobs[jid]
+        if len(self._jobs) < self.max_jobs:
+            return
+        # oldest finished jobs first; running ones stay until they finish
+        finished = [jid for jid, j in self._jobs.items() if j.finished_at is not None]
+        for jid in finished[:len(self._jobs) - self.max_jobs + 1]:
+            del self._jobs[jid]
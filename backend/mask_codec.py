@@ -0,0 +1,55 @@
+# mask_codec.py
+"""
+Compact segmentation-mask outputs.
+- Threshold directly on logits: sigmoid(x) > 0.25  <=>  x > log(0.25 / 0.75)
+- The mask stays at the decoder's output resolution (no overlay, no PNG)
+- "rle":     row-major run lengths, starting with a run of 0s
+- "polygon": region outlines ("polygons") and the outlines of holes inside them ("holes") from
+  cv2.findContours (RETR_CCOMP), [[x, y], ...] per ring; fill all rings with the even-odd rule.
+  Lossy: rings run through boundary pixel centres, so regions of 1-2 pixels have no area;
+  "rle" is the exact format
+Both carry "size": [height, width] so the client can scale onto the original image.
+"""
+import math
+
+import numpy as np
+import cv2
+import torch
+
+MASK_THRESHOLD = 0.25
+LOGIT_THRESHOLD = math.log(MASK_THRESHOLD / (1.0 - MASK_THRESHOLD))
+MASK_FORMATS = ("png", "rle", "polygon")
+
+
+def mask_from_logits(seg_logits):
+    """(1, 1, H, W) logits tensor -> (H, W) uint8 {0, 1} mask, no sigmoid needed."""
+    return (seg_logits[0, 0] > LOGIT_THRESHOLD).to(torch.uint8).cpu().numpy()
+
+
+def encode_rle(mask):
+    h, w = mask.shape
+    flat = np.ascontiguousarray(mask, dtype=np.uint8).reshape(-1)
+    # indices where the value changes, plus both ends
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], change, [flat.size]))
+    counts = np.diff(bounds).tolist()
+    if flat.size and flat[0] == 1:
+        counts.insert(0, 0)
+    return {"size": [int(h), int(w)], "order": "row-major", "counts": counts}
+
+
+def encode_polygons(mask, min_area=0.0):
+    h, w = mask.shape
+    contours, hierarchy = cv2.findContours(np.ascontiguousarray(mask, dtype=np.uint8), cv2.RETR_CCOMP,
+                                           cv2.CHAIN_APPROX_SIMPLE)
+    polygons, holes = [], []
+    for i, c in enumerate(contours):
+        if cv2.contourArea(c) < min_area:
+            continue
+        # two-level hierarchy: no parent = region outline, parent = hole in that region
+        (holes if hierarchy[0][i][3] >= 0 else polygons).append(c.reshape(-1, 2).tolist())
+    return {"size": [int(h), int(w)], "polygons": polygons, "holes": holes}
+
+
+def empty_mask(size):
+    return np.zeros(size, dtype=np.uint8)
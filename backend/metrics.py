@@ -0,0 +1,269 @@
+# metrics.py
+"""
+Prometheus text-format metrics and per-request stage timers, without a client library.
+- Counter / Gauge / Histogram with label tuples; an observation is a bisect plus a locked add
+- Gauges can be callables read at scrape time (queue depths, model info), so nothing is
+  sampled on the request path
+- StageTimings: per-request {stage: seconds}, observed into a stage histogram as each stage
+  ends and rendered as a Server-Timing header ("decode;dur=3.1, forward;dur=41.0, ...")
+- instrument_app: request latency / status counters, in-flight gauge, flask.g.timings,
+  the Server-Timing header and GET /metrics for a Flask app
+"""
+import time
+import bisect
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """
+    Set / inc / dec, or fn: callable returning a number (no labels) or {label tuple: number},
+    evaluated at scrape time.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), fn=None):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+        self._values = {}
+
+    def set(self, value, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def inc(self, amount=1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, amount=1, *labelvalues):
+        self.inc(-amount, *labelvalues)
+
+    def render(self):
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                value = None
+            if value is None:
+                items = []
+            elif isinstance(value, dict):
+                items = list(value.items())
+            else:
+                items = [((), value)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label tuple -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+
+    def observe(self, value, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._series.items()]
+        lines = self.header()
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class _StageTimer:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+class StageTimings:
+    """
+    Stage durations of one request. Stages may be timed from several threads (pipeline stages);
+    a stage timed twice (e.g. base64 of heatmap and mask) accumulates.
+    """
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram
+        self.stages = {}
+        self.notes = {}
+
+    def stage(self, name):
+        return _StageTimer(self, name)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if self.histogram is not None:
+            self.histogram.observe(seconds, name)
+
+    def note(self, name, description):
+        # Server-Timing entry without a duration, e.g. cache;desc="HIT"
+        self.notes[name] = description
+
+    def server_timing(self, total=None):
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in list(self.stages.items())]
+        parts.extend(f'{name};desc="{_escape(desc)}"' for name, desc in list(self.notes.items()))
+        if total is not None:
+            parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+def timed(timings, name):
+    """timings.stage(name), or a no-op context manager when timings is None."""
+    return timings.stage(name) if timings is not None else _NO_TIMER
+
+
+def instrument_app(app, registry, stage_histogram=None, prefix=""):
+    """
+    Register request metrics and GET /metrics on a Flask app. Handlers time their stages with
+    flask.g.timings (a StageTimings observed into stage_histogram); every response gets a
+    Server-Timing header with those stages plus the total.
+    """
+    from flask import Response, g, request
+
+    request_seconds = registry.register(Histogram(
+        prefix + "http_request_duration_seconds", "HTTP request latency (until the response is returned)",
+        ("route", "method", "status")))
+    requests_total = registry.register(Counter(
+        prefix + "http_requests_total", "HTTP requests by route and status", ("route", "method", "status")))
+    in_flight = registry.register(Gauge(prefix + "http_requests_in_flight", "Requests being handled"))
+
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+        g.timings = StageTimings(stage_histogram)
+        in_flight.inc()
+
+    @app.after_request
+    def _record(response):
+        start = getattr(g, "request_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        labels = (route, request.method, str(response.status_code))
+        request_seconds.observe(elapsed, *labels)
+        requests_total.inc(1, *labels)
+        response.headers["Server-Timing"] = g.timings.server_timing(total=elapsed)
+        return response
+
+    @app.teardown_request
+    def _finish(_exc):
+        if getattr(g, "request_start", None) is not None:
+            in_flight.dec()
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+    # let browser devtools read Server-Timing on cross-origin API calls
+    @app.after_request
+    def _expose_timing(response):
+        response.headers["Timing-Allow-Origin"] = "*"
+        return response
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Move heatmap/mask images out of the predictions table into the artifact store.
+
+For every row that still has heatmap_base64 / mask_base64 text, the PNG is written to
+ARTIFACT_DIR (content-addressed), heatmap_ref / mask_ref are set and the base64 columns
+are cleared. Safe to re-run; rows are processed in id order in batches.
+
+Usage:
+    python migrate_artifacts.py [--batch-size 200] [--vacuum] [--dry-run]
+"""
+import sys
+import base64
+import argparse
+
+from sqlalchemy import text
+
+import app_pytorch_inference as srv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the database afterwards to reclaim space")
+    parser.add_argument("--dry-run", action="store_true", help="only count rows that would be migrated")
+    args = parser.parse_args()
+
+    srv.init_db()
+    pending = "(heatmap_base64 IS NOT NULL OR mask_base64 IS NOT NULL)"
+
+    with srv.engine.connect() as conn:
+        total = conn.execute(text(f"SELECT COUNT(*) FROM predictions WHERE {pending}")).scalar()
+    print(f"{total} rows to migrate into {srv.ARTIFACT_DIR}")
+    if args.dry_run or not total:
+        return 0
+
+    last_id = 0
+    moved = 0
+    failed = 0
+    while True:
+        with srv.engine.begin() as conn:
+            rows = conn.execute(text(
+                f"SELECT id, heatmap_base64, mask_base64 FROM predictions "
+                f"WHERE id > :last AND {pending} ORDER BY id LIMIT :n"
+            ), {"last": last_id, "n": args.batch_size}).fetchall()
+            if not rows:
+                break
+            updates = []
+            for pid, heatmap_b64, mask_b64 in rows:
+                last_id = pid
+                try:
+                    h = srv.artifact_store.put(base64.b64decode(heatmap_b64), "png") if heatmap_b64 else None
+                    m = srv.artifact_store.put(base64.b64decode(mask_b64), "png") if mask_b64 else None
+                except Exception as e:
+                    # leave the row untouched; it is still served from the base64 column
+                    print(f"row {pid}: could not migrate ({e})")
+                    failed += 1
+                    continue
+                updates.append({"id": pid, "h": h, "m": m})
+            if updates:
+                conn.execute(text(
+                    "UPDATE predictions SET heatmap_ref = COALESCE(:h, heatmap_ref), mask_ref = COALESCE(:m, mask_ref), "
+                    "heatmap_base64 = NULL, mask_base64 = NULL WHERE id = :id"
+                ), updates)
+            moved += len(updates)
+        print(f"migrated {moved}/{total} rows (last id {last_id})")
+
+    if args.vacuum:
+        print("VACUUM ...")
+        with srv.engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+
+    print(f"done: {moved} migrated, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
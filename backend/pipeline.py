@@ -0,0 +1,97 @@
+# pipeline.py
+"""
+Staged request pipeline with bounded queues between stages.
+- Each stage has its own worker threads and an input queue of at most maxsize jobs
+- A job is a dict handed from stage to stage; a stage function updates / returns it,
+  and the last stage's return value resolves the caller's Future
+- A full queue blocks the stage feeding it, so a slow stage pushes back instead of
+  piling up work in memory
+- Threads start lazily (and again after a fork), like the micro-batcher
+"""
+import os
+import queue
+import threading
+import traceback
+from concurrent.futures import Future
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1, maxsize=16):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.maxsize = max(0, int(maxsize))
+        self.queue = None
+        self.processed = 0
+        self.busy = 0
+
+
+class Pipeline:
+    def __init__(self, stages, name="pipeline"):
+        if not stages:
+            raise ValueError("a pipeline needs at least one stage")
+        self.stages = list(stages)
+        self.name = name
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_workers(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            for stage in self.stages:
+                stage.queue = queue.Queue(maxsize=stage.maxsize)
+                stage.busy = 0
+            for idx, stage in enumerate(self.stages):
+                for n in range(stage.workers):
+                    t = threading.Thread(target=self._loop, args=(idx,), name=f"{self.name}-{stage.name}-{n}",
+                                         daemon=True)
+                    t.start()
+            self._pid = os.getpid()
+
+    def submit(self, job):
+        """Queue job at the first stage (blocking while it is full); returns a Future of the result."""
+        self._ensure_workers()
+        fut = Future()
+        self.stages[0].queue.put((job, fut))
+        return fut
+
+    def __call__(self, job):
+        return self.submit(job).result()
+
+    def _loop(self, idx):
+        stage = self.stages[idx]
+        nxt = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+        while True:
+            job, fut = stage.queue.get()
+            with self._lock:
+                stage.busy += 1
+            try:
+                out = stage.fn(job)
+            except Exception as e:
+                traceback.print_exc()
+                fut.set_exception(e)
+                continue
+            finally:
+                with self._lock:
+                    stage.busy -= 1
+                    stage.processed += 1
+            if nxt is None:
+                fut.set_result(out)
+            else:
+                nxt.queue.put((out, fut))
+
+    def stats(self):
+        with self._lock:
+            return {
+                stage.name: {
+                    "workers": stage.workers,
+                    "queued": stage.queue.qsize() if stage.queue is not None else 0,
+                    "maxsize": stage.maxsize,
+                    "busy": stage.busy,
+                    "processed": stage.processed,
+                }
+                for stage in self.stages
+            }
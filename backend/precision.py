@@ -0,0 +1,215 @@
+# precision.py
+"""
+Reduced-precision / quantized CPU inference modes for MultiTaskNet.
+- fp32           the model as loaded
+- dynamic_int8   dynamic int8 quantization of the classifier Linear
+- static_int8    FX static int8 of encoder.features and seg_head (calibrated, saved as TorchScript
+                 with encode / classify / segment kept, so the decoder still runs conditionally)
+                 + dynamic int8 classifier
+- bf16           CPU autocast to bfloat16
+- channels_last  NHWC memory format (oneDNN-friendly convolutions)
+
+A mode other than fp32 is only enabled when an agreement report (written by
+`python quantize_model.py calibrate`) exists for the same checkpoint and passes every gate:
+top-1 agreement, max softmax-probability difference and mean mask IoU against fp32.
+"""
+import copy
+import json
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from mask_codec import LOGIT_THRESHOLD
+
+MODES = ("fp32", "dynamic_int8", "static_int8", "bf16", "channels_last")
+
+
+class _StagedNet(nn.Module):
+    # MultiTaskNet.forward with swappable stages
+    def __init__(self, features, classifier, seg_head, img_size):
+        super().__init__()
+        self.features = features
+        self.classifier = classifier
+        self.seg_head = seg_head
+        self.img_size = img_size
+
+    def encode(self, x):
+        return self.features(x)
+
+    def classify(self, feats):
+        pooled = F.adaptive_avg_pool2d(feats, 1).reshape(feats.shape[0], -1)
+        return self.classifier(pooled)
+
+    def segment(self, feats):
+        seg_out = self.seg_head(feats)
+        if seg_out.shape[-2:] != (self.img_size, self.img_size):
+            seg_out = F.interpolate(seg_out, size=(self.img_size, self.img_size), mode='bilinear', align_corners=False)
+        return seg_out
+
+    def forward(self, x):
+        feats = self.encode(x)
+        return self.classify(feats), self.segment(feats)
+
+
+class _Bf16Net(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def encode(self, x):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            return self.model.encode(x)
+
+    def classify(self, feats):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            return self.model.classify(feats).float()
+
+    def segment(self, feats):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            return self.model.segment(feats).float()
+
+    def forward(self, x):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            cls_out, seg_out = self.model(x)
+        return cls_out.float(), seg_out.float()
+
+
+class _ChannelsLastNet(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def encode(self, x):
+        return self.model.encode(x.contiguous(memory_format=torch.channels_last))
+
+    def classify(self, feats):
+        return self.model.classify(feats)
+
+    def segment(self, feats):
+        return self.model.segment(feats)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+def _dynamic_classifier(model):
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model.classifier), {nn.Linear}, dtype=torch.qint8)
+
+
+def build_dynamic_int8(model):
+    return _StagedNet(model.encoder.features, _dynamic_classifier(model), model.seg_head, model.img_size).eval()
+
+
+def build_static_int8(model, calibration_batches, backend="fbgemm"):
+    """FX-quantize encoder.features and seg_head, calibrating on an iterable of input batches."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = backend
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    batches = list(calibration_batches)
+    if not batches:
+        raise ValueError("static_int8 needs at least one calibration batch")
+
+    features = copy.deepcopy(model.encoder.features).eval()
+    seg_head = copy.deepcopy(model.seg_head).eval()
+    with torch.no_grad():
+        example_feats = features(batches[0][:1])
+    features_p = prepare_fx(features, qconfig_mapping, example_inputs=(batches[0][:1],))
+    seg_head_p = prepare_fx(seg_head, qconfig_mapping, example_inputs=(example_feats,))
+    with torch.no_grad():
+        for batch in batches:
+            feats = features_p(batch)
+            seg_head_p(feats)
+    return _StagedNet(convert_fx(features_p), _dynamic_classifier(model), convert_fx(seg_head_p), model.img_size).eval()
+
+
+STAGED_METHODS = ("encode", "classify", "segment")
+
+
+def save_static_int8(qmodel, path, img_size):
+    # every stage traced as its own method and kept through freeze (a plain trace keeps only forward)
+    example = torch.randn(1, 3, img_size, img_size)
+    with torch.no_grad():
+        feats = qmodel.encode(example)
+        traced = torch.jit.trace_module(qmodel, {"forward": example, "encode": example, "classify": feats,
+                                                 "segment": feats}, check_trace=False)
+    torch.jit.save(torch.jit.freeze(traced.eval(), preserved_attrs=list(STAGED_METHODS)), str(path))
+
+
+def is_staged(module):
+    return all(hasattr(module, a) for a in STAGED_METHODS)
+
+
+def apply_precision(mode, model, static_int8_path=None):
+    """Return an inference module for mode (model itself for fp32)."""
+    if mode == "fp32":
+        return model
+    if mode == "dynamic_int8":
+        return build_dynamic_int8(model)
+    if mode == "static_int8":
+        return torch.jit.load(str(static_int8_path), map_location="cpu").eval()
+    if mode == "bf16":
+        return _Bf16Net(model).eval()
+    if mode == "channels_last":
+        return _ChannelsLastNet(copy.deepcopy(model)).eval()
+    raise ValueError(f"unknown precision mode {mode!r}; expected one of {MODES}")
+
+
+# ---------------- Accuracy / agreement gate ----------------
+def agreement_report(reference, candidate, batches):
+    """Compare candidate vs reference (fp32) outputs over batches -> dict of agreement metrics."""
+    n = 0
+    agree = 0
+    max_prob_delta = 0.0
+    ious = []
+    with torch.inference_mode():
+        for batch in batches:
+            ref_cls, ref_seg = reference(batch)
+            cls_out, seg_out = candidate(batch)
+            ref_p = torch.softmax(ref_cls.float(), dim=1)
+            p = torch.softmax(cls_out.float(), dim=1)
+            agree += int((p.argmax(1) == ref_p.argmax(1)).sum())
+            max_prob_delta = max(max_prob_delta, float((p - ref_p).abs().max()))
+            ref_mask = ref_seg.float() > LOGIT_THRESHOLD
+            mask = seg_out.float() > LOGIT_THRESHOLD
+            inter = (ref_mask & mask).flatten(1).sum(1).float()
+            union = (ref_mask | mask).flatten(1).sum(1).float()
+            # two empty masks agree perfectly
+            ious.extend(torch.where(union > 0, inter / union.clamp(min=1), torch.ones_like(union)).tolist())
+            n += batch.shape[0]
+    return {
+        "images": n,
+        "argmax_agreement": agree / n if n else 0.0,
+        "max_prob_delta": max_prob_delta,
+        "mask_iou_mean": float(np.mean(ious)) if ious else 0.0,
+        "mask_iou_min": float(np.min(ious)) if ious else 0.0,
+    }
+
+
+def gate(entry, min_agreement, max_prob_delta=1.0, min_mask_iou=0.0):
+    """(ok, reason) for one mode's agreement metrics."""
+    if entry.get("argmax_agreement", 0.0) < min_agreement:
+        return False, f"argmax agreement {entry.get('argmax_agreement', 0.0):.4f} < {min_agreement}"
+    if entry.get("max_prob_delta", 1.0) > max_prob_delta:
+        return False, f"max probability delta {entry.get('max_prob_delta', 1.0):.4f} > {max_prob_delta}"
+    if entry.get("mask_iou_mean", 0.0) < min_mask_iou:
+        return False, f"mean mask IoU {entry.get('mask_iou_mean', 0.0):.4f} < {min_mask_iou}"
+    return True, "ok"
+
+
+def check_report(report_path, mode, model_id, min_agreement, max_prob_delta=1.0, min_mask_iou=0.0):
+    """Return (ok, reason) for enabling mode given the saved report file."""
+    try:
+        with open(report_path) as fh:
+            report = json.load(fh)
+    except (OSError, ValueError):
+        return False, f"no agreement report at {report_path}"
+    if report.get("model_id") != model_id:
+        return False, "agreement report was produced for a different checkpoint"
+    entry = report.get("modes", {}).get(mode)
+    if entry is None:
+        return False, f"mode {mode!r} missing from agreement report"
+    return gate(entry, min_agreement, max_prob_delta, min_mask_iou)
@@ -0,0 +1,164 @@
+# prediction_log.py
+"""
+Background writer for prediction rows.
+- Rows go into a bounded queue; one writer thread commits them in batched transactions
+- Durability modes:
+    sync            caller waits until its row is committed (group commit) and gets the row id
+    async           caller returns immediately; blocks only while the queue is full
+    fire-and-forget caller never blocks; rows are dropped (and counted) when the queue is full
+- flush()/close() drain the queue; close() is registered with atexit by the app
+- stats(): queue depth, rows written/dropped, flush latency
+"""
+import os
+import time
+import queue
+import threading
+import traceback
+from concurrent.futures import Future
+
+from sqlalchemy import text
+
+MODES = ("sync", "async", "fire-and-forget")
+
+
+class PredictionLogWriter:
+    def __init__(self, engine, insert_sql, mode="async", max_queue=1000, max_batch=200, linger_ms=20):
+        if mode not in MODES:
+            raise ValueError(f"unknown durability mode {mode!r}; expected one of {MODES}")
+        self.engine = engine
+        self.insert_sql = text(insert_sql)
+        self.mode = mode
+        self.max_batch = max(1, int(max_batch))
+        self.linger = max(0.0, float(linger_ms)) / 1000.0
+        self._max_queue = int(max_queue)
+        self._queue = queue.Queue(maxsize=self._max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._counters = {
+            "written": 0,
+            "dropped": 0,
+            "errors": 0,
+            "flushes": 0,
+        }
+        self._flush_ms_total = 0.0
+        self._flush_ms_max = 0.0
+        self._flush_ms_last = 0.0
+
+    # ---------- producer side ----------
+    def submit(self, row):
+        """Queue one row. Returns the row id in sync mode, else None."""
+        return self.submit_many([row])[0]
+
+    def submit_many(self, rows):
+        """Queue rows. Returns a list of ids (sync mode) or Nones."""
+        if not rows:
+            return []
+        self._ensure_worker()
+        futures = []
+        for row in rows:
+            fut = Future()
+            if self.mode == "fire-and-forget":
+                try:
+                    self._queue.put_nowait((row, fut))
+                except queue.Full:
+                    with self._lock:
+                        self._counters["dropped"] += 1
+                    continue
+            else:
+                self._queue.put((row, fut))
+            futures.append(fut)
+        if self.mode != "sync":
+            return [None] * len(rows)
+        return [fut.result() for fut in futures]
+
+    def flush(self, timeout=10.0):
+        """Block until every queued row has been committed (or timeout)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self._queue.unfinished_tasks == 0
+
+    def close(self, timeout=10.0):
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._queue.put((None, None))
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._counters)
+            flushes = out["flushes"]
+            out.update({
+                "mode": self.mode,
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self._max_queue,
+                "flush_ms_last": round(self._flush_ms_last, 3),
+                "flush_ms_avg": round(self._flush_ms_total / flushes, 3) if flushes else 0.0,
+                "flush_ms_max": round(self._flush_ms_max, 3),
+            })
+        return out
+
+    # ---------- writer thread ----------
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                # rows queued in the parent before a fork belong to the parent
+                self._queue = queue.Queue(maxsize=self._max_queue)
+            self._pid = os.getpid()
+            self._closed = False
+            self._thread = threading.Thread(target=self._loop, name="prediction-log-writer", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.linger
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            items = [b for b in batch if b[0] is not None]
+            stop = len(items) != len(batch)
+            try:
+                self._write(items)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, items):
+        if not items:
+            return
+        start = time.perf_counter()
+        try:
+            ids = []
+            # one transaction per batch; rows are executed individually so each gets its id
+            with self.engine.begin() as conn:
+                for row, _ in items:
+                    ids.append(conn.execute(self.insert_sql, row).lastrowid)
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                self._counters["errors"] += len(items)
+            for _, fut in items:
+                fut.set_exception(e)
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            self._counters["written"] += len(items)
+            self._counters["flushes"] += 1
+            self._flush_ms_last = elapsed_ms
+            self._flush_ms_total += elapsed_ms
+            self._flush_ms_max = max(self._flush_ms_max, elapsed_ms)
+        for (_, fut), row_id in zip(items, ids):
+            fut.set_result(row_id)
@@ -0,0 +1,68 @@
+# preprocess.py
+"""
+Decode-to-tensor preprocessing for fundus uploads.
+- JPEG: Image.draft() lets libjpeg decode at 1/2, 1/4 or 1/8 scale (DCT scaling), so a
+  4000 px capture is decoded at ~500 px instead of being fully decoded and then shrunk
+- one resize to (img_size, img_size), same resample filter as the old pipeline
+- uint8 -> normalized float32 through a per-channel 256-entry lookup table, written
+  straight into a preallocated (3, H, W) buffer (per thread) or a caller-provided batch row
+"""
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+class Preprocessor:
+    def __init__(self, img_size, mean, std, resample=Image.BICUBIC):
+        self.img_size = int(img_size)
+        self.resample = resample
+        mean = np.asarray(mean, dtype=np.float32)
+        std = np.asarray(std, dtype=np.float32)
+        # lut[c, v] == (v / 255 - mean[c]) / std[c]
+        self._lut = np.ascontiguousarray(
+            ((np.arange(256, dtype=np.float32)[None, :] / 255.0) - mean[:, None]) / std[:, None])
+        self._local = threading.local()
+
+    def decode(self, stream):
+        """Decode an upload to an RGB PIL image of (img_size, img_size)."""
+        size = (self.img_size, self.img_size)
+        img = Image.open(stream)
+        # JPEG only (no-op otherwise): smallest DCT scale that keeps both sides >= img_size
+        img.draft("RGB", size)
+        img = img.convert("RGB")
+        if img.size != size:
+            img = img.resize(size, self.resample)
+        return img
+
+    def _thread_buffer(self):
+        buf = getattr(self._local, "buf", None)
+        if buf is None:
+            buf = np.empty((3, self.img_size, self.img_size), dtype=np.float32)
+            self._local.buf = buf
+        return buf
+
+    def to_array(self, pil_img, out=None):
+        """
+        Normalize an (img_size, img_size) RGB image into out (3, H, W) float32.
+        out=None allocates a fresh array.
+        """
+        rgb = np.asarray(pil_img, dtype=np.uint8)
+        if out is None:
+            out = np.empty((3, self.img_size, self.img_size), dtype=np.float32)
+        for c in range(3):
+            np.take(self._lut[c], rgb[:, :, c], out=out[c])
+        return out
+
+    def to_tensor(self, pil_img, reuse=False):
+        """
+        (1, 3, H, W) float tensor. reuse=True writes into this thread's buffer: the tensor is
+        only valid until the same thread preprocesses its next image.
+        """
+        out = self._thread_buffer() if reuse else None
+        return torch.from_numpy(self.to_array(pil_img, out=out)).unsqueeze(0)
+
+    def new_batch(self, n):
+        """Preallocated (n, 3, H, W) batch; fill rows with to_array(img, out=batch[i])."""
+        return np.empty((n, 3, self.img_size, self.img_size), dtype=np.float32)
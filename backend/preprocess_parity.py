@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Parity check: Preprocessor (draft decode + LUT normalization) vs the original
+Image.open().convert("RGB").resize() + build_preprocess() pipeline, in three parts:
+- normalization: LUT output vs build_preprocess() on the same decoded image (float rounding only)
+- draft scale: the JPEG DCT scale libjpeg decoded at is the smallest one keeping both sides >= IMG_SIZE
+- decode: draft-decoded + resized pixels vs the full-resolution decode, in 8-bit steps; the
+  mean and 99th percentile are gated, the max is reported (edges of thin vessels move by a few steps,
+  most when the draft lands just above IMG_SIZE; one DCT scale too small roughly doubles both)
+
+Usage:
+    python preprocess_parity.py --images path/to/fundus [--lut-atol 1e-5] [--mean-steps 1.5] [--p99-steps 14]
+Exits with status 1 if any image exceeds a tolerance.
+tests/test_preprocess.py runs the same checks on synthetic JPEGs and PNGs.
+"""
+import sys
+import argparse
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import app_pytorch_inference as srv
+
+
+def reference_image(path):
+    pil = Image.open(path).convert("RGB")
+    return pil.resize((srv.IMG_SIZE, srv.IMG_SIZE))
+
+
+def fast_image(path):
+    with open(path, "rb") as fh:
+        return srv._preprocessor.decode(fh)
+
+
+def draft_scale_ok(path):
+    """-> (ok, decoded size, full size). Non-JPEG images must not be drafted at all."""
+    with Image.open(path) as img:
+        full, is_jpeg = img.size, img.format == "JPEG"
+        img.draft("RGB", (srv.IMG_SIZE, srv.IMG_SIZE))
+        drafted = img.size
+    scale = 1
+    if is_jpeg:
+        # libjpeg scales by 1/1, 1/2, 1/4 or 1/8: the smallest output still >= IMG_SIZE on both sides
+        scale = max(s for s in (1, 2, 4, 8) if min(full) // s >= srv.IMG_SIZE or s == 1)
+    expected = tuple(-(-side // scale) for side in full)
+    return drafted == expected, drafted, full
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True)
+    parser.add_argument("--lut-atol", type=float, default=1e-5,
+                        help="max abs normalized difference, LUT vs build_preprocess on the same image")
+    parser.add_argument("--mean-steps", type=float, default=1.5, help="max mean abs pixel difference (8-bit steps)")
+    parser.add_argument("--p99-steps", type=float, default=14.0,
+                        help="max 99th-percentile abs pixel difference (8-bit steps)")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in Path(args.images).iterdir() if p.suffix.lower() in srv.IMAGE_EXTENSIONS)
+    failed = 0
+    worst_max = 0
+    for p in paths:
+        ref_pil, fast_pil = reference_image(p), fast_image(p)
+
+        lut_diff = float(np.abs(srv._preprocessor.to_array(fast_pil) - srv.build_preprocess()(fast_pil).numpy()).max())
+        scale_ok, drafted, full = draft_scale_ok(p)
+        steps = np.abs(np.asarray(fast_pil, dtype=np.int16) - np.asarray(ref_pil, dtype=np.int16))
+        mean, p99, peak = float(steps.mean()), float(np.percentile(steps, 99)), int(steps.max())
+        worst_max = max(worst_max, peak)
+
+        ok = lut_diff <= args.lut_atol and scale_ok and mean <= args.mean_steps and p99 <= args.p99_steps
+        failed += 0 if ok else 1
+        print(f"{'ok  ' if ok else 'FAIL'} {p.name}: lut_max_abs={lut_diff:.1e} "
+              f"draft={full[0]}x{full[1]}->{drafted[0]}x{drafted[1]}{'' if scale_ok else ' (wrong scale)'} "
+              f"steps mean={mean:.3f} p99={p99:.0f} max={peak}")
+    print(f"{len(paths)} images, {failed} failures, worst pixel difference {worst_max} steps")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# profiling.py
+"""
+On-demand profiles of single /predict requests.
+- RequestProfiler.profile(): torch.profiler (CPU, + CUDA when available) with cProfile around the
+  same block; stage timers become record_function ranges, so the Chrome trace shows
+  decode / forward / cam / ... as named spans
+- Each profile is a directory <id>/ with trace.json (chrome://tracing, Perfetto), ops.txt
+  (top-N operators by self time), python.txt (top-N Python functions by cumulative time)
+  and meta.json
+- The output directory rotates: oldest profiles are deleted while it exceeds max_bytes
+- should_sample(): 1-in-N sampling decision (N <= 0 = never)
+cProfile only sees the thread that enables it: profiled requests must run every stage inline.
+"""
+import io
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import pstats
+import cProfile
+import itertools
+import threading
+from pathlib import Path
+
+import torch
+
+from metrics import StageTimings
+
+FILES = ("trace.json", "ops.txt", "python.txt", "meta.json")
+_ID_RE = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9a-f]{8}$")
+
+
+class _RangeTimer:
+    __slots__ = ("timer", "name", "range")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.range = torch.profiler.record_function(self.name)
+        self.range.__enter__()
+        self.timer.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.__exit__(*exc)
+        self.range.__exit__(*exc)
+        return False
+
+
+class ProfiledTimings(StageTimings):
+    """StageTimings whose stages are also named ranges in the torch profiler trace."""
+
+    def stage(self, name):
+        return _RangeTimer(super().stage(name), name)
+
+
+def _dir_size(path):
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+
+def _device_ms(evt, attr):
+    # self_cuda_time_total was renamed self_device_time_total in newer torch
+    value = getattr(evt, attr.replace("cuda", "device"), None)
+    if value is None:
+        value = getattr(evt, attr, 0)
+    return round(value / 1000.0, 3)
+
+
+class ProfileRun:
+    """Result of one profiled block; summary() is filled in once the block has exited."""
+
+    def __init__(self, profile_id, label, sampled):
+        self.id = profile_id
+        self.label = label
+        self.sampled = sampled
+        self.top_ops = []
+        self.top_python = []
+        self.wall_ms = None
+
+    def summary(self):
+        return {"id": self.id, "sampled": self.sampled, "wall_ms": self.wall_ms,
+                "top_ops": self.top_ops, "top_python": self.top_python}
+
+
+class RequestProfiler:
+    def __init__(self, out_dir, max_bytes=200 * 1024 * 1024, sample_every=0, top_n=25):
+        self.out_dir = Path(out_dir)
+        self.max_bytes = max_bytes
+        self.sample_every = sample_every
+        self.top_n = top_n
+        self.cuda = torch.cuda.is_available()
+        self._counter = itertools.count(1)
+        # one profile at a time: torch.profiler is process-wide
+        self._lock = threading.Lock()
+        self._rotate_lock = threading.Lock()
+
+    def should_sample(self):
+        return self.sample_every > 0 and next(self._counter) % self.sample_every == 0
+
+    def busy(self):
+        return self._lock.locked()
+
+    def profile(self, label="", sampled=False, timings=None):
+        """
+        Context manager -> ProfileRun; profiles the block and writes <out_dir>/<id>/.
+        timings: the request's StageTimings, saved with the profile in meta.json
+        """
+        return _Profiling(self, label, sampled, timings)
+
+    def _new_id(self):
+        return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+    def _write(self, run, prof, cprof, timings):
+        path = self.out_dir / run.id
+        path.mkdir(parents=True, exist_ok=True)
+        prof.export_chrome_trace(str(path / "trace.json"))
+
+        sort_key = "self_cuda_time_total" if self.cuda else "self_cpu_time_total"
+        averages = prof.key_averages()
+        (path / "ops.txt").write_text(averages.table(sort_by=sort_key, row_limit=self.top_n))
+        top = sorted(averages, key=lambda e: e.self_cpu_time_total, reverse=True)[:self.top_n]
+        for evt in top:
+            row = {"name": evt.key, "calls": evt.count, "self_cpu_ms": round(evt.self_cpu_time_total / 1000.0, 3),
+                   "cpu_total_ms": round(evt.cpu_time_total / 1000.0, 3)}
+            if self.cuda:
+                row["self_cuda_ms"] = _device_ms(evt, "self_cuda_time_total")
+            run.top_ops.append(row)
+
+        out = io.StringIO()
+        stats = pstats.Stats(cprof, stream=out)
+        stats.sort_stats("cumulative").print_stats(self.top_n)
+        (path / "python.txt").write_text(out.getvalue())
+        rows = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:self.top_n]
+        run.top_python = [{"function": f"{os.path.basename(file)}:{line}({func})", "calls": nc,
+                           "tottime_ms": round(tt * 1000, 3), "cumtime_ms": round(ct * 1000, 3)}
+                          for (file, line, func), (_, nc, tt, ct, _) in rows]
+
+        meta = {"id": run.id, "label": run.label, "sampled": run.sampled, "wall_ms": run.wall_ms,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "cuda": self.cuda,
+                "stages_ms": {k: round(v * 1000, 3) for k, v in timings.stages.items()} if timings else {}}
+        (path / "meta.json").write_text(json.dumps(meta, indent=2))
+        self._rotate(keep=run.id)
+
+    def _rotate(self, keep=None):
+        # oldest first until the directory fits max_bytes (the newest profile is always kept)
+        with self._rotate_lock:
+            entries = sorted((p for p in self.out_dir.iterdir() if p.is_dir() and _ID_RE.match(p.name)),
+                             key=lambda p: p.name)
+            sizes = {p.name: _dir_size(p) for p in entries}
+            total = sum(sizes.values())
+            for p in entries:
+                if total <= self.max_bytes:
+                    break
+                if p.name == keep:
+                    continue
+                shutil.rmtree(p, ignore_errors=True)
+                total -= sizes[p.name]
+
+    def list(self):
+        if not self.out_dir.is_dir():
+            return []
+        out = []
+        for p in sorted(self.out_dir.iterdir(), key=lambda p: p.name, reverse=True):
+            if not (p.is_dir() and _ID_RE.match(p.name)):
+                continue
+            try:
+                meta = json.loads((p / "meta.json").read_text())
+            except (OSError, ValueError):
+                meta = {"id": p.name}
+            meta["bytes"] = _dir_size(p)
+            out.append(meta)
+        return out
+
+    def path(self, profile_id, name):
+        """-> Path of one profile file, or None (unknown id / file name)."""
+        if not _ID_RE.match(profile_id) or name not in FILES:
+            return None
+        path = self.out_dir / profile_id / name
+        return path if path.is_file() else None
+
+    def stats(self):
+        profiles = self.list()
+        return {"dir": str(self.out_dir), "profiles": len(profiles), "bytes": sum(p["bytes"] for p in profiles),
+                "max_bytes": self.max_bytes, "sample_every": self.sample_every}
+
+
+class _Profiling:
+    def __init__(self, profiler, label, sampled, timings):
+        self.profiler = profiler
+        self.run = ProfileRun(profiler._new_id(), label, sampled)
+        self.timings = timings
+
+    def __enter__(self):
+        p = self.profiler
+        p._lock.acquire()
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if p.cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.prof = torch.profiler.profile(activities=activities, record_shapes=True)
+        self.cprof = cProfile.Profile()
+        self.prof.__enter__()
+        self.cprof.enable()
+        self.start = time.perf_counter()
+        return self.run
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.run.wall_ms = round(1000 * (time.perf_counter() - self.start), 3)
+            self.cprof.disable()
+            self.prof.__exit__(exc_type, exc, tb)
+            if exc_type is None:
+                self.profiler._write(self.run, self.prof, self.cprof, self.timings)
+        finally:
+            self.profiler._lock.release()
+        return False
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Calibrate reduced-precision modes for MultiTaskNet and write the agreement report
+the server checks before enabling INFERENCE_PRECISION.
+
+For every mode the report records argmax agreement, max softmax-probability delta and
+thresholded mask IoU against fp32 on a folder of fundus images; a mode passes only if all three
+are within their limits. static_int8 is calibrated on the same folder and saved next to the
+checkpoint ("staged" in the report: whether it kept encode / classify / segment).
+
+Usage:
+    python quantize_model.py calibrate --images path/to/fundus [--modes dynamic_int8 static_int8 bf16 channels_last]
+                                       [--threshold 0.99] [--max-prob-delta 0.02] [--min-mask-iou 0.9]
+                                       [--max-images 256] [--batch-size 8]
+"""
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+import app_pytorch_inference as srv
+from precision import MODES, agreement_report, apply_precision, build_static_int8, gate, is_staged, save_static_int8
+
+
+def _load_batches(folder, max_images, batch_size):
+    paths = sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in srv.IMAGE_EXTENSIONS)[:max_images]
+    if not paths:
+        raise SystemExit(f"no images found in {folder}")
+    tensors = []
+    for p in paths:
+        with open(p, "rb") as fh:
+            tensors.append(srv.pil_to_tensor_for_model(srv._load_pil_resized(fh)).cpu())
+    return [torch.cat(tensors[i:i + batch_size]) for i in range(0, len(tensors), batch_size)]
+
+
+def _latency_ms(model, batch, iters=5):
+    with torch.inference_mode():
+        model(batch)
+        t0 = time.perf_counter()
+        for _ in range(iters):
+            model(batch)
+    return (time.perf_counter() - t0) * 1000.0 / iters / batch.shape[0]
+
+
+def cmd_calibrate(args):
+    if srv.DEVICE != "cpu":
+        print("warning: precision modes target CPU; calibrating on CPU copies anyway")
+    srv.load_model()
+    fp32 = srv._model.cpu() if srv.DEVICE != "cpu" else srv._model
+    batches = _load_batches(args.images, args.max_images, args.batch_size)
+    print(f"{sum(b.shape[0] for b in batches)} images from {args.images}")
+
+    report = {"model_id": srv._model_id, "threshold": args.threshold, "max_prob_delta": args.max_prob_delta,
+              "min_mask_iou": args.min_mask_iou, "images_dir": str(args.images), "modes": {}}
+    ref_ms = _latency_ms(fp32, batches[0])
+    print(f"{'mode':<15}{'agree':>8}{'maxΔp':>9}{'IoU':>8}{'ms/img':>9}{'speedup':>9}  status")
+    print(f"{'fp32':<15}{1.0:>8.4f}{0.0:>9.4f}{1.0:>8.3f}{ref_ms:>9.2f}{1.0:>9.2f}  reference")
+
+    for mode in args.modes:
+        try:
+            if mode == "static_int8":
+                qmodel = build_static_int8(fp32, batches)
+                save_static_int8(qmodel, srv.STATIC_INT8_PATH, srv.IMG_SIZE)
+                candidate = apply_precision(mode, fp32, static_int8_path=srv.STATIC_INT8_PATH)
+            else:
+                candidate = apply_precision(mode, fp32)
+            entry = agreement_report(fp32, candidate, batches)
+            entry["ms_per_image"] = _latency_ms(candidate, batches[0])
+            entry["staged"] = is_staged(candidate)
+        except Exception as e:
+            print(f"{mode:<15} failed: {e}")
+            report["modes"][mode] = {"error": str(e), "argmax_agreement": 0.0, "passed": False}
+            continue
+        entry["passed"], reason = gate(entry, args.threshold, args.max_prob_delta, args.min_mask_iou)
+        report["modes"][mode] = entry
+        print(f"{mode:<15}{entry['argmax_agreement']:>8.4f}{entry['max_prob_delta']:>9.4f}{entry['mask_iou_mean']:>8.3f}"
+              f"{entry['ms_per_image']:>9.2f}{ref_ms / entry['ms_per_image']:>9.2f}  "
+              f"{'ok' if entry['passed'] else 'REFUSED (' + reason + ')'}"
+              f"{'' if entry['staged'] else ', runs the full decoder on every request'}")
+
+    with open(srv.PRECISION_REPORT_PATH, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print("report ->", srv.PRECISION_REPORT_PATH)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["calibrate"])
+    parser.add_argument("--images", required=True)
+    parser.add_argument("--modes", nargs="+", default=[m for m in MODES if m != "fp32"], choices=[m for m in MODES if m != "fp32"])
+    parser.add_argument("--threshold", type=float, default=srv.PRECISION_MIN_AGREEMENT, help="min argmax agreement")
+    parser.add_argument("--max-prob-delta", type=float, default=srv.PRECISION_MAX_PROB_DELTA)
+    parser.add_argument("--min-mask-iou", type=float, default=srv.PRECISION_MIN_MASK_IOU, help="min mean mask IoU")
+    parser.add_argument("--max-images", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+    return cmd_calibrate(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# render.py
+"""
+Heatmap / mask overlay kernels in uint8 fixed point, shared by both Flask apps.
+- JET colormap as a precomputed RGB lookup table (the colors of cv2.COLORMAP_JET after
+  BGR->RGB), pre-multiplied by the blend weight once per alpha
+- Blends compute (rgb * (256 - a) + color * a + 128) >> 8 with a = round(alpha * 256) in uint16,
+  within 1 of the float blends they replace
+- Scratch and output arrays come from per-thread buffers reused across calls of the same shape:
+  a returned array is only valid until the next call of the same kernel on the same thread
+  (pass out= to keep it)
+- Frames may carry leading batch dimensions: (..., H, W, 3) images with (..., H, W) CAMs / masks
+"""
+import threading
+
+import numpy as np
+import cv2
+
+HEATMAP_ALPHA = 0.4
+MASK_ALPHA = 0.5
+RED = (255, 0, 0)
+
+_JET_RGB = cv2.cvtColor(cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_JET),
+                        cv2.COLOR_BGR2RGB).reshape(256, 3)
+_weighted_luts = {}
+_local = threading.local()
+
+
+def _weight(alpha):
+    return int(round(min(max(alpha, 0.0), 1.0) * 256))
+
+
+def _weighted_lut(alpha):
+    # color * a + 128 (rounding term folded in); max 255 * 256 + 128 fits uint16 with the image term
+    a = _weight(alpha)
+    lut = _weighted_luts.get(a)
+    if lut is None:
+        lut = (_JET_RGB.astype(np.uint16) * a + 128).astype(np.uint16)
+        _weighted_luts[a] = lut
+    return lut
+
+
+def _buffer(name, shape, dtype):
+    buffers = getattr(_local, "buffers", None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    key = (name, shape, np.dtype(dtype).str)
+    buf = buffers.get(key)
+    if buf is None:
+        buf = buffers[key] = np.empty(shape, dtype=dtype)
+    return buf
+
+
+def cam_to_uint8(cam, out=None):
+    """CAM values in [0, 1] -> uint8 colormap indices (clipped, truncated like astype)."""
+    cam = np.asarray(cam)
+    if cam.dtype == np.uint8:
+        return cam
+    if out is None:
+        out = _buffer("cam_u8", cam.shape, np.uint8)
+    scratch = _buffer("cam_f32", cam.shape, np.float32)
+    np.clip(cam, 0, 1, out=scratch)
+    np.multiply(scratch, 255, out=scratch)
+    np.copyto(out, scratch, casting="unsafe")
+    return out
+
+
+def heatmap_overlay(rgb, cam, alpha=HEATMAP_ALPHA, out=None):
+    """
+    rgb: (..., H, W, 3) uint8; cam: (..., H, W) float in [0, 1] or uint8 colormap indices
+    -> (..., H, W, 3) uint8 JET heatmap blended over rgb with weight alpha.
+    """
+    rgb = np.asarray(rgb, dtype=np.uint8)
+    idx = cam_to_uint8(cam)
+    acc = _buffer("heat_acc", rgb.shape, np.uint16)
+    color = _buffer("heat_color", rgb.shape, np.uint16)
+    if out is None:
+        out = _buffer("heat_out", rgb.shape, np.uint8)
+    np.multiply(rgb, np.uint16(256 - _weight(alpha)), out=acc)
+    # mode="clip": indices are uint8, and it keeps take() from buffering the output
+    np.take(_weighted_lut(alpha), idx, axis=0, out=color, mode="clip")
+    np.add(acc, color, out=acc)
+    np.right_shift(acc, 8, out=acc)
+    np.copyto(out, acc, casting="unsafe")
+    return out
+
+
+def red_mask_overlay(rgb, mask, alpha=MASK_ALPHA, out=None, color=RED):
+    """
+    rgb: (..., H, W, 3) uint8; mask: (..., H, W), pixels > 0 are tinted
+    -> (..., H, W, 3) uint8, color blended with weight alpha on the mask, rgb elsewhere.
+    """
+    rgb = np.asarray(rgb, dtype=np.uint8)
+    a = _weight(alpha)
+    acc = _buffer("mask_acc", rgb.shape, np.uint16)
+    where = _buffer("mask_where", np.shape(mask), np.bool_)
+    if out is None:
+        out = _buffer("mask_out", rgb.shape, np.uint8)
+    np.multiply(rgb, np.uint16(256 - a), out=acc)
+    np.add(acc, np.asarray(color, dtype=np.uint16) * a + 128, out=acc)
+    np.right_shift(acc, 8, out=acc)
+    np.greater(mask, 0, out=where)
+    np.copyto(out, rgb)
+    np.copyto(out, acc, casting="unsafe", where=where[..., None])
+    return out
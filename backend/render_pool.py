@@ -0,0 +1,182 @@
+# render_pool.py
+"""
+Heatmap / mask overlay rendering and encoding, optionally in a pool of worker processes.
+- Overlay kernels from render.py (uint8 fixed point), also used for in-thread rendering
+- Inputs travel through fixed shared-memory slots (RGB image, CAM, mask); only the slot
+  index, a few flags and the encoded bytes cross the process boundary
+- Acquiring a slot blocks while every slot is in use (backpressure on the render stage)
+- Workers are spawned rather than forked, and recreated lazily after the parent forks
+"""
+import os
+import queue
+import threading
+import traceback
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import cv2
+from PIL import Image
+
+from artifact_codec import encode_image
+from render import heatmap_overlay, red_mask_overlay
+
+
+# ---------------- Kernels ----------------
+def normalize_cam(cam, size):
+    """Any CAM array -> (size, size) float32 in [0, 1] (all zeros when the CAM is empty)."""
+    cam_np = np.squeeze(np.array(cam))
+    if cam_np.ndim == 3:
+        cam_np = cam_np[0]
+
+    cam_np = cam_np.astype(np.float32)
+    if cam_np.max() > 0:
+        cam_np = (cam_np - cam_np.min()) / (cam_np.max() - cam_np.min() + 1e-8)
+    else:
+        cam_np = np.zeros((size, size), dtype=np.float32)
+
+    if cam_np.shape != (size, size):
+        cam_np = cv2.resize(cam_np, (size, size))
+    return cam_np
+
+
+def render_heatmap(rgb, cam, encoding, normalized=False):
+    # the kernels return per-thread buffers; Image.fromarray copies RGB frames before encoding
+    cam_np = cam if normalized else normalize_cam(cam, rgb.shape[0])
+    return encode_image(Image.fromarray(heatmap_overlay(rgb, cam_np)), encoding)
+
+
+def render_mask(rgb, mask_uint8, encoding):
+    # mask_uint8 None (Normal prediction) or empty -> the clean image
+    if mask_uint8 is not None and mask_uint8.max() > 0:
+        return encode_image(Image.fromarray(red_mask_overlay(rgb, mask_uint8)), encoding)
+    return encode_image(Image.fromarray(rgb), encoding)
+
+
+# ---------------- Worker side ----------------
+_worker_shm = None
+_worker_slots = None
+
+
+def _slot_views(buf, size, n_slots):
+    """[(rgb, cam, mask)] numpy views, one tuple per slot, over a shared buffer."""
+    rgb_bytes = size * size * 3
+    cam_bytes = size * size * 4
+    slot_bytes = rgb_bytes + cam_bytes + size * size
+    views = []
+    for i in range(n_slots):
+        base = i * slot_bytes
+        rgb = np.ndarray((size, size, 3), dtype=np.uint8, buffer=buf, offset=base)
+        cam = np.ndarray((size, size), dtype=np.float32, buffer=buf, offset=base + rgb_bytes)
+        mask = np.ndarray((size, size), dtype=np.uint8, buffer=buf, offset=base + rgb_bytes + cam_bytes)
+        views.append((rgb, cam, mask))
+    return views
+
+
+def _slot_nbytes(size, n_slots):
+    return n_slots * size * size * 8
+
+
+def _worker_init(shm_name, size, n_slots):
+    global _worker_shm, _worker_slots
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        # the parent owns the block; keep this process's tracker from unlinking it on exit
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(_worker_shm._name, "shared_memory")
+    except Exception:
+        pass
+    _worker_slots = _slot_views(_worker_shm.buf, size, n_slots)
+
+
+def _render_slot(slot, kind, encoding, flag):
+    # flag: heatmap -> CAM already normalized; mask -> mask present (False = clean image)
+    rgb, cam, mask = _worker_slots[slot]
+    if kind == "heatmap":
+        return render_heatmap(rgb, cam, encoding, normalized=flag)
+    return render_mask(rgb, mask if flag else None, encoding)
+
+
+# ---------------- Parent side ----------------
+class RenderPool:
+    """
+    processes: worker process count; slots: shared-memory slots (default 4 per process),
+    i.e. the number of renders that can be queued or running at once.
+    """
+
+    def __init__(self, processes, img_size, slots=None):
+        self.processes = max(1, int(processes))
+        self.img_size = int(img_size)
+        self.n_slots = int(slots or self.processes * 4)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._shm = None
+        self._slots = None
+        self._free = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # a forked child must not reuse the parent's workers or slots
+            self._shm = shared_memory.SharedMemory(create=True, size=_slot_nbytes(self.img_size, self.n_slots))
+            self._slots = _slot_views(self._shm.buf, self.img_size, self.n_slots)
+            self._free = queue.Queue()
+            for i in range(self.n_slots):
+                self._free.put(i)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=mp.get_context("spawn"),
+                initializer=_worker_init, initargs=(self._shm.name, self.img_size, self.n_slots))
+            self._pid = os.getpid()
+
+    def _run(self, rgb, kind, encoding, fill):
+        self._ensure_started()
+        slot = self._free.get()
+        try:
+            slot_rgb, slot_cam, slot_mask = self._slots[slot]
+            np.copyto(slot_rgb, rgb)
+            flag = fill(slot_cam, slot_mask)
+            return self._executor.submit(_render_slot, slot, kind, encoding, flag).result()
+        finally:
+            self._free.put(slot)
+
+    def heatmap(self, rgb, cam, encoding):
+        """Encoded heatmap overlay of rgb ((S, S, 3) uint8) with a raw grayscale CAM."""
+        def fill(slot_cam, _mask):
+            cam_np = np.squeeze(np.asarray(cam, dtype=np.float32))
+            if cam_np.ndim == 3:
+                cam_np = cam_np[0]
+            if cam_np.shape == slot_cam.shape:
+                # normalized by the worker
+                np.copyto(slot_cam, cam_np)
+                return False
+            np.copyto(slot_cam, normalize_cam(cam_np, self.img_size))
+            return True
+        return self._run(rgb, "heatmap", encoding, fill)
+
+    def mask(self, rgb, mask_uint8, encoding):
+        """Encoded red mask overlay (mask_uint8 None -> the clean image)."""
+        def fill(_cam, slot_mask):
+            if mask_uint8 is None:
+                return False
+            np.copyto(slot_mask, mask_uint8)
+            return True
+        return self._run(rgb, "mask", encoding, fill)
+
+    def close(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            try:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                # the numpy views must go before the mapping can be closed
+                self._slots = None
+                self._shm.close()
+                self._shm.unlink()
+            except Exception:
+                traceback.print_exc()
+            self._pid = None
@@ -0,0 +1,243 @@
+# result_cache.py
+"""
+Content-addressed cache for /predict responses.
+- Key: SHA-256 of the uploaded bytes + model checkpoint identity + request options
+- In-memory LRU tier bounded by a byte budget (values are stored as JSON bytes)
+- Optional on-disk tier (one JSON file per key, sharded by hash prefix), bounded by
+  disk_max_bytes: least recently used files are deleted first (order rebuilt from mtimes at
+  startup; with several processes sharing the directory each one enforces the cap on what it sees)
+- Single-flight: concurrent identical requests wait on one in-flight computation
+- Hit / miss / eviction counters via stats()
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def make_key(data, model_id, **options):
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(data).digest())
+    h.update(str(model_id).encode("utf-8"))
+    h.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_bytes)
+        self._lru = OrderedDict()
+        self._bytes = 0
+        # disk tier: key -> file size, least recently used first
+        self._disk_lru = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "inflight_waits": 0,
+            "evictions": 0,
+            "disk_evictions": 0,
+            "errors": 0,
+        }
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_scan()
+
+    # ---------- public API ----------
+    def get_or_compute(self, key, compute):
+        """
+        Return (value, status) where status is "hit", "disk", "wait" or "miss".
+        compute() must return a JSON-serializable value; it runs at most once per key
+        at a time, and exceptions are propagated to every waiter without being cached.
+        """
+        leader = False
+        with self._lock:
+            payload = self._lru.get(key)
+            if payload is not None:
+                self._lru.move_to_end(key)
+                self._counters["hits"] += 1
+                return json.loads(payload), "hit"
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self._counters["inflight_waits"] += 1
+            else:
+                fut = Future()
+                self._inflight[key] = fut
+                leader = True
+        if not leader:
+            return json.loads(fut.result()), "wait"
+
+        try:
+            payload = self._disk_get(key)
+            status = "disk"
+            if payload is None:
+                status = "miss"
+                payload = json.dumps(compute()).encode("utf-8")
+                self._disk_put(key, payload)
+        except BaseException as e:
+            with self._lock:
+                self._counters["errors"] += 1
+                self._inflight.pop(key, None)
+            fut.set_exception(e)
+            raise
+
+        with self._lock:
+            self._counters["disk_hits" if status == "disk" else "misses"] += 1
+            self._put_locked(key, payload)
+            self._inflight.pop(key, None)
+        fut.set_result(payload)
+        return json.loads(payload), status
+
+    def get(self, key):
+        """Cached value (memory, then disk) or None; never computes."""
+        with self._lock:
+            payload = self._lru.get(key)
+            if payload is not None:
+                self._lru.move_to_end(key)
+                self._counters["hits"] += 1
+                return json.loads(payload)
+        payload = self._disk_get(key)
+        if payload is None:
+            return None
+        with self._lock:
+            self._counters["disk_hits"] += 1
+            self._put_locked(key, payload)
+        return json.loads(payload)
+
+    def put(self, key, value):
+        """Store a value computed outside get_or_compute (e.g. by a background job)."""
+        payload = json.dumps(value).encode("utf-8")
+        self._disk_put(key, payload)
+        with self._lock:
+            self._put_locked(key, payload)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._counters)
+            out.update({
+                "entries": len(self._lru),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "inflight": len(self._inflight),
+                "disk_dir": self.disk_dir,
+                "disk_entries": len(self._disk_lru),
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+            })
+        return out
+
+    # ---------- memory tier ----------
+    def _put_locked(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return
+        old = self._lru.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._lru[key] = payload
+        self._bytes += len(payload)
+        while self._bytes > self.max_bytes and self._lru:
+            _, evicted = self._lru.popitem(last=False)
+            self._bytes -= len(evicted)
+            self._counters["evictions"] += 1
+
+    # ---------- disk tier ----------
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def _disk_scan(self):
+        entries = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name[:-len(".json")], st.st_size))
+        with self._lock:
+            for _, key, size in sorted(entries):
+                self._disk_lru[key] = size
+                self._disk_bytes += size
+            victims = self._disk_evict_locked()
+        self._disk_remove(victims)
+
+    def _disk_evict_locked(self, keep=None):
+        # -> keys to delete so the disk tier fits disk_max_bytes (oldest use first)
+        victims = []
+        for key in list(self._disk_lru):
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            if key == keep:
+                continue
+            self._disk_bytes -= self._disk_lru.pop(key)
+            self._counters["disk_evictions"] += 1
+            victims.append(key)
+        return victims
+
+    def _disk_remove(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as fh:
+                payload = fh.read()
+        except OSError:
+            return None
+        with self._lock:
+            if key in self._disk_lru:
+                self._disk_lru.move_to_end(key)
+            else:
+                # written by another process sharing the directory
+                self._disk_lru[key] = len(payload)
+                self._disk_bytes += len(payload)
+        try:
+            # keeps the use order across restarts
+            os.utime(path, (time.time(), time.time()))
+        except OSError:
+            pass
+        return payload
+
+    def _disk_put(self, key, payload):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write-then-rename so readers never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(payload)
+            os.replace(tmp, path)
+        except OSError as e:
+            print("Result cache disk write failed:", e)
+            return
+        with self._lock:
+            self._disk_bytes += len(payload) - self._disk_lru.pop(key, 0)
+            self._disk_lru[key] = len(payload)
+            victims = self._disk_evict_locked(keep=key)
+        self._disk_remove(victims)
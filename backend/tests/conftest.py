@@ -0,0 +1,29 @@
+# tests/conftest.py
+"""
+Shared setup for the backend tests (run from backend/: python -m pytest -q tests).
+The server module writes its SQLite log, artifacts and profiles at import time, so those
+are pointed at a throwaway directory before any test imports app_pytorch_inference.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _BACKEND not in sys.path:
+    sys.path.insert(0, _BACKEND)
+
+_SCRATCH = tempfile.mkdtemp(prefix="eye-backend-tests-")
+os.environ.setdefault("LOG_DB_PATH", "sqlite:///" + os.path.join(_SCRATCH, "predictions.db"))
+os.environ.setdefault("ARTIFACT_DIR", os.path.join(_SCRATCH, "artifacts"))
+os.environ.setdefault("PROFILE_DIR", os.path.join(_SCRATCH, "profiles"))
+
+
+@pytest.fixture(scope="session")
+def srv():
+    """The PyTorch server module (skips when its dependencies are not installed)."""
+    for module in ("torch", "torchvision", "cv2", "flask", "flask_cors", "sqlalchemy", "pandas"):
+        pytest.importorskip(module)
+    import app_pytorch_inference
+    return app_pytorch_inference
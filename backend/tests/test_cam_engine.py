@@ -0,0 +1,96 @@
+# tests/test_cam_engine.py
+"""Single-pass Grad-CAM (cam_engine) vs pytorch-grad-cam, and batched vs per-image post-processing."""
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("cv2")
+
+from cam_engine import CamEngine, _postprocess, _postprocess_batched  # noqa: E402
+
+ATOL = 1e-4
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_postprocess_batched_matches_per_image(seed):
+    rng = np.random.default_rng(seed)
+    b, k, c, h, w = (int(v) for v in rng.integers([1, 1, 4, 4, 4], [5, 5, 64, 12, 12]))
+    activations = rng.standard_normal((b, c, h, w)).astype(np.float32)
+    grads = rng.standard_normal((k, b, c, h, w)).astype(np.float32)
+
+    batched = _postprocess_batched(activations, grads, (224, 224))
+    ref = np.stack([_postprocess(activations, grads[slot], (224, 224)) for slot in range(k)], axis=1)
+
+    assert batched.shape == ref.shape == (b, k, 224, 224)
+    np.testing.assert_allclose(batched, ref, atol=ATOL, rtol=0)
+
+
+@pytest.fixture(scope="module")
+def model(srv):
+    torch.manual_seed(0)
+    return srv.MultiTaskNet(num_classes=srv.NUM_CLASSES).eval()
+
+
+def test_single_pass_matches_pytorch_grad_cam(srv, model):
+    grad_cam = pytest.importorskip("pytorch_grad_cam")
+    from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
+
+    target = srv._find_target_conv(model)
+    x = torch.randn(2, 3, srv.IMG_SIZE, srv.IMG_SIZE, generator=torch.Generator().manual_seed(1))
+    size = (srv.IMG_SIZE, srv.IMG_SIZE)
+
+    engine = CamEngine(model, target)
+    cls_logits, _, cams = engine(x, out_size=size)
+    assert not engine.hooked
+
+    library = grad_cam.GradCAM(model=srv.ClassificationOnlyWrapper(model), target_layers=[target])
+    for row in range(x.shape[0]):
+        pred_idx = int(cls_logits[row].argmax())
+        ref = library(input_tensor=x[row:row + 1].clone(), targets=[ClassifierOutputTarget(pred_idx)])[0]
+        np.testing.assert_allclose(cams[row], ref, atol=ATOL, rtol=0)
+
+
+def test_multi_matches_one_call_per_class(srv, model):
+    target = srv._find_target_conv(model)
+    x = torch.randn(2, 3, srv.IMG_SIZE, srv.IMG_SIZE, generator=torch.Generator().manual_seed(2))
+    size = (srv.IMG_SIZE, srv.IMG_SIZE)
+
+    engine = CamEngine(model, target)
+    cls_logits, _, cams = engine.multi(x, out_size=size, with_argmax=True)
+    assert cams.shape == (2, srv.NUM_CLASSES + 1) + size
+    for k in range(srv.NUM_CLASSES):
+        _, _, ref = engine(x, target_idx=k, out_size=size)
+        np.testing.assert_allclose(cams[:, k + 1], ref, atol=ATOL, rtol=0)
+    _, _, argmax_ref = engine(x, out_size=size)
+    np.testing.assert_allclose(cams[:, 0], argmax_ref, atol=ATOL, rtol=0)
+
+
+def test_pending_cam_finishes_on_another_thread(srv, model):
+    import threading
+
+    target = srv._find_target_conv(model)
+    x = torch.randn(2, 3, srv.IMG_SIZE, srv.IMG_SIZE, generator=torch.Generator().manual_seed(3))
+    size = (srv.IMG_SIZE, srv.IMG_SIZE)
+
+    engine = CamEngine(model, target, max_concurrency=1)
+    ref_cls, _, ref_cams = engine(x, out_size=size)
+
+    released = []
+    pending = engine.start(x)
+    pending.on_release = lambda: released.append(True)
+    assert not engine.hooked
+    torch.testing.assert_close(pending.cls_logits, ref_cls)
+
+    result = {}
+    worker = threading.Thread(target=lambda: result.update(out=pending.finish(out_size=size)))
+    worker.start()
+    worker.join()
+    np.testing.assert_allclose(result["out"][2], ref_cams, atol=ATOL, rtol=0)
+    assert released == [True]
+
+    # the slot is free again, and a second finish / cancel is refused / a no-op
+    engine.start(x).cancel()
+    with pytest.raises(RuntimeError):
+        pending.finish(out_size=size)
+    pending.cancel()
+    assert released == [True]
@@ -0,0 +1,73 @@
+# tests/test_preprocess.py
+"""Preprocessor (draft decode + LUT normalization) vs the Image.open().resize() + build_preprocess() pipeline."""
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+from PIL import Image, ImageDraw  # noqa: E402
+
+# tolerances of preprocess_parity.py
+LUT_ATOL = 1e-5
+MEAN_STEPS = 1.5
+P99_STEPS = 14.0
+
+
+def _fundus(width, height, seed=0):
+    """Synthetic fundus-like RGB image: an orange disc crossed by thin dark vessels."""
+    rng = np.random.default_rng(seed)
+    img = Image.new("RGB", (width, height))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse([width * 0.05, height * 0.05, width * 0.95, height * 0.95], fill=(180, 80, 30))
+    for _ in range(40):
+        points = [tuple(rng.uniform(0.1, 0.9, 2) * (width, height)) for _ in range(4)]
+        draw.line(points, fill=(90, 20, 10), width=int(rng.integers(2, 10)))
+    return img
+
+
+@pytest.fixture(params=[("JPEG", (1600, 1200)), ("JPEG", (2000, 2000)), ("JPEG", (3000, 2000)),
+                        ("PNG", (1600, 1200)), ("PNG", (300, 300))],
+                ids=lambda p: f"{p[0].lower()}-{p[1][0]}x{p[1][1]}")
+def upload(request, tmp_path):
+    fmt, size = request.param
+    path = tmp_path / ("fundus.jpg" if fmt == "JPEG" else "fundus.png")
+    _fundus(*size).save(path, fmt, **({"quality": 92} if fmt == "JPEG" else {}))
+    return path
+
+
+def _reference(srv, path):
+    pil = Image.open(path).convert("RGB").resize((srv.IMG_SIZE, srv.IMG_SIZE))
+    return pil, srv.build_preprocess()(pil).numpy()
+
+
+def _fast(srv, path):
+    with open(path, "rb") as fh:
+        pil = srv._preprocessor.decode(fh)
+    return pil, srv._preprocessor.to_tensor(pil)[0].numpy()
+
+
+def test_lut_matches_build_preprocess(srv, upload):
+    fast_pil, fast = _fast(srv, upload)
+    np.testing.assert_allclose(fast, srv.build_preprocess()(fast_pil).numpy(), atol=LUT_ATOL, rtol=0)
+
+
+def test_draft_decode_within_tolerance(srv, upload):
+    import preprocess_parity
+
+    scale_ok, drafted, full = preprocess_parity.draft_scale_ok(upload)
+    assert scale_ok, f"{full} drafted to {drafted}"
+    if upload.suffix == ".jpg":
+        assert drafted != full
+    else:
+        assert drafted == full
+
+    fast_pil, fast = _fast(srv, upload)
+    ref_pil, ref = _reference(srv, upload)
+    assert fast.shape == ref.shape == (3, srv.IMG_SIZE, srv.IMG_SIZE)
+    # normalized difference back in 8-bit steps
+    std = np.asarray(srv.STD, dtype=np.float32)[:, None, None]
+    steps = np.abs(fast - ref) * std * 255.0
+    assert steps.mean() <= MEAN_STEPS
+    assert np.percentile(steps, 99) <= P99_STEPS
+    if upload.suffix == ".png":
+        # no draft: same decode and resize as the reference, only the normalization differs
+        np.testing.assert_array_equal(np.asarray(fast_pil), np.asarray(ref_pil))
@@ -0,0 +1,64 @@
+# tuning.py
+"""
+Machine-specific thread / worker settings written by `python autotune.py`.
+- machine_fingerprint: CPU model, logical CPU count and torch version a config was measured on
+- load_tuning: the "recommended" settings of a config file, or {} when it is missing, unreadable
+  or was tuned on a different machine type (so a copied file never mis-tunes a node)
+- apply_torch_threads: intra-op / inter-op thread counts (0 keeps torch's default)
+No torch import at module level: gunicorn.conf.py reads the worker settings from here too.
+"""
+import os
+import json
+import platform
+
+
+def _cpu_model():
+    try:
+        with open("/proc/cpuinfo") as fh:
+            for line in fh:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def machine_fingerprint():
+    try:
+        import torch
+        torch_version = torch.__version__
+    except Exception:
+        torch_version = None
+    return {"cpu_model": _cpu_model(), "cpu_count": os.cpu_count(), "machine": platform.machine(),
+            "torch": torch_version}
+
+
+def load_tuning(path):
+    """-> recommended settings dict (torch_threads, interop_threads, workers, threads) or {}."""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as fh:
+            config = json.load(fh)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring autotune config {path}: {e}")
+        return {}
+    tuned_on = config.get("machine", {})
+    here = machine_fingerprint()
+    if (tuned_on.get("cpu_model"), tuned_on.get("cpu_count")) != (here["cpu_model"], here["cpu_count"]):
+        print(f"Ignoring autotune config {path}: tuned on {tuned_on.get('cpu_model')} x{tuned_on.get('cpu_count')}, "
+              f"this machine is {here['cpu_model']} x{here['cpu_count']}; re-run python autotune.py")
+        return {}
+    return dict(config.get("recommended", {}))
+
+
+def apply_torch_threads(threads=0, interop_threads=0):
+    import torch
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if interop_threads > 0 and torch.get_num_interop_threads() != interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            # only settable before the first inter-op parallel work in this process
+            print("Could not set inter-op threads:", e)
@@ -0,0 +1,116 @@
+# weights.py
+"""
+Checkpoint loading and memory-mapped weights shared across worker processes.
+- normalize_state_dict: "model" / "model_state" / "model_state_dict" / "state_dict" probing
+  and "module." prefix stripping, for any checkpoint layout we have shipped
+- convert_checkpoint writes the normalized fp32 state_dict once, as a torch zipfile
+  (".mmap.pt") or safetensors (".safetensors", optional dependency), tagged with the source
+  checkpoint's SHA-256 so a stale conversion is never used
+- load_mapped maps that file read-only: torch.load(mmap=True) / safetensors, so every worker
+  shares the same page-cache pages; pair with load_state_dict(assign=True) to avoid a copy
+- memory_usage: RSS / PSS / shared / private MB of this process (Linux smaps_rollup)
+"""
+import os
+import tempfile
+from pathlib import Path
+
+import torch
+
+# tolerant import of safetensors (optional dependency)
+try:
+    from safetensors import safe_open
+    from safetensors.torch import save_file as safetensors_save_file
+except Exception:
+    safe_open = None
+    safetensors_save_file = None
+
+STATE_DICT_KEYS = ("model_state", "model_state_dict", "state_dict")
+FORMATS = ("torch", "safetensors")
+
+
+def normalize_state_dict(ckpt):
+    """Raw torch.load result -> flat state_dict without "module." prefixes."""
+    state = ckpt
+    if isinstance(ckpt, dict):
+        # Priority check for 'model' key which we know works
+        if 'model' in ckpt:
+            state = ckpt['model']
+        else:
+            for key in STATE_DICT_KEYS:
+                if key in ckpt:
+                    state = ckpt[key]
+                    break
+
+    # normalize keys (strip 'module.' if present)
+    if isinstance(state, dict):
+        state = {
+            (k.replace("module.", "") if isinstance(k, str) and k.startswith("module.") else k): v
+            for k, v in state.items()
+        }
+    return state
+
+
+def mapped_path(checkpoint_path, fmt="torch"):
+    checkpoint_path = Path(checkpoint_path)
+    return checkpoint_path.with_suffix(".safetensors" if fmt == "safetensors" else ".mmap.pt")
+
+
+def convert_checkpoint(src, dst, source_sha256, fmt="torch"):
+    """Write the normalized state_dict of checkpoint src to dst (atomically), tagged with source_sha256."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown weights format {fmt!r}; expected one of {FORMATS}")
+    if fmt == "safetensors" and safetensors_save_file is None:
+        raise RuntimeError("safetensors is not installed")
+    state = normalize_state_dict(torch.load(src, map_location="cpu"))
+    if not isinstance(state, dict):
+        raise ValueError("checkpoint does not contain a state_dict")
+    # contiguous, untied tensors so every entry maps to its own aligned record
+    state = {k: v.detach().contiguous().clone() for k, v in state.items() if torch.is_tensor(v)}
+
+    dst = Path(dst)
+    fd, tmp = tempfile.mkstemp(dir=str(dst.parent), prefix=dst.name + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        if fmt == "safetensors":
+            safetensors_save_file(state, tmp, metadata={"source_sha256": source_sha256})
+        else:
+            torch.save({"source_sha256": source_sha256, "state_dict": state}, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return dst
+
+
+def load_mapped(path):
+    """-> (state_dict of read-only mmap-backed CPU tensors, source_sha256)."""
+    path = Path(path)
+    if path.suffix == ".safetensors":
+        if safe_open is None:
+            raise RuntimeError("safetensors is not installed")
+        with safe_open(str(path), framework="pt", device="cpu") as fh:
+            source = (fh.metadata() or {}).get("source_sha256")
+            state = {k: fh.get_tensor(k) for k in fh.keys()}
+        return state, source
+    blob = torch.load(str(path), map_location="cpu", mmap=True, weights_only=True)
+    return blob["state_dict"], blob.get("source_sha256")
+
+
+def memory_usage():
+    """Resident / proportional set size of this process in MB (empty dict off Linux)."""
+    fields = {"Rss": "rss_mb", "Pss": "pss_mb", "Shared_Clean": "shared_clean_mb",
+              "Private_Clean": "private_clean_mb", "Private_Dirty": "private_dirty_mb"}
+    out = {}
+    try:
+        with open("/proc/self/smaps_rollup") as fh:
+            for line in fh:
+                parts = line.split()
+                key = parts[0].rstrip(":")
+                if key in fields:
+                    out[fields[key]] = round(int(parts[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return out
@@ -1,7 +1,7 @@
 import React from 'react';
 import { Download, Activity, FileText, Calendar, User } from 'lucide-react';
 import { generateReport } from '@/lib/generatereport'; // Importing your existing script
-import { PredictionResult } from '@/lib/api';
+import { PredictionResult, artifactDataUrl } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 
 interface ReportViewProps {
@@ -127,7 +127,7 @@ export const ReportView: React.FC<ReportViewProps> = ({ result, patientName, ori
                 <div className="space-y-2">
                   <div className="aspect-square bg-slate-100 rounded-lg overflow-hidden border border-slate-200">
                     <img 
-                      src={`data:image/png;base64,${result.heatmap_png_base64}`} 
+                      src={artifactDataUrl(result.heatmap_png_base64, result.artifact_format)} 
                       alt="AI Analysis" 
                       className="w-full h-full object-cover"
                     />
@@ -1,6 +1,7 @@
 import React from 'react';
 import { Download, Activity, FileText } from 'lucide-react';
 import { generateReport } from '@/lib/generatereport'; // Import your existing script
+import { artifactDataUrl } from '@/lib/api';
 
 interface ReportViewProps {
   result: any; // Replace 'any' with your PredictionResult type if available
@@ -74,7 +75,7 @@ export const ReportView: React.FC<ReportViewProps> = ({ result, patientName, ori
             {result.heatmap_png_base64 && (
               <div>
                 <p className="text-xs font-bold text-slate-400 uppercase mb-2">Lesion Heatmap</p>
-                <img src={`data:image/png;base64,${result.heatmap_png_base64}`} alt="Heatmap" className="w-full rounded-lg border border-slate-200" />
+                <img src={artifactDataUrl(result.heatmap_png_base64, result.artifact_format)} alt="Heatmap" className="w-full rounded-lg border border-slate-200" />
               </div>
             )}
           </div>
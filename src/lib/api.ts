@@ -1,8 +1,12 @@
 import axios from 'axios';
+import type { MaskPolygons, MaskRle } from './maskCodec';
 
 
 // ✅ CORRECT (Dynamic)
 const API_BASE_URL = import.meta.env.VITE_BACKEND_URL || 'http://localhost:8000';
+// Async /predict is opt-in: jobs live in one backend process, so /jobs/<id> must reach the worker
+// that accepted the upload (a single worker, or sticky routing in front of gunicorn).
+export const PREDICT_ASYNC = import.meta.env.VITE_PREDICT_ASYNC === '1';
 
 export const api = axios.create({
   baseURL: API_BASE_URL,
@@ -15,18 +19,55 @@ export interface PredictionResult {
   probabilities: Record<string, number>;
   confidence: number;
   heatmap_png_base64?: string;
+  mask_rle?: MaskRle;            // mask_format=rle
+  mask_polygons?: MaskPolygons;  // mask_format=polygon
+  artifact_format?: ArtifactFormat;  // encoding of heatmap/mask images (default png)
+  job_id?: string;               // async=1: heatmap/mask still being rendered
+  status?: JobStatus;
+  prediction_id?: number;
+  model_version?: string;        // <checkpoint>@<sha256 prefix> that produced the diagnosis
+  class_heatmaps_base64?: Record<string, string>;  // cam_classes=all|<label>,...: heatmap per class
+  error?: string;
 }
 
+export type JobStatus = 'running' | 'done' | 'error';
+
+export type ArtifactFormat = 'png' | 'webp' | 'jpeg';
+
+// data: URL for a base64 heatmap/mask image in whatever format the server encoded it
+export const artifactDataUrl = (b64: string, format: ArtifactFormat = 'png') =>
+  `data:image/${format};base64,${b64}`;
+
 export interface HistoryItem {
   id: number;
+  filename?: string;
   predicted_disease: string;
   confidence: number;
-  probabilities: string;  // stored as JSON string in DB
-  timestamp: string;      // must match backend field
+  probabilities: string | Record<string, number>;
+  timestamp?: string;     // TensorFlow backend (app.py)
+  created_at?: string;    // PyTorch backend (app_pytorch_inference.py)
+  model_version?: string; // PyTorch backend
+}
+
+export interface HistoryQuery {
+  cursor?: string;
+  limit?: number;
+  disease?: string;
+  min_confidence?: number;
+  max_confidence?: number;
+  from?: string;
+  to?: string;
+}
+
+export interface HistoryPage {
+  items: HistoryItem[];
+  next_cursor: string | null;
 }
 
 // Predict Image
-export const predictImage = async (file: File): Promise<PredictionResult> => {
+// async: the diagnosis comes back first with a job_id; follow it with subscribeJob / getJob.
+// Backends without async mode ignore the flag and return the full result.
+export const predictImage = async (file: File, options: { async?: boolean } = {}): Promise<PredictionResult> => {
   const formData = new FormData();
   formData.append('image', file);
 
@@ -34,21 +75,57 @@ export const predictImage = async (file: File): Promise<PredictionResult> => {
     headers: {
       'Content-Type': 'multipart/form-data',
     },
+    params: options.async ? { async: 1 } : undefined,
   });
 
   return response.data;
 };
 
-// Get History
-export const getHistory = async (): Promise<HistoryItem[]> => {
-  const response = await api.get('/history');
+// Async prediction job: everything produced so far
+export const getJob = async (jobId: string): Promise<PredictionResult> => {
+  const response = await api.get(`/jobs/${jobId}`);
+  return response.data;
+};
+
+// Stream an async job over server-sent events. onUpdate receives the fields of each event
+// (mask, heatmap, then done/error with a status). Returns a function that closes the stream.
+export const subscribeJob = (
+  jobId: string,
+  onUpdate: (fields: Partial<PredictionResult>) => void,
+): (() => void) => {
+  const source = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events`);
+  const forward = (status?: JobStatus) => (ev: MessageEvent) => {
+    const fields = JSON.parse(ev.data);
+    onUpdate(status ? { ...fields, status } : fields);
+    if (status) source.close();
+  };
+  source.addEventListener('mask', forward());
+  source.addEventListener('heatmap', forward());
+  source.addEventListener('done', forward('done'));
+  source.addEventListener('error', (ev) => {
+    // a server "error" event carries data; a bare transport error falls back to polling once
+    if (ev instanceof MessageEvent && ev.data) {
+      forward('error')(ev);
+      return;
+    }
+    source.close();
+    getJob(jobId).then(onUpdate).catch(() => onUpdate({ status: 'error', error: 'job stream lost' }));
+  });
+  return () => source.close();
+};
+
+// Get History (keyset-paginated: pass the previous page's next_cursor to scroll further)
+export const getHistory = async (query: HistoryQuery = {}): Promise<HistoryPage> => {
+  const response = await api.get('/history', { params: query });
 
-  // Backend returns an array, so just return response.data
+  // Paginated backends return { items, next_cursor }; older ones return a plain array
   if (Array.isArray(response.data)) {
+    return { items: response.data, next_cursor: null };
+  } else if (response.data && Array.isArray(response.data.items)) {
     return response.data;
   } else {
     console.error("Unexpected /history response:", response.data);
-    return [];
+    return { items: [], next_cursor: null };
   }
 };
 
@@ -7,6 +7,7 @@ interface PredictionResult {
   confidence: number; // 0..1
   probabilities: Record<string, number>;
   heatmap_png_base64?: string;
+  artifact_format?: "png" | "webp" | "jpeg"; // encoding of the heatmap (default png)
   // optionally other metadata
 }
 
@@ -102,7 +103,8 @@ function createReportDoc(result: PredictionResult, patientName: string): jsPDF {
       const imgW = imgMaxWidth;
       const imgH = imgMaxWidth; // square box; image will scale to fit
 
-      doc.addImage("data:image/png;base64," + result.heatmap_png_base64, "PNG", imgX, imgY, imgW, imgH);
+      const format = result.artifact_format ?? "png";
+      doc.addImage(`data:image/${format};base64,${result.heatmap_png_base64}`, format.toUpperCase(), imgX, imgY, imgW, imgH);
       // caption on the right
       const captionX = marginLeft + imgW + 6;
       const captionWidth = usableWidth - imgW - 6;
@@ -0,0 +1,92 @@
+// Compact segmentation masks returned by /predict?mask_format=rle|polygon.
+// Coordinates are in mask space ("size": [height, width]); they are scaled to
+// whatever canvas the original image is drawn on.
+
+export interface MaskRle {
+  size: [number, number];
+  order: 'row-major';
+  counts: number[]; // alternating runs, starting with 0s
+}
+
+// Lossy (rings through boundary pixel centres); RLE is the exact format
+export interface MaskPolygons {
+  size: [number, number];
+  polygons: [number, number][][];
+  holes?: [number, number][][]; // outlines of holes inside the polygons
+}
+
+// Paint an RLE mask as a translucent overlay on top of an already-drawn image
+export const drawMaskRle = (
+  ctx: CanvasRenderingContext2D,
+  mask: MaskRle,
+  width: number,
+  height: number,
+  color: [number, number, number] = [255, 0, 0],
+  alpha = 0.5,
+) => {
+  const [mh, mw] = mask.size;
+  const layer = new ImageData(mw, mh);
+  let pos = 0;
+  mask.counts.forEach((run, i) => {
+    if (i % 2 === 1) {
+      for (let p = pos; p < pos + run; p++) {
+        layer.data[p * 4] = color[0];
+        layer.data[p * 4 + 1] = color[1];
+        layer.data[p * 4 + 2] = color[2];
+        layer.data[p * 4 + 3] = Math.round(alpha * 255);
+      }
+    }
+    pos += run;
+  });
+  const tmp = document.createElement('canvas');
+  tmp.width = mw;
+  tmp.height = mh;
+  tmp.getContext('2d')?.putImageData(layer, 0, 0);
+  ctx.drawImage(tmp, 0, 0, width, height);
+};
+
+// Fill mask polygons minus their holes (even-odd rule, scaled from mask space to width x height)
+export const drawMaskPolygons = (
+  ctx: CanvasRenderingContext2D,
+  mask: MaskPolygons,
+  width: number,
+  height: number,
+  fill = 'rgba(255, 0, 0, 0.5)',
+) => {
+  const [mh, mw] = mask.size;
+  const sx = width / mw;
+  const sy = height / mh;
+  ctx.save();
+  ctx.fillStyle = fill;
+  ctx.beginPath();
+  for (const poly of [...mask.polygons, ...(mask.holes ?? [])]) {
+    if (poly.length < 3) continue;
+    ctx.moveTo(poly[0][0] * sx, poly[0][1] * sy);
+    for (let i = 1; i < poly.length; i++) ctx.lineTo(poly[i][0] * sx, poly[i][1] * sy);
+    ctx.closePath();
+  }
+  ctx.fill('evenodd');
+  ctx.restore();
+};
+
+// The image with a compact mask painted over it, as a PNG data URL (what mask_png_base64 shows)
+export const renderMaskOverlay = (imageUrl: string, mask: MaskRle | MaskPolygons): Promise<string> =>
+  new Promise((resolve, reject) => {
+    const img = new Image();
+    img.onload = () => {
+      const canvas = document.createElement('canvas');
+      canvas.width = img.naturalWidth;
+      canvas.height = img.naturalHeight;
+      const ctx = canvas.getContext('2d');
+      if (!ctx) {
+        reject(new Error('canvas 2d context unavailable'));
+        return;
+      }
+      ctx.drawImage(img, 0, 0);
+      if ('counts' in mask) drawMaskRle(ctx, mask, canvas.width, canvas.height);
+      else drawMaskPolygons(ctx, mask, canvas.width, canvas.height);
+      resolve(canvas.toDataURL('image/png'));
+    };
+    img.onerror = () => reject(new Error('could not load image for the mask overlay'));
+    img.src = imageUrl;
+  });
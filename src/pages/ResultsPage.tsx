@@ -23,7 +23,8 @@ import { Alert, AlertDescription } from "@/components/ui/alert";
 import { Badge } from "@/components/ui/badge";
 import { Separator } from "@/components/ui/separator";
 import { useLanguage } from "@/contexts/LanguageContext";
-import { PredictionResult } from "@/lib/api";
+import { PredictionResult, artifactDataUrl, subscribeJob } from "@/lib/api";
+import { renderMaskOverlay } from "@/lib/maskCodec";
 import ChatWidget from "@/components/ChatWidget";
 
 // --- NEW COMPONENTS ---
@@ -63,6 +64,7 @@ const ResultsPage: React.FC = () => {
   const [saved, setSaved] = useState(false);
   const [modalSrc, setModalSrc] = useState<string | null>(null);
   const [opacity, setOpacity] = useState<number>(0.55); // Heatmap opacity state
+  const [compactMaskSrc, setCompactMaskSrc] = useState<string | null>(null); // mask_format=rle|polygon
 
   useEffect(() => {
     const state = location.state as LocationState | undefined;
@@ -74,9 +76,30 @@ const ResultsPage: React.FC = () => {
     }
   }, [location.state, navigate]);
 
-  // Persist scan locally
+  // Async prediction: merge heatmap/mask into the result as the job produces them
+  const jobId = result?.status === "running" ? result.job_id : undefined;
   useEffect(() => {
-    if (!result || saved || !isLoaded) return; 
+    if (!jobId) return;
+    return subscribeJob(jobId, (fields) => setResult((prev) => (prev ? { ...prev, ...fields } : prev)));
+  }, [jobId]);
+
+  // mask_format=rle|polygon: paint the mask over the original image in the browser
+  const compactMask = result?.mask_rle ?? result?.mask_polygons;
+  useEffect(() => {
+    if (!compactMask || !imageUrl) {
+      setCompactMaskSrc(null);
+      return;
+    }
+    let cancelled = false;
+    renderMaskOverlay(imageUrl, compactMask)
+      .then((src) => { if (!cancelled) setCompactMaskSrc(src); })
+      .catch((err) => console.warn("Failed to render mask:", err));
+    return () => { cancelled = true; };
+  }, [compactMask, imageUrl]);
+
+  // Persist scan locally (once any async job has finished, so the images are included)
+  useEffect(() => {
+    if (!result || saved || !isLoaded || result.status === "running") return; 
     try {
       const rec = {
         id: uuidv4(),
@@ -84,8 +107,8 @@ const ResultsPage: React.FC = () => {
         imageDataUrl: imageUrl ?? "",
         prediction: result.predicted_disease ?? "unknown",
         probability: result.confidence ?? 0,
-        gradcamDataUrl: result.heatmap_png_base64 ? `data:image/png;base64,${result.heatmap_png_base64}` : undefined,
-        maskDataUrl: result.mask_png_base64 ? `data:image/png;base64,${result.mask_png_base64}` : undefined,
+        gradcamDataUrl: result.heatmap_png_base64 ? artifactDataUrl(result.heatmap_png_base64, result.artifact_format) : undefined,
+        maskDataUrl: result.mask_png_base64 ? artifactDataUrl(result.mask_png_base64, result.artifact_format) : undefined,
         notes: "",
       };
       
@@ -119,12 +142,12 @@ const ResultsPage: React.FC = () => {
   if (!val) return null;
   // If it's already a data URL, just return it
   if (val.startsWith("data:")) return val;
-  // Otherwise, treat it as raw base64
-  return `data:image/png;base64,${val}`;
+  // Otherwise, treat it as raw base64 in the format the server encoded it
+  return artifactDataUrl(val, result?.artifact_format);
 };
 
 const gradcamSrc = ensureDataUrl(result?.heatmap_png_base64 || null);
-const maskSrc = ensureDataUrl(result?.mask_png_base64 || null);
+const maskSrc = ensureDataUrl(result?.mask_png_base64 || null) ?? compactMaskSrc;
 
 
 
@@ -7,7 +7,7 @@ import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/com
 import { Alert, AlertDescription } from '@/components/ui/alert';
 import { useToast } from '@/hooks/use-toast';
 import { useLanguage } from '@/contexts/LanguageContext';
-import { predictImage, PredictionResult } from '@/lib/api';
+import { predictImage, PredictionResult, PREDICT_ASYNC } from '@/lib/api';
 import { useNavigate } from 'react-router-dom';
 // Import the SkeletonLoader component we created
 import { SkeletonLoader } from '@/components/SkeletonLoader';
@@ -50,7 +50,8 @@ const UploadPage = () => {
     setLoading(true);
     try {
       // Ensure file is passed correctly to API
-      const prediction = await predictImage(file);
+      // VITE_PREDICT_ASYNC=1: the diagnosis arrives first, heatmap/mask stream in on the results page
+      const prediction = await predictImage(file, { async: PREDICT_ASYNC });
       setResult(prediction);
       
       toast({